@@ -0,0 +1,44 @@
+"""
+Per-item JSON encode / decode time of realistic queue items for every installed codec.
+
+    python benchmarks/bench_json.py [nodes]
+"""
+
+import json
+import sys
+import time
+
+from harness import make_item, summarize
+
+from src.comfyui_queue_manager import qm_json
+
+
+def bench_codec(codec, item, rounds=2000):
+    qm_json.set_codec(codec)
+    encoded = qm_json.dumps(item)
+
+    encode = []
+    decode = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        qm_json.dumps(item)
+        encode.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        qm_json.loads(encoded)
+        decode.append(time.perf_counter() - start)
+
+    return [
+        {"benchmark": "json", "codec": codec, "operation": "encode", "bytes": len(encoded), **summarize(encode)},
+        {"benchmark": "json", "codec": codec, "operation": "decode", "bytes": len(encoded), **summarize(decode)},
+    ]
+
+
+if __name__ == "__main__":
+    nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    item = make_item(1, nodes=nodes)
+    for codec in ("json", "orjson", "msgspec"):
+        if codec != "json" and getattr(qm_json, codec) is None:
+            continue
+        for result in bench_codec(codec, item):
+            print(json.dumps(result))
@@ -0,0 +1,35 @@
+"""
+Time from task_done() of one job to queue_get() handing out the next one, for several prefetch windows
+and durability modes.
+
+    python benchmarks/bench_pickup.py [items]
+"""
+
+import json
+import sys
+import time
+
+from harness import make_item, make_queue, summarize
+
+
+def bench_pickup(items, prefetch, durability="strict"):
+    queue = make_queue({"pending_prefetch": prefetch, "durability": durability})
+    for number in range(items):
+        queue.queue_put(make_item(number))
+
+    samples = []
+    got = queue.queue_get(timeout=0.01)
+    while got is not None:
+        start = time.perf_counter()
+        queue.task_done(got[1], {}, None)
+        got = queue.queue_get(timeout=0.01)
+        samples.append(time.perf_counter() - start)
+
+    return {"benchmark": "pickup", "items": items, "prefetch": prefetch, "durability": durability, **summarize(samples[:-1])}
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for prefetch in (1, 16, 64):
+        print(json.dumps(bench_pickup(items, prefetch)))
+    print(json.dumps(bench_pickup(items, 16, "batched")))
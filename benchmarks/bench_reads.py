@@ -0,0 +1,95 @@
+"""
+Read throughput while items are written, for several sizes of the read connection pool.
+
+Reader threads list pages of the archive (summary columns, keyset pagination), count items matching a text filter
+(the LIKE fallback of the search filter, a scan which runs in SQLite without the GIL) and load full items straight
+through qm_db.read_query(), i.e. like the HTTP routes do from the executor threads, while a writer thread keeps
+importing items in batches and finishing jobs. With a single read connection the readers take turns, with a pool
+they read concurrently (WAL readers don't block each other or the writer), so reads scale with the CPU cores.
+
+    python benchmarks/bench_reads.py [items] [seconds]
+"""
+
+import json
+import sys
+import threading
+import time
+
+from harness import make_queue, summarize, synthetic_items, throughput
+
+from src.comfyui_queue_manager import qm_db
+from src.comfyui_queue_manager.qm_queue import SUMMARY_COLUMNS
+
+READERS = 4
+PAGE_SIZE = 100
+
+
+def reader(stop, samples, max_id):
+    cursor = ("", 0)
+    reads = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        rows = qm_db.read_query(
+            f"""
+            SELECT {SUMMARY_COLUMNS}, updated_at
+            FROM queue
+            WHERE status = 3 AND (updated_at, id) > (?, ?)
+            ORDER BY updated_at, id
+            LIMIT ?
+        """,
+            cursor + (PAGE_SIZE,),
+        )
+        cursor = (rows[-1]["updated_at"], rows[-1]["id"]) if len(rows) == PAGE_SIZE else ("", 0)
+        qm_db.read_single("SELECT COUNT(*) FROM queue WHERE status = 3 AND (name LIKE ? OR preview LIKE ?)", ("%7%", "%7%"))
+        qm_db.read_single("SELECT prompt FROM queue WHERE id = ?", ((reads * 7919) % max_id + 1,))
+        samples.append(time.perf_counter() - start)
+        reads += 1
+
+
+def writer(queue, stop, counts, start):
+    written = 0
+    number = start
+    while not stop.is_set():
+        written += queue.import_queue(synthetic_items(50, start=number), None, 0)[0]
+        number += 50
+        got = queue.queue_get(timeout=0.01)
+        if got is not None:
+            queue.task_done(got[1], {}, None)
+            written += 1
+    counts["written"] = written
+
+
+def bench_reads(items, seconds, read_connections):
+    queue = make_queue({"db_read_connections": read_connections})
+    queue.import_queue(synthetic_items(items), None, 3)
+    max_id = qm_db.read_single("SELECT MAX(id) FROM queue")[0]
+
+    stop = threading.Event()
+    counts = {}
+    samples = []
+    threads = [threading.Thread(target=reader, args=(stop, samples, max_id)) for _ in range(READERS)]
+    threads.append(threading.Thread(target=writer, args=(queue, stop, counts, items)))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "benchmark": "reads",
+        "items": items,
+        "readers": READERS,
+        "read_connections": read_connections,
+        "reads": {**throughput(len(samples), elapsed), **summarize(samples)},
+        "writes": throughput(counts["written"], elapsed),
+    }
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    for read_connections in (1, 2, 4, 8):
+        print(json.dumps(bench_reads(items, seconds, read_connections)))
@@ -0,0 +1,59 @@
+"""
+Throughput of a shared queue (QM_SHARED_QUEUE) with 1, 2 and 4 worker processes.
+
+The queue is filled, then worker processes (tests/shared_worker.py, stand-ins for ComfyUI instances) claim and run the
+items until none is left. Each item "executes" for a few milliseconds, like a prompt the GPU works on while the
+database isn't touched, so throughput scales with the workers until claims and results contend for the write lock.
+On a machine with fewer cores than workers the processes take turns and throughput doesn't scale.
+
+    python benchmarks/bench_shared.py [items] [seconds per item]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from harness import ROOT, make_queue, synthetic_items, throughput
+
+from src.comfyui_queue_manager import qm_db
+
+WORKER = os.path.join(ROOT, "tests", "shared_worker.py")
+
+
+def bench_shared(items, seconds, workers):
+    queue = make_queue()
+    queue.import_queue(synthetic_items(items), None, 0)
+    qm_db.get_writer().flush()
+
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen(
+            [sys.executable, WORKER, str(seconds)],
+            env={**os.environ, "QM_DB_PATH": str(qm_db.DB_PATH), "QM_SHARED_QUEUE": "1", "QM_WORKER_ID": f"bench-{i}"},
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for i in range(workers)
+    ]
+    ran = [len(json.loads(process.communicate()[0])) for process in processes]
+    # workers give up after waiting 0.5 s for an item
+    elapsed = time.perf_counter() - start - 0.5
+    queue.notifier.flush()
+
+    return {
+        "benchmark": "shared",
+        "items": items,
+        "seconds_per_item": seconds,
+        "workers": workers,
+        "per_worker": ran,
+        **throughput(sum(ran), elapsed),
+    }
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.005
+    for workers in (1, 2, 4):
+        print(json.dumps(bench_shared(items, seconds, workers)))
@@ -0,0 +1,128 @@
+"""
+Shared setup for benchmarks: runs the queue manager against a temporary database with stand-ins for
+ComfyUI's server and execution modules (see tests/stubs), so benchmarks can run without ComfyUI.
+"""
+
+import datetime
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+try:
+    import server  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.join(ROOT, "tests", "stubs"))
+
+from server import PromptServer  # noqa: E402
+
+
+def make_queue(options=None):
+    """
+    Fresh QM_Queue on a temporary database. Options are stored before the queue is created.
+    """
+    from src.comfyui_queue_manager import qm_db
+    from src.comfyui_queue_manager.qm_options import QM_Options
+    from src.comfyui_queue_manager.qm_queue import QM_Queue
+
+    qm_db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="qm-bench-"), "qm-queue.db")
+    qm_db.close_connections()
+    qm_db._pool = qm_db.QM_ReadPool()
+    qm_db._writer = qm_db.QM_Writer()
+    qm_db.init_schema()
+
+    PromptServer()
+
+    class QueueManager:
+        pass
+
+    manager = QueueManager()
+    manager.options = QM_Options()
+    for key, value in (options or {}).items():
+        manager.options.set(key, value)
+    manager.queue = QM_Queue(manager)
+    return manager.queue
+
+
+def make_item(number, workflow_id="workflow-a", nodes=60):
+    """
+    Queue item shaped like one queued from ComfyUI's frontend: API prompt plus the UI workflow graph.
+    """
+    prompt = {
+        str(i): {"class_type": "KSampler", "inputs": {"seed": number, "steps": 20, "cfg": 7.0, "model": [str(i + 1), 0]}}
+        for i in range(nodes)
+    }
+    workflow = {
+        "id": workflow_id,
+        "workflow_name": "Benchmark " + workflow_id,
+        "nodes": [
+            {"id": i, "type": "KSampler", "pos": [i * 10, i * 20], "size": [300, 200], "widgets_values": [number, "fixed", 20, 7.0]}
+            for i in range(nodes)
+        ],
+        "links": [[i, i, 0, i + 1, 0, "MODEL"] for i in range(nodes)],
+        "version": 0.4,
+    }
+    return [number, str(uuid.uuid4()), prompt, {"client_id": "bench", "extra_pnginfo": {"workflow": workflow}}, ["0"], {}]
+
+
+def summarize(samples):
+    """
+    Latency summary in milliseconds.
+    """
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+    }
+
+
+def throughput(count, seconds):
+    return {"count": count, "seconds": seconds, "items_per_s": count / seconds if seconds > 0 else None}
+
+
+def synthetic_items(count, workflows=10, nodes=60, start=0):
+    """
+    Generate count items spread over a number of workflows (so workflow blobs are deduplicated as in real queues).
+    """
+    for number in range(start, start + count):
+        yield make_item(number, f"workflow-{number % workflows}", nodes)
+
+
+def environment():
+    """
+    Metadata stored with every result so runs can be compared across versions and machines.
+    """
+    from src.comfyui_queue_manager import qm_json
+
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    version = None
+    with open(os.path.join(ROOT, "pyproject.toml")) as pyproject:
+        for line in pyproject:
+            if line.startswith("version"):
+                version = line.split("=", 1)[1].strip().strip('"')
+                break
+
+    return {
+        "version": version,
+        "revision": revision,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "json_codec": qm_json.get_codec(),
+    }
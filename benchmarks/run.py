@@ -0,0 +1,155 @@
+"""
+Offline benchmark suite for QM_Queue hot paths, runs without ComfyUI (see harness.py).
+
+For every queue size a fresh database is filled with synthetic items and the following operations are measured:
+
+    import            import_queue() of the whole synthetic queue (throughput)
+    queue_put         single items put on top of the filled queue (latency)
+    pickup            queue_get() + task_done() cycles (latency)
+    page              get_current_queue() at several page depths, page numbers and cursors (latency)
+    export            iter_full_queue() encoded like the export route (throughput)
+    archive_queue     archive_queue() of every pending item (throughput)
+    play_archive      play_archive() of the whole archive (throughput)
+
+Each result is printed as one JSON line with the environment (version, git revision, codec...) so runs can be
+stored and compared across versions:
+
+    python benchmarks/run.py --sizes 1000,100000 --out results.jsonl
+    python benchmarks/run.py --sizes 1000000 --operations import,page,export
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from harness import environment, make_item, make_queue, summarize, synthetic_items, throughput
+
+from src.comfyui_queue_manager.helpers import export_chunk
+
+OPERATIONS = ["import", "queue_put", "pickup", "page", "export", "archive_queue", "play_archive"]
+SAMPLES = 200
+PAGE_SIZE = 100
+
+
+def bench_import(queue, size, nodes):
+    start = time.perf_counter()
+    imported, submitted = queue.import_queue(synthetic_items(size, nodes=nodes), None, 0)
+    return throughput(imported, time.perf_counter() - start)
+
+
+def bench_queue_put(queue, size, nodes):
+    samples = []
+    for number in range(size, size + SAMPLES):
+        item = make_item(number, f"workflow-{number % 10}", nodes)
+        start = time.perf_counter()
+        queue.queue_put(item)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def bench_pickup(queue, size, nodes):
+    samples = []
+    got = queue.queue_get(timeout=0.01)
+    for _ in range(min(SAMPLES, size)):
+        if got is None:
+            break
+        start = time.perf_counter()
+        queue.task_done(got[1], {}, None)
+        got = queue.queue_get(timeout=0.01)
+        samples.append(time.perf_counter() - start)
+    if got is not None:
+        queue.task_done(got[1], {}, None)
+    return summarize(samples)
+
+
+def bench_page(queue, size, nodes):
+    """
+    Page number (OFFSET) mode at the start, middle and end of the queue, and cursor mode walking from the start.
+    """
+    results = {}
+    last_page = max(size // PAGE_SIZE - 1, 0)
+    for label, page in (("first", 0), ("middle", last_page // 2), ("last", last_page)):
+        samples = []
+        for _ in range(20):
+            start = time.perf_counter()
+            queue.get_current_queue(page, PAGE_SIZE, return_meta=True, summary=True)
+            samples.append(time.perf_counter() - start)
+        results[f"offset_{label}"] = summarize(samples)
+
+    samples = []
+    cursor = []
+    for _ in range(min(100, last_page + 1)):
+        start = time.perf_counter()
+        info = queue.get_current_queue(0, PAGE_SIZE, return_meta=True, cursor=cursor, with_total=False, summary=True)[2]
+        samples.append(time.perf_counter() - start)
+        cursor = info["next_cursor"]
+        if cursor is None:
+            break
+    results["cursor_walk"] = summarize(samples)
+    return results
+
+
+def bench_export(queue, size, nodes):
+    start = time.perf_counter()
+    exported = 0
+    written = 0
+    for chunk in queue.iter_full_queue("queue"):
+        exported += len(chunk)
+        written += len(export_chunk(chunk, first=exported == len(chunk)))
+    return {**throughput(exported, time.perf_counter() - start), "bytes": written}
+
+
+def bench_archive_queue(queue, size, nodes):
+    start = time.perf_counter()
+    archived = queue.archive_queue()
+    return throughput(archived, time.perf_counter() - start)
+
+
+def bench_play_archive(queue, size, nodes):
+    start = time.perf_counter()
+    moved = queue.play_archive("bench")
+    return throughput(moved, time.perf_counter() - start)
+
+
+def run(sizes, operations, nodes, options):
+    for size in sizes:
+        queue = make_queue(options)
+        meta = environment()
+        # the queue has to be filled for the other operations, so import always runs first
+        for operation in ["import"] + [operation for operation in OPERATIONS[1:] if operation in operations]:
+            result = globals()["bench_" + operation](queue, size, nodes)
+            if operation == "import" and "import" not in operations:
+                continue
+            yield {"benchmark": operation, "size": size, "nodes": nodes, "options": options, **result, "environment": meta}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000", help="comma separated queue sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--operations", default=",".join(OPERATIONS), help="comma separated subset of " + ",".join(OPERATIONS))
+    parser.add_argument("--nodes", type=int, default=60, help="nodes per synthetic prompt")
+    parser.add_argument("--option", action="append", default=[], metavar="KEY=JSON", help='queue manager option, e.g. durability="batched"')
+    parser.add_argument("--out", help="append results to this JSON lines file")
+    args = parser.parse_args(argv)
+
+    operations = args.operations.split(",")
+    unknown = set(operations) - set(OPERATIONS)
+    if unknown:
+        parser.error("unknown operations: " + ",".join(sorted(unknown)))
+    options = {key: json.loads(value) for key, value in (option.split("=", 1) for option in args.option)}
+
+    out = open(args.out, "a") if args.out else None
+    try:
+        for result in run([int(size) for size in args.sizes.split(",")], operations, args.nodes, options):
+            line = json.dumps(result)
+            print(line, flush=True)
+            if out is not None:
+                out.write(line + "\n")
+    finally:
+        if out is not None:
+            out.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
+import codecs
 import re
 import json
 
+from .qm_json import dumps_bytes, loads
+
 WINDOWS_BAD = r'<>:"/\\|?*'
 CONTROL_CHARS = "".join(map(chr, range(32)))
 
@@ -25,7 +28,161 @@ async def requestJson(request):
     Safely parse JSON from an async request object and return an empty dict on parse error.
     """
     try:
-        json_data = await request.json()
+        json_data = await request.json(loads=loads)
     except json.JSONDecodeError:
         json_data = {}
     return json_data
+
+
+PREVIEW_LENGTH = 140
+
+
+def item_summary(item):
+    """
+    Extract the summary columns stored alongside a queue item so listings don't need to decode the full prompt.
+    Returns dict with name, workflow_id, client_id, node_count and preview (first prose-like text input of the prompt).
+    """
+    extra_data = item[3] if len(item) > 3 and isinstance(item[3], dict) else {}
+    workflow = extra_data.get("extra_pnginfo", {}).get("workflow", {})
+    prompt = item[2] if len(item) > 2 and isinstance(item[2], dict) else {}
+
+    preview = None
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values() if isinstance(node, dict) else ():
+            # text widget values (prompts, notes) rather than file names or enum values
+            if isinstance(value, str) and " " in value.strip():
+                preview = " ".join(value.split())[:PREVIEW_LENGTH]
+                break
+        if preview is not None:
+            break
+
+    return {
+        "name": workflow.get("workflow_name"),
+        "workflow_id": workflow.get("id"),
+        "client_id": extra_data.get("client_id"),
+        "node_count": len(prompt),
+        "preview": preview,
+    }
+
+
+SEARCH_COLUMNS = ("name", "nodes", "inputs")
+
+
+def search_query(text):
+    """
+    FTS5 query for the search filter: every word has to match (as a prefix if it ends with *), optionally limited
+    to a column with name:, nodes: or inputs: (e.g. "inputs:juggernaut* portrait"). Quotes are dropped so user
+    input can't produce FTS5 syntax errors. Returns None if there's nothing to search for.
+    """
+    terms = []
+    for word in str(text).split():
+        column = None
+        if ":" in word:
+            prefix, rest = word.split(":", 1)
+            if prefix.lower() in SEARCH_COLUMNS:
+                column, word = prefix.lower(), rest
+        prefix_match = word.endswith("*")
+        word = word.replace('"', "").rstrip("*")
+        if word == "":
+            continue
+        term = '"' + word + '"' + ("*" if prefix_match else "")
+        terms.append(f"{column} : {term}" if column else term)
+    return " ".join(terms) if terms else None
+
+
+def export_chunk(items, ndjson=False, first=False):
+    """
+    Encode a chunk of exported queue items as a part of a JSON array (or as NDJSON lines) without their sensitive data (item[5]).
+    """
+    lines = [dumps_bytes(item[:5]) for item in items]
+    if ndjson:
+        return b"".join(line + b"\n" for line in lines)
+
+    return (b"" if first else b",") + b",".join(lines)
+
+
+def iter_json_items(file, read_size=1 << 16):
+    """
+    Iterate over the items of a JSON array, or of NDJSON (one item per line), read incrementally from a binary file.
+    Memory use is bounded by the largest item rather than by the size of the file.
+    Queue items are arrays themselves so a file starting with "[[" (or "[]") is a JSON array, anything else is NDJSON.
+    Raises json.JSONDecodeError on malformed input.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill(size=read_size):
+        # Append more of the file to the buffer, False at the end of the file
+        nonlocal buffer, eof
+        if eof:
+            return False
+        data = file.read(size)
+        if not data:
+            eof = True
+            buffer += reader.decode(b"", final=True)
+            return False
+        buffer += reader.decode(data)
+        return True
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return
+
+    def decode_item():
+        nonlocal buffer, pos
+        if pos > read_size:
+            # drop what's been parsed already
+            buffer = buffer[pos:]
+            pos = 0
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    pos = end
+                    return item
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # incomplete item (or one which might continue), read more. Reads grow with the item so parsing stays linear.
+            fill(max(read_size, len(buffer) - pos))
+
+    skip_whitespace()
+    if pos >= len(buffer):
+        raise json.JSONDecodeError("Expecting value", buffer, pos)
+
+    is_array = False
+    if buffer[pos] == "[":
+        start = pos
+        pos += 1
+        skip_whitespace()
+        is_array = pos < len(buffer) and buffer[pos] in "[]"
+        if not is_array:
+            pos = start
+
+    if is_array:
+        if buffer[pos] == "]":
+            return
+        while True:
+            yield decode_item()
+            skip_whitespace()
+            if pos >= len(buffer):
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            if buffer[pos] == "]":
+                return
+            if buffer[pos] != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buffer, pos)
+            pos += 1
+            skip_whitespace()
+    else:
+        while True:
+            yield decode_item()
+            skip_whitespace()
+            if pos >= len(buffer):
+                return
@@ -4,3 +4,19 @@ class BadRouteException(Exception):
     def __init__(self, message="Bad route"):
         self.message = message
         super().__init__(self.message)
+
+
+class BadCursorException(Exception):
+    """Exception raised when malformed pagination cursor is passed."""
+
+    def __init__(self, message="Bad cursor"):
+        self.message = message
+        super().__init__(self.message)
+
+
+class BadSelectionException(Exception):
+    """Exception raised when malformed bulk selection is passed."""
+
+    def __init__(self, message="Bad selection"):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,102 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+
+class QM_AsyncQueue:
+    """
+    Awaitable wrappers for the QM_Queue API used by the HTTP routes.
+
+    QM_Queue methods do blocking SQLite I/O and JSON work while holding the native queue mutex, so they are run
+    on a small bounded thread pool instead of the aiohttp event loop. This keeps websocket traffic and previews
+    flowing while bulk operations (export, import, archive replay...) are running.
+    Worker threads read through their own SQLite connections, writes go through the shared writer (see qm_db.QM_Writer).
+    """
+
+    def __init__(self, queue, max_workers=2):
+        self.queue = queue
+        self.executor = ThreadPoolExecutor(max_workers=max(int(max_workers), 1), thread_name_prefix="queue-manager-db")
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run any blocking callable in the executor and await its result.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    async def get_current_queue(self, *args, **kwargs):
+        return await self.run(self.queue.get_current_queue, *args, **kwargs)
+
+    async def get_item(self, db_id, tier="hot"):
+        return await self.run(self.queue.get_item, db_id, tier)
+
+    async def get_status_counts(self):
+        return await self.run(self.queue.get_status_counts)
+
+    async def get_facets(self, facets=None, status=None):
+        return await self.run(self.queue.get_facets, facets, status)
+
+    async def repair_facets(self):
+        return await self.run(self.queue.repair_facets)
+
+    async def get_eta(self):
+        return await self.run(self.queue.get_eta)
+
+    async def get_timing_stats(self):
+        return await self.run(self.queue.get_timing_stats)
+
+    async def get_expected_starts(self, db_ids, eta=None):
+        return await self.run(self.queue.get_expected_starts, db_ids, eta)
+
+    async def get_full_queue(self, route="queue", filters=None, tier="hot"):
+        return await self.run(self.queue.get_full_queue, route, filters, tier)
+
+    async def iter_full_queue(self, route="queue", filters=None, chunk_size=500, tier="hot"):
+        """
+        Async iterator over chunks of QM_Queue.iter_full_queue(), each chunk is read in the executor.
+        """
+        chunks = self.queue.iter_full_queue(route, filters, chunk_size, tier)
+        while True:
+            chunk = await self.run(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def archive_items(self, items):
+        return await self.run(self.queue.archive_items, items)
+
+    async def archive_selection(self, selection):
+        return await self.run(self.queue.archive_selection, selection)
+
+    async def delete_selection(self, selection):
+        return await self.run(self.queue.delete_selection, selection)
+
+    async def archive_queue(self, filters=None):
+        return await self.run(self.queue.archive_queue, filters)
+
+    async def play_items(self, items, front, client_id=None, tier="hot"):
+        return await self.run(self.queue.play_items, items, front, client_id, tier)
+
+    async def play_archive(self, client_id=None, filters=None, tier="hot"):
+        return await self.run(self.queue.play_archive, client_id, filters, tier)
+
+    async def import_queue(self, items, client_id=None, status=0, api_key_comfy_org=None):
+        return await self.run(self.queue.import_queue, items, client_id, status, api_key_comfy_org)
+
+    async def delete_from_queue(self, route="queue", filters=None, tier="hot"):
+        return await self.run(self.queue.delete_from_queue, route, filters, tier)
+
+    async def delete_items(self, items):
+        return await self.run(self.queue.delete_items, items)
+
+    async def delete_running(self, prompt_id=None):
+        return await self.run(self.queue.delete_running, prompt_id)
+
+    async def wipe_queue(self):
+        return await self.run(self.queue.wipe_queue)
+
+    async def toggle_playback(self):
+        return await self.run(self.queue.toggle_playback)
@@ -0,0 +1,136 @@
+"""
+Content-addressed storage for the large, repeated parts of queue items.
+
+The UI workflow graph (extra_pnginfo.workflow) is usually identical across thousands of items queued from
+the same workflow, so it's stored once in the `blobs` table keyed by its hash and replaced in the stored
+prompt with a {"$blob": hash} reference. Blobs are optionally compressed and reference counted by triggers
+on the queue table (see init_schema()), so they go away together with the last item using them.
+"""
+
+from functools import lru_cache
+import hashlib
+import logging
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .qm_db import read_single, write_query
+from .qm_json import dumps, dumps_bytes, loads
+
+BLOB_REF = "$blob"
+CODECS = ["none", "zlib", "zstd"]
+
+# Codec used for new blobs. Existing blobs are always read with the codec they were written with.
+_compression = "zlib"
+
+
+def set_compression(codec):
+    global _compression
+    if codec == "zstd" and zstandard is None:
+        logging.warning("[Queue Manager] zstandard is not installed, falling back to zlib compression")
+        codec = "zlib"
+    if codec not in CODECS:
+        logging.warning("[Queue Manager] Unknown compression %s, falling back to zlib compression", codec)
+        codec = "zlib"
+    _compression = codec
+
+
+def compress(data: bytes):
+    match _compression:
+        case "zlib":
+            return "zlib", zlib.compress(data, 6)
+        case "zstd":
+            return "zstd", zstandard.ZstdCompressor(level=6).compress(data)
+    return "none", data
+
+
+def decompress(codec, data: bytes) -> bytes:
+    match codec:
+        case "zlib":
+            return zlib.decompress(data)
+        case "zstd":
+            if zstandard is None:
+                raise RuntimeError("zstandard is required to read blobs compressed with zstd")
+            return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+
+def save_blob(data: bytes, conn=None):
+    """
+    Store the blob unless it's already stored (commit is left to the caller's statement) and return its hash.
+    Migrations pass their connection so the blob is part of their transaction.
+    """
+    blob_hash = hashlib.sha256(data).hexdigest()
+    exists = "SELECT 1 FROM blobs WHERE hash = ?"
+    insert = """
+            INSERT OR IGNORE INTO blobs (hash, codec, data, size)
+            VALUES (?, ?, ?, ?)
+        """
+    if conn is not None:
+        if conn.execute(exists, (blob_hash,)).fetchone() is None:
+            conn.execute(insert, (blob_hash, *compress(data), len(data)))
+    elif read_single(exists, (blob_hash,)) is None:
+        write_query(insert, (blob_hash, *compress(data), len(data)), False)
+    return blob_hash
+
+
+@lru_cache(maxsize=64)
+def load_blob(blob_hash) -> str:
+    # Blobs are immutable so they can be cached by hash. Cache the text, not the decoded object, so every item gets its own copy.
+    row = read_single("SELECT codec, data FROM blobs WHERE hash = ?", (blob_hash,))
+    if row is None:
+        raise KeyError(f"Missing blob {blob_hash}")
+    return decompress(row[0], row[1]).decode("utf-8")
+
+
+def pack_item(item, conn=None):
+    """
+    Serialize queue item for storage with its workflow moved to the blobs table (through conn if given, see save_blob()).
+    Returns (prompt JSON, workflow hash or None). The item itself is not modified.
+    """
+    extra_data = item[3] if len(item) > 3 and isinstance(item[3], dict) else None
+    extra_pnginfo = extra_data.get("extra_pnginfo") if extra_data is not None else None
+    workflow = extra_pnginfo.get("workflow") if isinstance(extra_pnginfo, dict) else None
+
+    if not isinstance(workflow, dict) or BLOB_REF in workflow:
+        return dumps(item), None
+
+    workflow_hash = save_blob(dumps_bytes(workflow), conn)
+
+    packed = list(item)
+    packed[3] = {**extra_data, "extra_pnginfo": {**extra_pnginfo, "workflow": {BLOB_REF: workflow_hash}}}
+    return dumps(packed), workflow_hash
+
+
+def unpack_item(prompt, resolve=True):
+    """
+    Decode stored prompt JSON. With resolve=False the workflow reference is left in place,
+    which is enough (and cheaper) when the item is only modified and stored again.
+    """
+    item = loads(prompt)
+    if not resolve:
+        return item
+
+    try:
+        workflow = item[3]["extra_pnginfo"]["workflow"]
+    except (IndexError, KeyError, TypeError):
+        return item
+
+    if isinstance(workflow, dict) and BLOB_REF in workflow:
+        item[3]["extra_pnginfo"]["workflow"] = loads(load_blob(workflow[BLOB_REF]))
+    return item
+
+
+def pack_cold_item(item):
+    """
+    Serialize queue item for the cold tier: compressed JSON of the whole item (workflow included).
+    Returns (codec, data).
+    """
+    return compress(dumps_bytes(item))
+
+
+def unpack_cold_item(codec, data):
+    return loads(decompress(codec, data))
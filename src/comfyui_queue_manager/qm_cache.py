@@ -0,0 +1,51 @@
+from collections import OrderedDict
+import hashlib
+
+
+def make_etag(revision, key):
+    """
+    Strong ETag of a response for the queue revision and the request's canonical query (see QM_ResponseCache).
+    """
+    return '"' + str(revision) + "-" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:16] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    return any(tag.strip() in (etag, "*", "W/" + etag) for tag in if_none_match.split(","))
+
+
+class QM_ResponseCache:
+    """
+    LRU cache of serialized response bodies of the current queue revision, keyed by the canonical query string.
+
+    Every change of the queue bumps its revision (see QM_Queue.publish()), so seeing a newer revision drops
+    all entries. Only used from the event loop, so it needs no lock.
+    """
+
+    def __init__(self, size=64):
+        self.size = max(size, 0)
+        self.revision = None
+        self.entries = OrderedDict()
+
+    def get(self, revision, key):
+        if revision != self.revision:
+            return None
+        body = self.entries.get(key)
+        if body is not None:
+            self.entries.move_to_end(key)
+        return body
+
+    def put(self, revision, key, body):
+        if self.size == 0:
+            return
+        if revision != self.revision:
+            # a response computed before a change must not replace the entries of a newer revision
+            if self.revision is not None and revision < self.revision:
+                return
+            self.entries.clear()
+            self.revision = revision
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
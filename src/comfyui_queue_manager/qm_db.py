@@ -1,22 +1,376 @@
+from collections import deque
+from contextlib import contextmanager
 from pathlib import Path
-import sqlite3, threading
+import sqlite3, threading, logging, time, atexit, os
 
-DB_PATH = Path(__file__).resolve().parents[2] / "data" / "qm-queue.db"
-_local = threading.local()
+from .helpers import item_summary
+from .qm_json import loads
+from . import qm_metrics
 
+# QM_DB_PATH points several ComfyUI instances at one queue database (see QM_Queue.shared)
+DB_PATH = Path(os.environ.get("QM_DB_PATH") or Path(__file__).resolve().parents[2] / "data" / "qm-queue.db")
 
-def get_conn() -> sqlite3.Connection:
-    if not hasattr(_local, "conn"):
-        _local.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        _local.conn.execute("PRAGMA journal_mode=WAL")
-        _local.conn.execute("PRAGMA synchronous=NORMAL")
-        _local.conn.row_factory = sqlite3.Row
-    return _local.conn
+TEMP_STORES = ["default", "file", "memory"]
+
+# Settings of new connections (see configure_connections())
+_settings = {
+    "cache_size_kb": 8192,  # page cache per connection and database file
+    "mmap_size_mb": 64,  # memory mapped I/O per connection and database file, 0 disables it
+    "temp_store": "memory",  # temporary tables and indexes (sorts, DISTINCT...)
+    "cached_statements": 128,  # prepared statements kept per connection
+    "busy_timeout_ms": 5000,  # wait for the write lock held by another process sharing the database
+}
+
+
+def cold_path() -> Path:
+    """
+    Database file of the cold tier: completed and archived items past their retention (see QM_Queue.expire_items()).
+    """
+    path = Path(DB_PATH)
+    return path.with_name(path.stem + "-cold" + path.suffix)
+
+
+def connect(read_only=False) -> sqlite3.Connection:
+    """
+    Open a connection to the queue database with the cold tier attached. Read-only connections (see QM_ReadPool)
+    can't change the database, they rely on the writer connection having set it up (WAL mode, schema).
+    """
+    if read_only:
+        conn = sqlite3.connect(
+            Path(DB_PATH).resolve().as_uri() + "?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=_settings["cached_statements"],
+        )
+        conn.execute("ATTACH DATABASE ? AS cold", (cold_path().resolve().as_uri() + "?mode=ro",))
+    else:
+        new = not Path(DB_PATH).exists()
+        new_cold = not cold_path().exists()
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=_settings["cached_statements"])
+        if new:
+            # Has to be set before WAL writes the header, existing databases are converted by QM_Maintenance
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        # The cold tier is attached to every connection so it's queried like the hot queue (cold.queue)
+        conn.execute("ATTACH DATABASE ? AS cold", (str(cold_path()),))
+        if new_cold:
+            conn.execute("PRAGMA cold.auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA cold.journal_mode=WAL")
+        conn.execute("PRAGMA cold.synchronous=NORMAL")
+
+    for schema in ("main", "cold"):
+        conn.execute(f"PRAGMA {schema}.cache_size=-{int(_settings['cache_size_kb'])}")
+        conn.execute(f"PRAGMA {schema}.mmap_size={int(_settings['mmap_size_mb']) * 1024 * 1024}")
+    conn.execute(f"PRAGMA temp_store={_settings['temp_store'].upper()}")
+    conn.execute(f"PRAGMA busy_timeout={int(_settings['busy_timeout_ms'])}")
+
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+class QM_ReadPool:
+    """
+    Bounded pool of read-only connections. In WAL mode readers don't block the writer or each other,
+    so reads from the executor threads, ComfyUI's worker and the maintenance thread run concurrently while
+    holding a connection only for the duration of one statement.
+
+    When all `size` connections are in use, readers wait in line: a returned connection is handed to the reader
+    waiting the longest, so a thread doing the occasional read (e.g. queue_get() between two jobs) isn't starved
+    by threads reading in a loop.
+
+    close() closes the idle connections and the ones in use once they are returned, the pool opens new ones
+    (with the current settings) on demand.
+    """
+
+    def __init__(self, size=4):
+        self.size = max(size, 1)
+        self.lock = threading.Lock()
+        self.idle = []  # most recently used last
+        self.waiting = deque()  # [event, connection handed over (None: open one), generation] per waiting reader
+        self.opened = 0
+        self.generation = 0  # bumped by close(), connections of older generations are closed when returned
+
+    def resize(self, size):
+        with self.lock:
+            self.size = max(size, 1)
+            while self.waiting and self.opened < self.size:
+                self.hand_over(None)
+
+    @contextmanager
+    def connection(self):
+        conn, generation = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn, generation)
+
+    def acquire(self):
+        with self.lock:
+            generation = self.generation
+            waiter = None
+            if self.waiting or (len(self.idle) == 0 and self.opened >= self.size):
+                waiter = [threading.Event(), None, generation]
+                self.waiting.append(waiter)
+            elif self.idle:
+                return self.idle.pop(), generation
+            else:
+                self.opened += 1
+
+        if waiter is not None:
+            waiter[0].wait()
+            conn, generation = waiter[1], waiter[2]
+            if conn is not None:
+                return conn, generation
+        return self.open(generation)
+
+    def open(self, generation):
+        try:
+            return connect(read_only=True), generation
+        except Exception:
+            with self.lock:
+                self.opened -= 1
+                if self.waiting and self.opened < self.size:
+                    self.hand_over(None)
+            raise
+
+    def hand_over(self, conn):
+        """
+        Give the connection (or the right to open one if None) to the reader waiting the longest. Called with the lock held.
+        """
+        waiter = self.waiting.popleft()
+        if conn is None:
+            self.opened += 1
+        waiter[1], waiter[2] = conn, self.generation
+        waiter[0].set()
+
+    def release(self, conn, generation):
+        with self.lock:
+            if generation == self.generation and self.opened <= self.size:
+                if self.waiting:
+                    self.hand_over(conn)
+                else:
+                    self.idle.append(conn)
+                return
+            self.opened -= 1
+            if self.waiting and self.opened < self.size:
+                self.hand_over(None)
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+            self.opened -= len(idle)
+            self.generation += 1
+            while self.waiting and self.opened < self.size:
+                self.hand_over(None)
+        for conn in idle:
+            conn.close()
+
+
+_pool = QM_ReadPool()
+
+
+def get_pool() -> QM_ReadPool:
+    return _pool
+
+
+class QM_Writer:
+    """
+    Single connection all writes go through.
+
+    In "strict" durability mode every write is committed right away. In "batched" mode commits are grouped:
+    writes (enqueued items, status transitions...) are committed together once `delay` seconds passed since
+    the first uncommitted write or `max_batch` writes piled up, whichever comes first, so fast workflows
+    don't pay for three separate commits per execution.
+
+    Reads issued while there are uncommitted writes are served by the writer connection, so callers always
+    see their own writes. On a clean shutdown pending writes are committed (atexit).
+
+    Crash recovery in batched mode: writes of the last `delay` seconds may be lost. A lost "running" transition
+    leaves the item pending, a lost "finished" transition leaves it running and restore_queue() puts it back at
+    the front of the queue, so a job is never lost once its enqueue was committed but may run again.
+    Items enqueued within `delay` before the crash may be lost.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.lock = threading.RLock()
+        self.flushed = threading.Condition(self.lock)
+        self.durability = "strict"
+        self.delay = 0.05
+        self.max_batch = 256
+        self.dirty = False  # there are uncommitted writes
+        self.writes = 0  # number of uncommitted writes
+        self.first_write = 0.0  # monotonic time of the first uncommitted write
+        self.thread = None
+
+    def configure(self, durability="strict", delay_ms=50, max_batch=256):
+        if durability not in ("strict", "batched"):
+            logging.warning("[Queue Manager] Unknown durability mode %s, falling back to strict", durability)
+            durability = "strict"
+        with self.lock:
+            self.durability = durability
+            self.delay = max(delay_ms, 0) / 1000
+            self.max_batch = max(max_batch, 1)
+            if durability == "strict":
+                self.flush()
+
+    def connection(self) -> sqlite3.Connection:
+        if self.conn is None:
+            self.conn = connect()
+        return self.conn
+
+    def close(self):
+        """
+        Commit pending writes and close the connection, it's reopened by the next write.
+        """
+        with self.lock:
+            self.flush()
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def written(self, commit):
+        """
+        Called after each write (with the lock held): commit now, schedule a group commit or leave it to the caller.
+        """
+        if not commit:
+            self.dirty = True
+            return
+
+        if self.durability == "strict":
+            self.commit()
+            self.dirty = False
+            self.writes = 0
+            return
+
+        if not self.dirty or self.writes == 0:
+            self.first_write = time.monotonic()
+        self.dirty = True
+        self.writes += 1
+
+        if self.writes >= self.max_batch:
+            self.flush()
+        else:
+            self.start_committer()
+            self.flushed.notify()
+
+    def flush(self):
+        """
+        Commit all pending writes.
+        """
+        with self.lock:
+            if self.conn is not None and self.conn.in_transaction:
+                self.commit()
+            self.dirty = False
+            self.writes = 0
+
+    def commit(self):
+        start = time.perf_counter()
+        self.conn.commit()
+        qm_metrics.observe_statement("COMMIT", time.perf_counter() - start)
+
+    def start_committer(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.committer, name="queue-manager-commit", daemon=True)
+            self.thread.start()
+
+    def committer(self):
+        with self.lock:
+            while True:
+                while self.writes == 0:
+                    self.flushed.wait()
+
+                remaining = self.first_write + self.delay - time.monotonic()
+                if remaining > 0:
+                    self.flushed.wait(remaining)
+                    continue
+
+                self.flush()
+
+
+_writer = QM_Writer()
+
+
+def get_writer() -> QM_Writer:
+    return _writer
+
+
+def configure_writer(durability="strict", delay_ms=50, max_batch=256):
+    _writer.configure(durability, delay_ms, max_batch)
+
+
+def configure_connections(
+    read_connections=4, cache_size_kb=8192, mmap_size_mb=64, temp_store="memory", cached_statements=128, busy_timeout_ms=5000
+):
+    """
+    Size of the read pool and settings of the connections. Open connections are closed and reopened on demand
+    with the new settings.
+    """
+    if temp_store not in TEMP_STORES:
+        logging.warning("[Queue Manager] Unknown temp_store %s, falling back to memory", temp_store)
+        temp_store = "memory"
+    settings = {
+        "cache_size_kb": max(int(cache_size_kb), 0),
+        "mmap_size_mb": max(int(mmap_size_mb), 0),
+        "temp_store": temp_store,
+        "cached_statements": max(int(cached_statements), 0),
+        "busy_timeout_ms": max(int(busy_timeout_ms), 0),
+    }
+    _pool.resize(read_connections)
+    if settings != _settings:
+        _settings.update(settings)
+        close_connections()
+
+
+def close_connections():
+    """
+    Commit pending writes and close all connections (on shutdown, atexit).
+    """
+    _writer.close()
+    _pool.close()
+
+
+atexit.register(lambda: close_connections())
+
+
+def commit():
+    """
+    Commit writes made with commit=False (following the durability mode).
+    """
+    with _writer.lock:
+        if _writer.dirty:
+            _writer.written(True)
+
+
+# Bump updated_at when the item is moved between statuses or re-prioritized, but not when bookkeeping columns
+# or the stored representation of the prompt are updated
+QUEUE_UPDATED_AT_TRIGGER = """
+        CREATE TRIGGER IF NOT EXISTS queue_set_updated_at
+        AFTER UPDATE OF status, number ON queue
+        FOR EACH ROW
+        WHEN NEW.updated_at = OLD.updated_at         -- only if caller didn't change it
+        BEGIN
+          UPDATE queue
+          SET    updated_at = CURRENT_TIMESTAMP
+          WHERE  rowid = NEW.rowid;
+        END;
+"""
 
 
 def init_schema():
-    conn = get_conn()
-    conn.executescript("""
+    with _writer.lock:
+        _writer.flush()
+        create_schema(_writer.connection())
+        create_cold_schema(_writer.connection())
+
+
+def create_schema(conn):
+    conn.executescript(
+        """
         CREATE TABLE IF NOT EXISTS queue (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             prompt_id  VARCHAR(255) NOT NULL UNIQUE,
@@ -36,19 +390,26 @@ def init_schema():
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         );
 
+        -- Indexes matching every route / filter / order combination used by QM_Queue
+        -- so listing, counting and bulk operations never fall back to full scans or temp B-tree sorts.
+        -- The implicit rowid (id) at the end of each index serves as a tiebreaker for keyset pagination.
         CREATE INDEX IF NOT EXISTS idx_queue_status_number
-            ON queue(status, number);
+            ON queue(status, number);                   -- queue route
+        CREATE INDEX IF NOT EXISTS idx_queue_status_updated_at
+            ON queue(status, updated_at);               -- archive and completed routes
+        CREATE INDEX IF NOT EXISTS idx_queue_status_created_at
+            ON queue(status, created_at);               -- export
+        CREATE INDEX IF NOT EXISTS idx_queue_workflow_status_number
+            ON queue(workflow_id, status, number);      -- workflow filter: queue route
+        CREATE INDEX IF NOT EXISTS idx_queue_workflow_status_updated_at
+            ON queue(workflow_id, status, updated_at);  -- workflow filter: archive and completed routes
+        CREATE INDEX IF NOT EXISTS idx_queue_workflow_status_created_at
+            ON queue(workflow_id, status, created_at);  -- workflow filter: export
 
         -- Create a trigger to update the updated_at column
-        CREATE TRIGGER IF NOT EXISTS queue_set_updated_at
-        AFTER UPDATE ON queue
-        FOR EACH ROW
-        WHEN NEW.updated_at = OLD.updated_at         -- only if caller didn't change it
-        BEGIN
-          UPDATE queue
-          SET    updated_at = CURRENT_TIMESTAMP
-          WHERE  rowid = NEW.rowid;
-        END;
+        """
+        + QUEUE_UPDATED_AT_TRIGGER
+        + """
 
         CREATE TRIGGER IF NOT EXISTS options_set_updated_at
         AFTER UPDATE ON options
@@ -59,38 +420,509 @@ def init_schema():
           SET    updated_at = CURRENT_TIMESTAMP
           WHERE  rowid = NEW.rowid;
         END;
+    """
+    )
+
+    migrate(conn)
+
+
+def create_cold_schema(conn):
+    """
+    Items moved to the cold tier keep their id and summary columns, the prompt is stored compressed with its workflow
+    inlined (see qm_blobs.pack_cold_item()), so the cold file doesn't depend on the blobs of the hot database.
+    """
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS cold.queue (
+            id INTEGER PRIMARY KEY,  -- id the item had in the hot queue
+            prompt_id  VARCHAR(255) NOT NULL UNIQUE,
+            created_at DATETIME,
+            updated_at DATETIME,
+            expired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            number     INTEGER,
+            name       TEXT,
+            workflow_id   VARCHAR(255),
+            client_id  VARCHAR(255),
+            node_count INTEGER,
+            preview    TEXT,
+            status     INTEGER,   -- 2: finished, 3: archive
+            codec      VARCHAR(16) NOT NULL,
+            prompt     BLOB NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS cold.idx_queue_status_updated_at
+            ON queue(status, updated_at);               -- archive and completed routes
+        CREATE INDEX IF NOT EXISTS cold.idx_queue_status_created_at
+            ON queue(status, created_at);               -- export
+        CREATE INDEX IF NOT EXISTS cold.idx_queue_workflow_status_updated_at
+            ON queue(workflow_id, status, updated_at);  -- workflow filter
     """)
 
 
-# Helper functions to read and write to the database
+# ===========================================================
+# ======================= MIGRATIONS ========================
+# ===========================================================
+# Schema changes for existing databases. Each migration runs once and
+# PRAGMA user_version tracks how many of them were applied. A migration and its
+# version bump are one transaction, so migrations mustn't use executescript().
+
+
+def split_statements(script):
+    """
+    Statements of a script, to be run one by one with conn.execute(). Unlike executescript(), which commits first,
+    they are then part of the migration's transaction.
+    """
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def add_column(conn, table, column, definition):
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def migrate_summary_columns(conn):
+    """
+    Summary columns used by listings instead of decoding the prompt JSON. Backfilled for existing items.
+    """
+    conn.execute("DROP TRIGGER IF EXISTS queue_set_updated_at")
+    conn.execute(QUEUE_UPDATED_AT_TRIGGER)
+
+    add_column(conn, "queue", "client_id", "VARCHAR(255)")
+    add_column(conn, "queue", "node_count", "INTEGER")
+    add_column(conn, "queue", "preview", "TEXT")
+
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, prompt FROM queue WHERE id > ? ORDER BY id LIMIT 500", (last_id,)).fetchall()
+        if len(rows) == 0:
+            break
+        params = []
+        for row in rows:
+            summary = item_summary(loads(row[1]))
+            params.append((summary["client_id"], summary["node_count"], summary["preview"], row[0]))
+        conn.executemany("UPDATE queue SET client_id = ?, node_count = ?, preview = ? WHERE id = ?", params)
+        last_id = rows[-1][0]
+
+
+def migrate_workflow_blobs(conn):
+    """
+    Move workflows out of stored prompts into reference counted, content-addressed blobs (see qm_blobs).
+    """
+    from .qm_blobs import pack_item, unpack_item
+
+    conn.execute("DROP TRIGGER IF EXISTS queue_set_updated_at")
+    conn.execute(QUEUE_UPDATED_AT_TRIGGER)
+
+    add_column(conn, "queue", "workflow_hash", "VARCHAR(64)")
+    for statement in split_statements("""
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash  VARCHAR(64) PRIMARY KEY,
+            codec VARCHAR(16) NOT NULL,  -- none, zlib, zstd
+            data  BLOB NOT NULL,
+            size  INTEGER,               -- uncompressed size
+            refs  INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Blobs stored for items which never made it to the queue (i.e. ignored duplicates on import)
+        CREATE INDEX IF NOT EXISTS idx_blobs_orphans
+            ON blobs(refs) WHERE refs <= 0;
+
+        CREATE TRIGGER IF NOT EXISTS queue_blob_ref_insert
+        AFTER INSERT ON queue
+        FOR EACH ROW
+        WHEN NEW.workflow_hash IS NOT NULL
+        BEGIN
+          UPDATE blobs SET refs = refs + 1 WHERE hash = NEW.workflow_hash;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_blob_ref_update
+        AFTER UPDATE OF workflow_hash ON queue
+        FOR EACH ROW
+        WHEN OLD.workflow_hash IS NOT NEW.workflow_hash
+        BEGIN
+          UPDATE blobs SET refs = refs + 1 WHERE hash = NEW.workflow_hash;
+          UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.workflow_hash;
+          DELETE FROM blobs WHERE hash = OLD.workflow_hash AND refs <= 0;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_blob_ref_delete
+        AFTER DELETE ON queue
+        FOR EACH ROW
+        WHEN OLD.workflow_hash IS NOT NULL
+        BEGIN
+          UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.workflow_hash;
+          DELETE FROM blobs WHERE hash = OLD.workflow_hash AND refs <= 0;
+        END;
+    """):
+        conn.execute(statement)
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, prompt FROM queue WHERE id > ? AND workflow_hash IS NULL ORDER BY id LIMIT 500", (last_id,)
+        ).fetchall()
+        if len(rows) == 0:
+            break
+        params = []
+        for row in rows:
+            prompt, workflow_hash = pack_item(unpack_item(row[1], False), conn)
+            if workflow_hash is not None:
+                params.append((prompt, workflow_hash, row[0]))
+        conn.executemany("UPDATE queue SET prompt = ?, workflow_hash = ? WHERE id = ?", params)
+        last_id = rows[-1][0]
+
+
+def migrate_queue_stats(conn):
+    """
+    Item counts per status (workflow_id = '') and per status and workflow, kept up to date by triggers
+    in the same transaction as the change, so counting never needs to scan the queue.
+    """
+    for statement in split_statements("""
+        CREATE TABLE IF NOT EXISTS queue_stats (
+            status      INTEGER NOT NULL,
+            workflow_id VARCHAR(255) NOT NULL,  -- '' for all items with the status
+            total       INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (status, workflow_id)
+        );
+
+        CREATE TRIGGER IF NOT EXISTS queue_stats_insert
+        AFTER INSERT ON queue
+        FOR EACH ROW
+        BEGIN
+          INSERT INTO queue_stats (status, workflow_id, total)
+          SELECT NEW.status, '', 1 WHERE 1
+          ON CONFLICT(status, workflow_id) DO UPDATE SET total = total + 1;
+
+          INSERT INTO queue_stats (status, workflow_id, total)
+          SELECT NEW.status, NEW.workflow_id, 1 WHERE IFNULL(NEW.workflow_id, '') != ''
+          ON CONFLICT(status, workflow_id) DO UPDATE SET total = total + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_stats_update
+        AFTER UPDATE OF status, workflow_id ON queue
+        FOR EACH ROW
+        WHEN OLD.status IS NOT NEW.status OR OLD.workflow_id IS NOT NEW.workflow_id
+        BEGIN
+          UPDATE queue_stats SET total = total - 1
+          WHERE status = OLD.status AND workflow_id IN ('', IFNULL(OLD.workflow_id, ''));
+
+          INSERT INTO queue_stats (status, workflow_id, total)
+          SELECT NEW.status, '', 1 WHERE 1
+          ON CONFLICT(status, workflow_id) DO UPDATE SET total = total + 1;
+
+          INSERT INTO queue_stats (status, workflow_id, total)
+          SELECT NEW.status, NEW.workflow_id, 1 WHERE IFNULL(NEW.workflow_id, '') != ''
+          ON CONFLICT(status, workflow_id) DO UPDATE SET total = total + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_stats_delete
+        AFTER DELETE ON queue
+        FOR EACH ROW
+        BEGIN
+          UPDATE queue_stats SET total = total - 1
+          WHERE status = OLD.status AND workflow_id IN ('', IFNULL(OLD.workflow_id, ''));
+        END;
+    """):
+        conn.execute(statement)
+
+    conn.execute("DELETE FROM queue_stats")
+    conn.execute(f"INSERT INTO queue_stats (status, workflow_id, total) {QUEUE_STATS_EXPECTED}")
+
+
+# Expected content of queue_stats computed from the queue table (full scan, see QM_Queue.repair_facets())
+QUEUE_STATS_EXPECTED = """
+    SELECT status, '', COUNT(*) FROM queue GROUP BY status
+    UNION ALL
+    SELECT status, workflow_id, COUNT(*) FROM queue WHERE IFNULL(workflow_id, '') != '' GROUP BY status, workflow_id
+"""
+
+
+# Facets counted per status in queue_facets: facet name -> expression of the queue row (NEW / OLD / queue)
+FACETS = {
+    "workflow": "IFNULL({0}.workflow_id, '')",
+    "client": "IFNULL({0}.client_id, '')",
+    "day": "IFNULL(date({0}.created_at), '')",
+}
+
+
+def facet_rows(row):
+    """
+    SELECTs of (facet, value, status, total, label) of a queue row, one per facet. The workflow name is its label.
+    """
+    return "\n          UNION ALL ".join(
+        f"SELECT '{facet}', {expression.format(row)}, {row}.status, 1, {row + '.name' if facet == 'workflow' else 'NULL'}"
+        for facet, expression in FACETS.items()
+    )
+
+
+def facet_updates(row, change):
+    return "\n".join(
+        f"""          UPDATE queue_facets SET total = total {change} 1
+          WHERE facet = '{facet}' AND value = {expression.format(row)} AND status = {row}.status;"""
+        for facet, expression in FACETS.items()
+    )
+
+
+FACETS_INSERT = """
+          INSERT INTO queue_facets (facet, value, status, total, label)
+          {0} WHERE 1
+          ON CONFLICT(facet, value, status) DO UPDATE SET total = total + 1, label = IFNULL(excluded.label, label);"""
+
+# Expected content of queue_facets computed from the queue table (full scan, see QM_Queue.repair_facets())
+FACETS_EXPECTED = "\nUNION ALL ".join(
+    f"""SELECT '{facet}' AS facet, {expression.format("queue")} AS value, status, COUNT(*) AS total,
+    {"MAX(name)" if facet == "workflow" else "NULL"} AS label
+FROM queue GROUP BY 2, 3"""
+    for facet, expression in FACETS.items()
+)
+
+
+def migrate_queue_facets(conn):
+    """
+    Item counts per status for every value of the facets (workflow, client, day), kept up to date by triggers
+    like queue_stats so the facets endpoint never scans the queue.
+    """
+    for statement in split_statements(f"""
+        CREATE TABLE IF NOT EXISTS queue_facets (
+            facet  VARCHAR(16) NOT NULL,   -- workflow, client, day
+            value  VARCHAR(255) NOT NULL,  -- workflow_id, client_id, date of created_at ('' if not set)
+            status INTEGER NOT NULL,
+            total  INTEGER NOT NULL DEFAULT 0,
+            label  TEXT,                   -- workflow name
+            PRIMARY KEY (facet, value, status)
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS queue_facets_insert
+        AFTER INSERT ON queue
+        FOR EACH ROW
+        BEGIN{FACETS_INSERT.format(facet_rows("NEW"))}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_facets_update
+        AFTER UPDATE OF status, workflow_id, client_id ON queue
+        FOR EACH ROW
+        WHEN OLD.status IS NOT NEW.status OR OLD.workflow_id IS NOT NEW.workflow_id OR OLD.client_id IS NOT NEW.client_id
+        BEGIN
+{facet_updates("OLD", "-")}{FACETS_INSERT.format(facet_rows("NEW"))}
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_facets_delete
+        AFTER DELETE ON queue
+        FOR EACH ROW
+        BEGIN
+{facet_updates("OLD", "-")}
+        END;
+    """):
+        conn.execute(statement)
+
+    conn.execute("DELETE FROM queue_facets")
+    conn.execute(f"INSERT INTO queue_facets (facet, value, status, total, label) {FACETS_EXPECTED}")
+
+
+# Text indexed for the search filter, extracted from the stored prompt: node types and string input values
+# (model file names, prompts...). Links between nodes are arrays so they are left out.
+SEARCH_NODES = """(SELECT group_concat(value, ' ') FROM json_tree({0}.prompt, '$[2]')
+    WHERE key = 'class_type' AND type = 'text')"""
+SEARCH_INPUTS = """(SELECT group_concat(value, ' ') FROM json_tree({0}.prompt, '$[2]')
+    WHERE key != 'class_type' AND type = 'text' AND typeof(key) = 'text')"""
+
+
+def migrate_search_index(conn):
+    """
+    Full-text index of the items (FTS5) kept up to date by triggers, see QM_Queue.get_filters() for the search filter.
+    It's contentless: the indexed text is extracted from the prompt again when an item is removed from the index.
+    """
+    try:
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS queue_fts USING fts5(name, nodes, inputs, content='')")
+    except sqlite3.OperationalError as e:
+        logging.warning("[Queue Manager] Full-text search is not available (%s), search filter falls back to LIKE", e)
+        return
+
+    for statement in split_statements(f"""
+        CREATE TRIGGER IF NOT EXISTS queue_fts_insert
+        AFTER INSERT ON queue
+        FOR EACH ROW
+        BEGIN
+          INSERT INTO queue_fts (rowid, name, nodes, inputs)
+          VALUES (NEW.id, NEW.name, {SEARCH_NODES.format("NEW")}, {SEARCH_INPUTS.format("NEW")});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_fts_update
+        AFTER UPDATE OF name, prompt ON queue
+        FOR EACH ROW
+        BEGIN
+          INSERT INTO queue_fts (queue_fts, rowid, name, nodes, inputs)
+          VALUES ('delete', OLD.id, OLD.name, {SEARCH_NODES.format("OLD")}, {SEARCH_INPUTS.format("OLD")});
+          INSERT INTO queue_fts (rowid, name, nodes, inputs)
+          VALUES (NEW.id, NEW.name, {SEARCH_NODES.format("NEW")}, {SEARCH_INPUTS.format("NEW")});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_fts_delete
+        AFTER DELETE ON queue
+        FOR EACH ROW
+        BEGIN
+          INSERT INTO queue_fts (queue_fts, rowid, name, nodes, inputs)
+          VALUES ('delete', OLD.id, OLD.name, {SEARCH_NODES.format("OLD")}, {SEARCH_INPUTS.format("OLD")});
+        END;
+    """):
+        conn.execute(statement)
+
+    conn.execute("INSERT INTO queue_fts (queue_fts) VALUES ('delete-all')")
+    conn.execute(
+        f"""
+        INSERT INTO queue_fts (rowid, name, nodes, inputs)
+        SELECT id, name, {SEARCH_NODES.format("queue")}, {SEARCH_INPUTS.format("queue")} FROM queue
+    """
+    )
+
+
+def has_search_index():
+    return read_single("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queue_fts'") is not None
+
+
+def migrate_worker_leases(conn):
+    """
+    Running items claimed by a worker of a shared queue (see QM_Queue.claim_next()) are leased until
+    lease_expires_at (unix time), expired leases are reclaimed by the other workers.
+    """
+    add_column(conn, "queue", "worker_id", "VARCHAR(255)")
+    add_column(conn, "queue", "lease_expires_at", "REAL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_queue_status_lease ON queue(status, lease_expires_at)")
+
+
+# Current unix time in SQL, the timing columns are unix time like the timestamps taken in Python (time.time())
+UNIX_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def migrate_execution_timing(conn):
+    """
+    When items were enqueued, started and finished (unix time). enqueued_at is set by triggers whenever an item becomes
+    pending, started_at and finished_at by QM_Queue.queue_get() / task_done(). Run times are folded into rolling
+    statistics per workflow (workflow_id '' for all workflows) as items finish, see QM_Queue.record_run().
+    """
+    add_column(conn, "queue", "enqueued_at", "REAL")
+    add_column(conn, "queue", "started_at", "REAL")
+    add_column(conn, "queue", "finished_at", "REAL")
+    for statement in split_statements(f"""
+        CREATE TABLE IF NOT EXISTS queue_timing (
+            workflow_id  VARCHAR(255) NOT NULL PRIMARY KEY,  -- '' for all workflows
+            runs         INTEGER NOT NULL DEFAULT 0,
+            mean_seconds REAL,  -- exponentially weighted mean of the run time
+            var_seconds  REAL,  -- and its variance
+            last_seconds REAL,
+            updated_at   DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS queue_enqueued_insert
+        AFTER INSERT ON queue
+        FOR EACH ROW
+        WHEN NEW.status = 0 AND NEW.enqueued_at IS NULL
+        BEGIN
+          UPDATE queue SET enqueued_at = {UNIX_NOW} WHERE rowid = NEW.rowid;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS queue_enqueued_update
+        AFTER UPDATE OF status ON queue
+        FOR EACH ROW
+        WHEN NEW.status = 0 AND OLD.status IS NOT 0
+        BEGIN
+          UPDATE queue SET enqueued_at = {UNIX_NOW}, started_at = NULL, finished_at = NULL WHERE rowid = NEW.rowid;
+        END;
+    """):
+        conn.execute(statement)
+
+    conn.execute("UPDATE queue SET enqueued_at = (julianday(updated_at) - 2440587.5) * 86400.0 WHERE status = 0 AND enqueued_at IS NULL")
+
+
+MIGRATIONS = [
+    migrate_summary_columns,
+    migrate_workflow_blobs,
+    migrate_queue_stats,
+    migrate_search_index,
+    migrate_queue_facets,
+    migrate_worker_leases,
+    migrate_execution_timing,
+]
+
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        with conn:  # transaction, rolled back if the migration fails
+            # Take the write lock before checking the version again, instances sharing the database start together
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                continue
+            logging.info("[Queue Manager] Migrating database: %s", migration.__name__)
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+
+
+# Helper functions to read and write to the database. Statement latencies are recorded in qm_metrics.
 def write_query(query, params=(), commit=True):
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    if commit:
-        conn.commit()
-    return cursor.rowcount
+    with _writer.lock:
+        start = time.perf_counter()
+        cursor = _writer.connection().cursor()
+        cursor.execute(query, params)
+        qm_metrics.observe_statement(query, time.perf_counter() - start)
+        _writer.written(commit)
+        return cursor.rowcount
+
+
+def write_returning(query, params=(), commit=True):
+    """
+    Execute write query with RETURNING clause and return the first returned row.
+    """
+    with _writer.lock:
+        start = time.perf_counter()
+        cursor = _writer.connection().cursor()
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        cursor.fetchall()  # step the statement to completion so it can be committed
+        qm_metrics.observe_statement(query, time.perf_counter() - start)
+        _writer.written(commit)
+        return row
 
 
 def write_many(query, params):
     if params is None:
         params = []
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.executemany(query, params)
-    conn.commit()
-    return cursor.rowcount
+    with _writer.lock:
+        start = time.perf_counter()
+        cursor = _writer.connection().cursor()
+        cursor.executemany(query, params)
+        qm_metrics.observe_statement(query, time.perf_counter() - start)
+        _writer.written(True)
+        return cursor.rowcount
 
 
 def read_query(query, params=()):
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    return cursor.fetchall()
+    start = time.perf_counter()
+    if _writer.dirty:
+        # Uncommitted writes are only visible to the writer connection
+        with _writer.lock:
+            rows = _writer.connection().execute(query, params).fetchall()
+    else:
+        with _pool.connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+    qm_metrics.observe_statement(query, time.perf_counter() - start)
+    return rows
 
 
 def read_single(query, params=()):
-    conn = get_conn()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    return cursor.fetchone()
+    start = time.perf_counter()
+    if _writer.dirty:
+        with _writer.lock:
+            row = _writer.connection().execute(query, params).fetchone()
+    else:
+        with _pool.connection() as conn:
+            cursor = conn.execute(query, params)
+            row = cursor.fetchone()
+            cursor.close()  # reset the statement before the connection goes back to the pool
+    qm_metrics.observe_statement(query, time.perf_counter() - start)
+    return row
@@ -0,0 +1,111 @@
+"""
+JSON codec used for stored prompts, options and HTTP responses.
+
+Encoding and decoding prompts is the dominant CPU cost of the queue manager, so orjson or msgspec is used when
+installed and stdlib json otherwise. Whatever the codec, values it can't handle (e.g. integers beyond 64 bits)
+fall back to stdlib json, and malformed input raises json.JSONDecodeError.
+"""
+
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+CODECS = ["auto", "orjson", "msgspec", "json"]
+
+# Fast codecs decode integers beyond 64 bits as floats, so documents with runs of 19+ digits are decoded with stdlib json.
+# Digits are mapped to "0" and everything else to " " so the check is a plain substring search, a fraction of the decoding time.
+_DIGITS = bytes(ord("0") if chr(i).isdigit() and i < 128 else ord(" ") for i in range(256))
+_LONG_DIGIT_RUN = b"0" * 19
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+
+
+def available_codec():
+    if orjson is not None:
+        return "orjson"
+    if msgspec is not None:
+        return "msgspec"
+    return "json"
+
+
+# Codec in use, see set_codec()
+_codec = available_codec()
+
+
+def set_codec(codec="auto"):
+    global _codec
+    if codec == "auto":
+        codec = available_codec()
+    if codec not in CODECS:
+        logging.warning("[Queue Manager] Unknown JSON codec %s, falling back to json", codec)
+        codec = "json"
+    if (codec == "orjson" and orjson is None) or (codec == "msgspec" and msgspec is None):
+        logging.warning("[Queue Manager] %s is not installed, falling back to json", codec)
+        codec = "json"
+    _codec = codec
+
+
+def get_codec():
+    return _codec
+
+
+def dumps_bytes(obj) -> bytes:
+    """
+    Encode to UTF-8 JSON bytes, e.g. to be passed to aiohttp as the response body as is.
+    """
+    match _codec:
+        case "orjson":
+            try:
+                return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+            except orjson.JSONEncodeError:
+                pass
+        case "msgspec":
+            try:
+                return _msgspec_encoder.encode(obj)
+            except (msgspec.EncodeError, TypeError, OverflowError):
+                pass
+    return json.dumps(obj).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    if _codec == "json":
+        return json.dumps(obj)
+    return dumps_bytes(obj).decode("utf-8")
+
+
+def has_long_integers(data) -> bool:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return _LONG_DIGIT_RUN in bytes(data).translate(_DIGITS)
+
+
+def loads(data):
+    """
+    Decode JSON from str or bytes.
+    """
+    if _codec != "json" and has_long_integers(data):
+        return json.loads(data)
+
+    match _codec:
+        case "orjson":
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                pass  # stdlib either handles it or raises the error
+        case "msgspec":
+            try:
+                return _msgspec_decoder.decode(data)
+            except msgspec.DecodeError:
+                pass
+    return json.loads(data)
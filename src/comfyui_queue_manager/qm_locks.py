@@ -0,0 +1,144 @@
+"""
+Opt-in contention profiling of the native queue mutex (lock_profiling option).
+
+QM_Queue takes the mutex through QM_Queue.locked(site). When profiling is off that returns the lock itself, so the
+only cost is a method call. When on, the time spent waiting to acquire the lock and the time it was held are recorded
+per call site, served by /queue_manager/locks and logged every lock_profiling_log_interval seconds.
+
+Stats are updated while the profiled lock is held, so they need no lock of their own.
+"""
+
+import logging
+import threading
+import time
+
+# Upper bounds (seconds) of the buckets used to estimate percentiles
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class QM_TimingStats:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        index = 0
+        while index < len(BUCKETS) and seconds > BUCKETS[index]:
+            index += 1
+        self.buckets[index] += 1
+
+    def percentile(self, fraction):
+        """
+        Upper bound of the bucket the percentile falls in (max for the last bucket).
+        """
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class QM_ProfiledLock:
+    """
+    Context manager acquiring `lock` (a lock or a Condition) and recording wait and hold time for `site`.
+    hold=False for sites waiting on a condition while holding the lock, where the hold time would mostly be idle time.
+    """
+
+    __slots__ = ("profiler", "lock", "site", "hold", "acquired")
+
+    def __init__(self, profiler, lock, site, hold=True):
+        self.profiler = profiler
+        self.lock = lock
+        self.site = site
+        self.hold = hold
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.acquired = time.perf_counter()
+        self.profiler.site(self.site)[0].add(self.acquired - start)
+        return self.lock
+
+    def __exit__(self, *exc_info):
+        if self.hold:
+            self.profiler.site(self.site)[1].add(time.perf_counter() - self.acquired)
+        self.lock.release()
+        return False
+
+
+class QM_LockProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.log_interval = 60
+        self.sites = {}  # site -> (wait stats, hold stats)
+        self.since = time.time()
+        self.thread = None
+
+    def configure(self, enabled=False, log_interval=60):
+        self.enabled = bool(enabled)
+        self.log_interval = log_interval
+        if self.enabled and self.log_interval and self.thread is None:
+            self.thread = threading.Thread(target=self.logger, name="queue-manager-lock-profiler", daemon=True)
+            self.thread.start()
+
+    def site(self, site):
+        stats = self.sites.get(site)
+        if stats is None:
+            stats = self.sites[site] = (QM_TimingStats(), QM_TimingStats())
+        return stats
+
+    def locked(self, lock, site, hold=True):
+        if not self.enabled:
+            return lock
+        return QM_ProfiledLock(self, lock, site, hold)
+
+    def reset(self):
+        self.sites = {}
+        self.since = time.time()
+
+    def summary(self):
+        """
+        {site: {"wait": {...}, "hold": {...}}} sorted by total wait time, worst first.
+        """
+        sites = sorted(dict(self.sites).items(), key=lambda site: site[1][0].total, reverse=True)
+        return {
+            "enabled": self.enabled,
+            "since": self.since,
+            "sites": {site: {"wait": wait.summary(), "hold": hold.summary()} for site, (wait, hold) in sites},
+        }
+
+    def log_line(self, limit=5):
+        parts = []
+        for site, stats in list(self.summary()["sites"].items())[:limit]:
+            wait, hold = stats["wait"], stats["hold"]
+            parts.append(f"{site} n={wait['count']} wait p99={wait['p99_ms']}ms max={wait['max_ms']}ms hold p99={hold['p99_ms']}ms")
+        return "; ".join(parts)
+
+    def logger(self):
+        while True:
+            time.sleep(self.log_interval or 60)
+            if self.enabled and self.log_interval and self.sites:
+                logging.info("[Queue Manager] Queue lock: %s", self.log_line())
+
+
+profiler = QM_LockProfiler()
@@ -0,0 +1,172 @@
+"""
+Background SQLite maintenance: retention of completed and archived items, WAL checkpoints, incremental vacuum and
+query planner statistics, of the queue database and of the cold tier.
+
+Runs on a low priority daemon thread every maintenance_interval seconds. Each step is short and goes through the
+writer lock (see qm_db.QM_Writer), so job pickup and the HTTP routes only wait for the step in progress, never for
+a whole maintenance run. Only the retention step takes the native queue mutex, one batch of expired items at a time
+(see QM_Queue.expire_items()). What was done is logged and kept in `report` (served by /queue_manager/maintenance).
+"""
+
+import logging
+import os
+import threading
+import time
+
+from . import qm_db
+
+# Pages freed per incremental_vacuum step, the writer lock is released between steps
+VACUUM_STEP_PAGES = 256
+
+# Database files maintained: schema name -> suffix of the actions reported for it
+SCHEMAS = {"main": "", "cold": " of the cold tier"}
+
+
+class QM_Maintenance:
+    def __init__(self, options, queue=None):
+        self.queue = queue
+        self.interval = options.get("maintenance_interval", 30)
+        self.wal_limit = options.get("wal_checkpoint_mb", 16) * 1024 * 1024
+        self.free_pages_limit = options.get("vacuum_free_pages", 1024)
+        self.analyze_interval = options.get("analyze_interval", 3600)
+        self.enabled = options.get("maintenance_enabled", True)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_analyze = 0.0
+        self.report = {
+            "runs": 0,
+            "expired": 0,
+            "checkpoints": 0,
+            "truncated": 0,
+            "vacuumed_pages": 0,
+            "analyzed": 0,
+            "last_run": None,
+            "last_actions": [],
+        }
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.loop, name="queue-manager-maintenance", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def loop(self):
+        try:
+            # Linux schedules threads separately, lower this one's priority so it yields to the executor thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+
+        self.last_analyze = time.monotonic()  # the statistics of a fresh start are fine
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:  # never let maintenance take the queue manager down
+                logging.warning("[Queue Manager] Database maintenance failed: %s", e)
+
+    def step(self, statement):
+        """
+        Run a maintenance statement on the writer connection once pending writes are committed.
+        """
+        writer = qm_db.get_writer()
+        with writer.lock:
+            writer.flush()
+            return writer.connection().execute(statement).fetchall()
+
+    def vacuum_step(self, pages, schema="main"):
+        """
+        Free up to `pages` pages. incremental_vacuum frees one page per sqlite3_step() and returns no rows,
+        so it's run as a script which steps it to completion.
+        """
+        writer = qm_db.get_writer()
+        with writer.lock:
+            writer.flush()
+            writer.connection().executescript(f"PRAGMA {schema}.incremental_vacuum({int(pages)})")
+
+    def wal_size(self, schema="main"):
+        path = qm_db.DB_PATH if schema == "main" else qm_db.cold_path()
+        try:
+            return os.path.getsize(str(path) + "-wal")
+        except OSError:
+            return 0
+
+    def is_idle(self):
+        return qm_db.read_single("SELECT IFNULL(SUM(total), 0) FROM queue_stats WHERE status IN (0, 1) AND workflow_id = ''")[0] == 0
+
+    def checkpoint(self, schema="main"):
+        """
+        WAL: PASSIVE never waits for readers or writers. Once everything is checkpointed the WAL file is truncated,
+        which only happens when no reader is in the middle of a statement.
+        """
+        actions = []
+        wal_size = self.wal_size(schema)
+        if wal_size > self.wal_limit:
+            busy, log, checkpointed = self.step(f"PRAGMA {schema}.wal_checkpoint(PASSIVE)")[0]
+            self.report["checkpoints"] += 1
+            actions.append(f"checkpoint {checkpointed}/{log} frames of {wal_size // 1024} KiB WAL{SCHEMAS[schema]}")
+            if busy == 0 and log == checkpointed:
+                self.step(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)")
+                self.report["truncated"] += 1
+                actions.append(f"WAL{SCHEMAS[schema]} truncated")
+        return actions
+
+    def vacuum(self, schema="main"):
+        """
+        Free pages left by large deletes / archive moves are returned to the file system in small steps.
+        """
+        actions = []
+        auto_vacuum = self.step(f"PRAGMA {schema}.auto_vacuum")[0][0]
+        free_pages = self.step(f"PRAGMA {schema}.freelist_count")[0][0]
+        if free_pages > self.free_pages_limit:
+            if auto_vacuum == 2:  # incremental
+                vacuumed = 0
+                while free_pages > 0 and not self.stop_event.is_set():
+                    self.vacuum_step(VACUUM_STEP_PAGES, schema)
+                    remaining = self.step(f"PRAGMA {schema}.freelist_count")[0][0]
+                    vacuumed += free_pages - remaining
+                    if remaining >= free_pages:
+                        break
+                    free_pages = remaining
+                    time.sleep(0.01)
+                self.report["vacuumed_pages"] += vacuumed
+                actions.append(f"incremental vacuum of {vacuumed} pages{SCHEMAS[schema]}")
+            elif self.is_idle():
+                # Databases created before auto_vacuum was enabled are converted by a full VACUUM,
+                # only when nothing is queued as it blocks writes for its whole duration
+                self.step(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                self.step(f"VACUUM {schema}")
+                actions.append(f"converted to incremental auto vacuum ({free_pages} free pages){SCHEMAS[schema]}")
+        return actions
+
+    def run_once(self):
+        actions = []
+
+        # Expired items move to the cold tier first, so the pages they free are vacuumed in the same run
+        if self.queue is not None:
+            expired = self.queue.expire_items()
+            if expired > 0:
+                self.report["expired"] += expired
+                actions.append(f"moved {expired} expired items to the cold tier")
+
+        for schema in SCHEMAS:
+            actions.extend(self.checkpoint(schema))
+            actions.extend(self.vacuum(schema))
+
+        if self.analyze_interval and time.monotonic() - self.last_analyze >= self.analyze_interval:
+            self.step("PRAGMA optimize")
+            self.last_analyze = time.monotonic()
+            self.report["analyzed"] += 1
+            actions.append("optimize")
+
+        self.report["runs"] += 1
+        self.report["last_run"] = time.time()
+        if actions:
+            self.report["last_actions"] = actions
+            logging.info("[Queue Manager] Database maintenance: %s", ", ".join(actions))
+        return actions
@@ -0,0 +1,189 @@
+"""
+Queue manager metrics in Prometheus text format, served by /queue_manager/metrics.
+
+Counters and histograms are plain Python objects updated in place (a lock and a bisect per observation), cheap enough
+for queue_get() / task_done() and every statement run through the qm_db helpers. Item counts per status are read
+from the queue_stats table when scraped. Collection is toggled with the metrics_enabled option.
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timezone
+from functools import lru_cache
+import re
+import threading
+import time
+
+# Seconds. Statements are usually sub-millisecond, waiting in the queue and running can take hours.
+STATEMENT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LIFECYCLE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600, 12 * 3600, 24 * 3600)
+
+STATUS_NAMES = {0: "pending", 1: "running", 2: "completed", 3: "archived"}
+
+_enabled = True
+
+
+def set_enabled(enabled):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        if not _enabled:
+            return
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total counter"]
+        with self.lock:
+            values = dict(self.values) if self.values or self.labels else {(): 0}
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}_total{format_labels(self.labels, label_values)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        if not _enabled:
+            return
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {label_values: list(values) for label_values, values in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values[:-1]):
+                cumulative += count
+                le = 'le="' + (bound if bound == "+Inf" else format_value(float(bound))) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, label_values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {format_value(float(values[-1]))}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {cumulative}")
+        return lines
+
+
+items_put = Counter("queue_manager_put", "Items put on the queue")
+items_get = Counter("queue_manager_get", "Items handed out for execution")
+items_done = Counter("queue_manager_done", "Items finished")
+items_archived = Counter("queue_manager_archived", "Items moved to the archive")
+items_deleted = Counter("queue_manager_deleted", "Items deleted")
+items_expired = Counter("queue_manager_expired", "Items moved to the cold tier")
+
+wait_seconds = Histogram("queue_manager_wait_seconds", "Time from enqueue (or re-prioritization) to start of execution", LIFECYCLE_BUCKETS)
+run_seconds = Histogram("queue_manager_run_seconds", "Time from start of execution to task_done", LIFECYCLE_BUCKETS)
+statement_seconds = Histogram("queue_manager_db_statement_seconds", "SQLite statement latency", STATEMENT_BUCKETS, ("statement",))
+
+COLLECTORS = [items_put, items_get, items_done, items_archived, items_deleted, items_expired, wait_seconds, run_seconds, statement_seconds]
+
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([\w.]+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def statement_label(query):
+    """
+    Low cardinality label for a statement: its verb and the first table it touches, e.g. "UPDATE queue".
+    """
+    words = query.split(None, 1)
+    if not words:
+        return ""
+    verb = words[0].upper()
+    table = _STATEMENT_TABLE.search(query)
+    return f"{verb} {table.group(1)}" if table is not None else verb
+
+
+def observe_statement(query, seconds):
+    if _enabled:
+        statement_seconds.observe(seconds, statement_label(query))
+
+
+# prompt_id -> perf_counter() when the item was handed out for execution, only running items
+_started = {}
+
+
+def item_started(prompt_id, queued_at=None):
+    """
+    Item handed out by queue_get(). queued_at: its updated_at before it was marked as running (UTC, as stored by SQLite).
+    """
+    if not _enabled:
+        return
+    items_get.inc()
+    _started[prompt_id] = time.perf_counter()
+    if queued_at:
+        try:
+            queued = datetime.fromisoformat(queued_at).replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return
+        wait_seconds.observe(max(time.time() - queued, 0.0))
+
+
+def item_finished(prompt_id):
+    if not _enabled:
+        return
+    items_done.inc()
+    started = _started.pop(prompt_id, None)
+    if started is not None:
+        run_seconds.observe(time.perf_counter() - started)
+
+
+def item_dropped(prompt_id=None):
+    """
+    Running item deleted or interrupted (all of them without prompt_id), it doesn't count as done.
+    """
+    if prompt_id is None:
+        _started.clear()
+    else:
+        _started.pop(prompt_id, None)
+
+
+def render(status_counts):
+    """
+    All metrics in Prometheus text exposition format. status_counts: {status: total} of items currently in the database.
+    """
+    lines = ["# HELP queue_manager_items Items in the database per status", "# TYPE queue_manager_items gauge"]
+    for status, name in STATUS_NAMES.items():
+        lines.append(f'queue_manager_items{{status="{name}"}} {status_counts.get(status, 0)}')
+    for collector in COLLECTORS:
+        lines.extend(collector.render())
+    return "\n".join(lines) + "\n"
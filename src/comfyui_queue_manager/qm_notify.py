@@ -0,0 +1,117 @@
+import threading
+import time
+
+from server import PromptServer
+
+# Pseudo event for PromptServer.queue_updated() (the native "status" broadcast)
+STATUS = "status"
+
+# When events are merged, counters are added up, lists of changes concatenated and the base revision of the first delta
+# kept, other keys keep the latest value (e.g. import progress or revision)
+SUMMED_KEYS = ("total_moved", "deleted")
+FIRST_KEYS = ("base_revision",)
+
+# Merged queue deltas with more changes ask the clients to refetch instead
+MAX_MERGED_CHANGES = 500
+
+
+def merge(payload, data):
+    if data is None:
+        return payload
+    if payload is None:
+        return dict(data)
+    for key, value in data.items():
+        if key in SUMMED_KEYS and key in payload:
+            payload[key] += value
+        elif key in FIRST_KEYS and key in payload:
+            continue
+        elif key == "changes" and key in payload:
+            payload[key] = payload[key] + value
+        elif key == "refetch":
+            payload[key] = payload.get(key, False) or value
+        else:
+            payload[key] = value
+    if payload.get("refetch") or len(payload.get("changes", ())) > MAX_MERGED_CHANGES:
+        payload.pop("changes", None)
+        payload["refetch"] = True
+    return payload
+
+
+class QM_Notifier:
+    """
+    Coalesces queue change broadcasts. Every broadcast makes each open browser refetch the queue, so bursts
+    (an API client enqueueing hundreds of prompts, bulk operations) are merged into at most one broadcast
+    per event per `window` seconds.
+
+    The first event after a quiet window is sent right away. Events arriving within the window are merged
+    (counters added up) and sent once the window has passed. window_ms=0 sends every event as is.
+    """
+
+    def __init__(self, window_ms=250):
+        self.window = max(window_ms, 0) / 1000
+        self.lock = threading.Lock()
+        self.last_sent = {}  # event -> monotonic time of the last broadcast
+        self.pending = {}  # event -> merged payload waiting for the end of the window
+        self.timers = {}  # event -> timer sending the pending payload
+
+    def queue_updated(self):
+        """
+        Coalesced PromptServer.queue_updated().
+        """
+        self.notify(STATUS)
+
+    def send(self, event, data=None):
+        """
+        Coalesced PromptServer.send_sync().
+        """
+        self.notify(event, data)
+
+    def notify(self, event, data=None):
+        if self.window == 0:
+            self.broadcast(event, data)
+            return
+
+        now = time.monotonic()
+        with self.lock:
+            if event not in self.pending and now - self.last_sent.get(event, float("-inf")) >= self.window:
+                self.last_sent[event] = now
+            else:
+                self.pending[event] = merge(self.pending.get(event), data)
+                if event not in self.timers:
+                    delay = self.last_sent[event] + self.window - now
+                    timer = self.timers[event] = threading.Timer(max(delay, 0), self.send_pending, (event,))
+                    timer.daemon = True
+                    timer.start()
+                return
+
+        # PromptServer is called without holding our lock, queue_updated() takes the queue mutex
+        self.broadcast(event, data)
+
+    def send_pending(self, event):
+        with self.lock:
+            self.timers.pop(event, None)
+            if event not in self.pending:
+                return
+            data = self.pending.pop(event)
+            self.last_sent[event] = time.monotonic()
+        self.broadcast(event, data)
+
+    def flush(self):
+        """
+        Send all pending events now (e.g. on shutdown).
+        """
+        with self.lock:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers = {}
+            pending = self.pending
+            self.pending = {}
+        for event, data in pending.items():
+            self.broadcast(event, data)
+
+    @staticmethod
+    def broadcast(event, data=None):
+        if event == STATUS:
+            PromptServer.instance.queue_updated()
+        else:
+            PromptServer.instance.send_sync(event, data)
@@ -1,7 +1,7 @@
 from datetime import datetime
 
 from .qm_db import write_query, read_single
-import json
+from .qm_json import dumps, loads
 
 
 class QM_Options:
@@ -17,9 +17,9 @@ class QM_Options:
             ON CONFLICT(key) DO UPDATE
               SET value = excluded.value;
         """,
-            (key, json.dumps(value)),
+            (key, dumps(value)),
         )
-        self.__options[key] = value
+        self.__options[key] = (value, datetime.now())
 
     def get(self, key, default=None, with_timestamp=False):
         if key in self.__options:
@@ -40,7 +40,7 @@ class QM_Options:
             return_value = default
             timestamp = datetime.now()
         else:
-            return_value = json.loads(value[0]) if value else default
+            return_value = loads(value[0]) if value else default
             timestamp = value[1]
 
         self.__options[key] = (return_value, timestamp)
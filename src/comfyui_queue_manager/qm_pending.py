@@ -0,0 +1,136 @@
+import heapq
+
+from .qm_db import read_query
+from .qm_blobs import unpack_item
+
+
+class QM_PendingIndex:
+    """
+    In-memory head of the pending queue: (number, id) pairs of the `window` highest priority pending items,
+    with the stored prompts of the next `prefetch` of them already fetched, so the next job can be handed out without
+    querying the database. Prompts are decoded one at a time when handed out to keep the cost per job flat.
+
+    Callers must hold the native queue mutex. Bulk changes to pending items call invalidate() and the window
+    is reloaded with a single indexed query on the next use.
+    """
+
+    def __init__(self, window=1000, prefetch=16):
+        self.window = max(window, 1)
+        self.prefetch = max(prefetch, 1)
+        self.invalidate()
+
+    def invalidate(self):
+        self.loaded = False
+        self.heap = []  # (number, id), may contain stale pairs, see entries
+        self.entries = {}  # id -> number of items in the window
+        self.fetched = {}  # id -> (stored prompt, updated_at) of prefetched items
+        self.bound = None  # (number, id) of the last item in the window if the window doesn't hold all pending items
+
+    def load(self):
+        rows = read_query(
+            """
+            SELECT number, id
+            FROM queue
+            WHERE status = 0
+            ORDER BY number, id
+            LIMIT ?
+        """,
+            (self.window + 1,),
+        )
+
+        self.invalidate()
+        self.loaded = True
+        if len(rows) > self.window:
+            rows = rows[: self.window]
+            self.bound = (rows[-1][0], rows[-1][1])
+
+        self.heap = [(row[0], row[1]) for row in rows]  # already sorted so it's a valid heap
+        self.entries = {row[1]: row[0] for row in rows}
+
+    def add(self, number, db_id):
+        """
+        New pending item or pending item with changed priority.
+        """
+        if not self.loaded:
+            return
+
+        self.fetched.pop(db_id, None)
+        if self.bound is not None and (number, db_id) > self.bound:
+            # Beyond the window, it will be picked up when the window is reloaded
+            self.entries.pop(db_id, None)
+            return
+
+        self.entries[db_id] = number
+        heapq.heappush(self.heap, (number, db_id))
+
+    def discard(self, db_id):
+        self.entries.pop(db_id, None)
+        self.fetched.pop(db_id, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def pop_pair(self):
+        """
+        Remove and return (number, id) of the highest priority pending item or None if there are none.
+        """
+        for attempt in range(2):
+            if not self.loaded:
+                self.load()
+
+            while self.heap:
+                number, db_id = heapq.heappop(self.heap)
+                if self.entries.get(db_id) == number:
+                    del self.entries[db_id]
+                    return number, db_id
+
+            if self.bound is None:
+                return None  # window held all pending items
+
+            self.loaded = False  # window exhausted, reload it
+
+        return None
+
+    def pop_item(self):
+        """
+        Remove and return (item, updated_at) of the highest priority pending item or None if there are none.
+        """
+        pair = self.pop_pair()
+        if pair is None:
+            return None
+
+        db_id = pair[1]
+        if db_id not in self.fetched:
+            self.prefetch_items(db_id)
+
+        row = self.fetched.pop(db_id, None)
+        if row is None:
+            return None
+
+        item = unpack_item(row[0])
+
+        # Native format is a tuple
+        item = tuple(item)
+
+        # Backwards compatibility: if item[5] does not exist, create it with empty dict
+        if len(item) < 6:
+            item = item + ({},)
+
+        return item, row[1]
+
+    def prefetch_items(self, first_id):
+        """
+        Fetch stored prompt of the given item together with the next ones in the window in one query.
+        """
+        ids = [first_id] + [pair[1] for pair in heapq.nsmallest(self.prefetch - 1, self.heap) if pair[1] in self.entries]
+        rows = read_query(
+            f"""
+            SELECT id, prompt, updated_at
+            FROM queue
+            WHERE id IN ({",".join("?" * len(ids))}) AND status = 0
+        """,
+            ids,
+        )
+
+        for row in rows:
+            self.fetched[row[0]] = (row[1], row[2])
@@ -1,13 +1,67 @@
+import os
+import socket
 import threading
+import time
 from typing import Optional
 
 from execution import PromptQueue
 from server import PromptServer
 import logging
-import json
 import heapq
-
-from .qm_db import get_conn, read_query, read_single, write_query, write_many
+import math
+
+from .qm_db import (
+    FACETS,
+    FACETS_EXPECTED,
+    QUEUE_STATS_EXPECTED,
+    commit,
+    configure_connections,
+    configure_writer,
+    get_writer,
+    has_search_index,
+    read_query,
+    read_single,
+    write_query,
+    write_many,
+    write_returning,
+)
+from .helpers import item_summary, search_query
+from .qm_blobs import pack_cold_item, pack_item, unpack_cold_item, unpack_item, set_compression
+from .qm_pending import QM_PendingIndex
+from .qm_json import dumps, set_codec
+from .qm_locks import profiler
+from .qm_notify import QM_Notifier
+from . import qm_metrics
+from .inc.exceptions import BadRouteException, BadSelectionException
+
+# Columns returned by listings in summary mode (no prompt JSON decoding)
+SUMMARY_COLUMNS = "id, prompt_id, number, name, workflow_id, client_id, node_count, preview"
+
+# Items inserted per transaction when importing, the queue mutex is released between batches
+IMPORT_BATCH_SIZE = 500
+
+# Changes of a single operation listed in a delta, bigger ones ask the clients to refetch
+DELTA_MAX_CHANGES = 100
+
+# Columns copied between the hot queue and the cold tier (see qm_db.create_cold_schema())
+COLD_COLUMNS = "id, prompt_id, created_at, updated_at, number, name, workflow_id, client_id, node_count, preview, status"
+
+# Items moved to the cold tier per transaction, the queue mutex is released between batches
+EXPIRE_BATCH_SIZE = 500
+
+# Fold a run time into the rolling statistics of a workflow (see record_run()). The weight of a new run is
+# max(alpha, 1 / runs) so the first runs are averaged evenly before the older ones start to fade out.
+TIMING_UPSERT = """
+    INSERT INTO queue_timing (workflow_id, runs, mean_seconds, var_seconds, last_seconds)
+    VALUES (:workflow_id, 1, :seconds, 0, :seconds)
+    ON CONFLICT(workflow_id) DO UPDATE
+      SET runs = runs + 1,
+          mean_seconds = mean_seconds + MAX(:alpha, 1.0 / (runs + 1)) * (:seconds - mean_seconds),
+          var_seconds = (1 - MAX(:alpha, 1.0 / (runs + 1)))
+                        * (var_seconds + MAX(:alpha, 1.0 / (runs + 1)) * (:seconds - mean_seconds) * (:seconds - mean_seconds)),
+          last_seconds = :seconds,
+          updated_at = CURRENT_TIMESTAMP
+"""
 
 
 class QM_Queue:
@@ -15,6 +69,73 @@ class QM_Queue:
         self.queue_manager = queue_manager
         self.restored = False
 
+        set_codec(queue_manager.options.get("json_codec", "auto"))
+        set_compression(queue_manager.options.get("blob_compression", "zlib"))
+        qm_metrics.set_enabled(queue_manager.options.get("metrics_enabled", True))
+        profiler.configure(
+            queue_manager.options.get("lock_profiling", False),
+            queue_manager.options.get("lock_profiling_log_interval", 60),
+        )
+
+        # Read-only connection pool and per connection SQLite settings (see qm_db.QM_ReadPool)
+        configure_connections(
+            queue_manager.options.get("db_read_connections", 4),
+            queue_manager.options.get("db_cache_size_kb", 8192),
+            queue_manager.options.get("db_mmap_size_mb", 64),
+            queue_manager.options.get("db_temp_store", "memory"),
+            queue_manager.options.get("db_cached_statements", 128),
+            queue_manager.options.get("db_busy_timeout_ms", 5000),
+        )
+
+        # Several ComfyUI instances sharing one database (QM_DB_PATH): with QM_SHARED_QUEUE=1 (or the shared_queue option)
+        # each instance claims pending items from the database with a lease, see claim_next() and qm_shared.QM_Heartbeat
+        self.shared = os.environ.get("QM_SHARED_QUEUE", "0") not in ("", "0") or queue_manager.options.get("shared_queue", False)
+        self.worker_id = os.environ.get("QM_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = queue_manager.options.get("lease_seconds", 60)
+        self.poll_interval = queue_manager.options.get("shared_poll_interval", 1.0)
+
+        durability = queue_manager.options.get("durability", "strict")
+        if self.shared and durability != "strict":
+            # grouped commits would hold the database write lock the other instances wait for
+            logging.warning("[Queue Manager] Shared queue uses strict durability")
+            durability = "strict"
+
+        # strict: commit every write, batched: group commits of writes within commit_delay_ms (see QM_Writer)
+        configure_writer(
+            durability,
+            queue_manager.options.get("commit_delay_ms", 50),
+            queue_manager.options.get("commit_max_batch", 256),
+        )
+
+        # Pending items with highest priority kept in memory so picking up next job doesn't need a query.
+        # Not used by a shared queue, other instances change the pending items behind its back.
+        self.pending = QM_PendingIndex(
+            queue_manager.options.get("pending_window", 1000),
+            queue_manager.options.get("pending_prefetch", 16),
+        )
+
+        # Weight of the latest run in the rolling run time statistics per workflow, used to estimate when items start
+        self.eta_smoothing = min(max(float(queue_manager.options.get("eta_smoothing", 0.1)), 0.0), 1.0)
+
+        # Retention of completed and archived items: (max age in days, number of newest items kept), 0 keeps everything.
+        # Expired items are moved to the cold tier (see expire_items()).
+        self.retention = {
+            route: (
+                queue_manager.options.get(f"retention_{route}_days", 0),
+                queue_manager.options.get(f"retention_{route}_count", 0),
+            )
+            for route in ("completed", "archive")
+        }
+
+        # Search filter uses the full-text index unless SQLite was built without FTS5
+        self.search_index = has_search_index()
+
+        # Queue change broadcasts within the window are merged (see QM_Notifier)
+        self.notifier = QM_Notifier(queue_manager.options.get("notify_window_ms", 250))
+
+        # Bumped with every change of the queue (see publish()). Starts from the clock so it keeps growing across restarts.
+        self.revision = time.time_ns() // 1_000_000
+
         self.paused = queue_manager.options.get("queue_paused", False)
         logging.info("[Queue Manager] Queue status: %s", "not paused" if not self.paused else "paused")
 
@@ -24,6 +145,8 @@ class QM_Queue:
         else:
             self.takeover_client = None
 
+        self.native_queue = PromptServer.instance.prompt_queue
+
         if self.paused:
             self.restore_queue(True)
 
@@ -37,7 +160,6 @@ class QM_Queue:
         #
         # ===================================================================
         # ===================================================================
-        self.native_queue = PromptServer.instance.prompt_queue
         self.pause_lock = threading.Condition(self.native_queue.mutex)
 
         # Hijack PromptQueue.get() to get the item marked for execution and mark the item as running in the database
@@ -60,33 +182,53 @@ class QM_Queue:
         self.original_task_done = self.native_queue.task_done
         self.native_queue.task_done = self.task_done
 
+    def locked(self, site, lock=None, hold=True):
+        """
+        The native queue mutex (or `lock`, e.g. pause_lock) to be used in a with statement, profiled under the name `site`
+        when lock profiling is enabled (see qm_locks).
+        """
+        return profiler.locked(self.native_queue.mutex if lock is None else lock, site, hold)
+
     # NOTE: This hijack will make native queue API endpoint to not return pending items.
     # We do this to avoid bottleneck in the native queue when it goes massive
     # and to avoid duplicate bandwidth for requesting queue by execution store and queue manager.
-    def get_current_queue(self, page=0, page_size=0, route="queue", filters=None, return_meta=False):
+    def get_current_queue(
+        self, page=0, page_size=0, route="queue", filters=None, return_meta=False, cursor=None, with_total=True, summary=False, tier="hot"
+    ):
+        """
+        Get a page of the queue for the given route.
+
+        By default, pages are addressed by number (page, page_size) which requires OFFSET scans.
+        If cursor is given (empty for the first page, or the [sort value, id] pair of the last seen item)
+        the next page is fetched with an indexed range scan instead, so cost per page stays constant.
+
+        In summary mode pending items are dicts of the summary columns instead of decoded prompts (see get_item()).
+        Completed and archived items past their retention are listed with tier="cold" (see expire_items()).
+        """
         # logging.info('get_current_queue: %d, %d', page, page_size)
         # Get the first page of the current queue
 
-        with self.native_queue.mutex:
+        if cursor is not None:
+            return self.get_queue_after(cursor, page_size, route, filters, return_meta, with_total, summary, tier)
+
+        table = self.get_table(tier, route)
+        with self.locked("get_current_queue"):
             # Split running and pending jobs into tuple of running and pending tuples
             running = []
             pending = []
             total_rows = 0
             last_page = 0
-            order_string = "ORDER BY number"
+            sort_column = self.get_sort_column(route)
 
-            match route:
-                case "queue":
-                    running.extend(self.native_queue.currently_running.values())
-                case "archive" | "completed":
-                    order_string = "ORDER BY updated_at"
+            if route == "queue":
+                running.extend(self.native_queue.currently_running.values())
 
             where_clauses = [self.get_route_query(route)]
 
-            where_string, params = self.get_filters(filters, where_clauses)
+            where_string, params = self.get_filters(filters, where_clauses, tier=tier)
 
             if page_size > 0:
-                total_rows = read_single(f"""SELECT COUNT(*) FROM queue WHERE {where_string}""", params)[0]
+                total_rows = self.count_items(route, filters, where_string, params, tier)
 
             if total_rows > 0:
                 last_page = (total_rows - 1) // (0 if page_size == 0 else page_size)
@@ -101,25 +243,16 @@ class QM_Queue:
 
                 rows = read_query(
                     f"""
-                    SELECT id, prompt, number
-                    FROM queue
+                    SELECT {SUMMARY_COLUMNS if summary else self.get_item_columns(tier)}
+                    FROM {table}
                     WHERE {where_string}
-                    {order_string}
+                    ORDER BY {sort_column}, id
                     LIMIT ?, ?
                 """,
                     params,
                 )
 
-                # array of prompts
-                for row in rows:
-                    item = json.loads(row[1])
-                    # Add db_id to the item
-                    item[3]["db_id"] = row[0]
-
-                    if route == "queue":
-                        item[0] = row[2]  # set the number to the one from the database
-
-                    pending.append(tuple(item))
+                pending = self.rows_to_summaries(rows) if summary else self.rows_to_items(rows, route, tier)
 
             # If called without parameters, return all three values
 
@@ -132,61 +265,449 @@ class QM_Queue:
                         "page": page,
                         "page_size": page_size,
                         "last_page": last_page,
+                        "revision": self.revision,
                     },
                 )
             else:
                 return running, pending
 
-    def get_full_queue(self, route="queue", filters=None):
-        with self.native_queue.mutex:
-            where_string, params = self.get_filters(filters, [self.get_route_query(route, True)])
+    def get_queue_after(
+        self, cursor, page_size, route="queue", filters=None, return_meta=False, with_total=False, summary=False, tier="hot"
+    ):
+        """
+        Keyset pagination: get up to page_size items sorted after the cursor ([sort value, id] of the last seen item).
+        An empty cursor returns the first page. Running items are only included on the first page of the queue route.
+        """
+        table = self.get_table(tier, route)
+        with self.locked("get_queue_after"):
+            running = []
+            total_rows = None
+            sort_column = self.get_sort_column(route)
+
+            if route == "queue" and len(cursor) == 0:
+                running.extend(self.native_queue.currently_running.values())
+
+            where_clauses = [self.get_route_query(route)]
+            where_string, params = self.get_filters(filters, where_clauses, tier=tier)
+
+            if with_total:
+                total_rows = self.count_items(route, filters, where_string, params, tier)
+
+            if len(cursor) == 2:
+                where_string = f"({where_string}) AND ({sort_column}, id) > (?, ?)"
+                params += tuple(cursor)
 
+            # Fetch one extra row to find out if there is a next page without counting
             rows = read_query(
                 f"""
-                SELECT id, prompt
-                FROM queue
+                SELECT {SUMMARY_COLUMNS if summary else self.get_item_columns(tier)}, {sort_column} AS sort_key
+                FROM {table}
                 WHERE {where_string}
-                ORDER BY created_at DESC
+                ORDER BY {sort_column}, id
+                LIMIT ?
             """,
-                params,
+                params + (page_size + 1,),
             )
 
-            # array of prompts
-            prompts = []
-            for row in rows:
-                item = json.loads(row[1])
-                # Convert the item to a tuple
-                # item = tuple(item)
-                # Add the item to the pending list
-                prompts.append(item)
-            return prompts
+            next_cursor = None
+            if len(rows) > page_size:
+                rows = rows[:page_size]
+                next_cursor = [rows[-1]["sort_key"], rows[-1]["id"]]
+
+            pending = self.rows_to_summaries(rows) if summary else self.rows_to_items(rows, route, tier)
+
+            if return_meta:
+                return (
+                    running,
+                    pending,
+                    {
+                        "total": total_rows,
+                        "page_size": page_size,
+                        "cursor": list(cursor),
+                        "next_cursor": next_cursor,
+                        "revision": self.revision,
+                    },
+                )
+            else:
+                return running, pending
+
+    def count_items(self, route, filters, where_string, params, tier="hot"):
+        """
+        Count items of the route matching the filters. Uses the maintained counters (see queue_stats table) when they can answer it.
+        """
+        if tier == "cold":
+            return read_single(f"""SELECT COUNT(*) FROM cold.queue WHERE {where_string}""", params)[0]
+
+        if filters is None or filters.keys() <= {"workflow"}:
+            workflow_id = filters["workflow"]["value"] if filters else ""
+            row = read_single(
+                """
+                SELECT total
+                FROM queue_stats
+                WHERE status = ? AND workflow_id = ?
+            """,
+                (self.get_route_status(route), workflow_id),
+            )
+            return row[0] if row is not None else 0
+
+        return read_single(f"""SELECT COUNT(*) FROM queue WHERE {where_string}""", params)[0]
+
+    def get_item_columns(self, tier="hot"):
+        # Columns decoded by rows_to_items(), prompts of the cold tier are compressed with their codec
+        return "id, prompt, number" if tier == "hot" else "id, prompt, number, codec"
+
+    def rows_to_items(self, rows, route="queue", tier="hot"):
+        """
+        Decode rows of get_item_columns() into native-like queue item tuples with db_id set.
+        """
+        items = []
+        for row in rows:
+            item = unpack_item(row[1]) if tier == "hot" else unpack_cold_item(row[3], row[1])
+            # Add db_id to the item
+            item[3]["db_id"] = row[0]
+
+            if route == "queue":
+                item[0] = row[2]  # set the number to the one from the database
+
+            items.append(tuple(item))
+        return items
+
+    def rows_to_summaries(self, rows):
+        """
+        Convert rows of SUMMARY_COLUMNS into summary dicts.
+        """
+        return [
+            {
+                "db_id": row["id"],
+                "prompt_id": row["prompt_id"],
+                "number": row["number"],
+                "name": row["name"],
+                "workflow_id": row["workflow_id"],
+                "client_id": row["client_id"],
+                "node_count": row["node_count"],
+                "preview": row["preview"],
+            }
+            for row in rows
+        ]
+
+    def get_item(self, db_id, tier="hot"):
+        """
+        Get the full item (as stored in the database) by its database id or None if it doesn't exist.
+        """
+        row = read_single(
+            f"""
+            SELECT {self.get_item_columns(tier)}
+            FROM {self.get_table(tier)}
+            WHERE id = ?
+        """,
+            (db_id,),
+        )
+        if row is None:
+            return None
+
+        return list(self.rows_to_items([row], "item", tier)[0])
+
+    def get_full_queue(self, route="queue", filters=None, tier="hot"):
+        prompts = []
+        for chunk in self.iter_full_queue(route, filters, tier=tier):
+            prompts.extend(chunk)
+        return prompts
+
+    def iter_full_queue(self, route="queue", filters=None, chunk_size=500, tier="hot"):
+        """
+        Yield all items of the route (running items included for the queue route) as lists of up to chunk_size decoded prompts,
+        newest first. Each chunk is a keyset range scan of its own, so memory use doesn't grow with the size of the queue
+        and the queue mutex is released between chunks. The route and tier are checked right away, before the first chunk.
+        """
+        return self.iter_table_chunks(self.get_table(tier, route), route, filters, chunk_size, tier)
+
+    def iter_table_chunks(self, table, route, filters, chunk_size, tier):
+        statuses = [1, 0] if route == "queue" else [self.get_route_status(route)]
+        for status in statuses:
+            last = None
+            while True:
+                where_clauses = ["status = ?"]
+                params = [status]
+                if last is not None:
+                    where_clauses.append("(created_at, id) < (?, ?)")
+                    params.extend(last)
+
+                where_string, params = self.get_filters(filters, where_clauses, params, tier)
+
+                with self.locked("iter_full_queue"):
+                    rows = read_query(
+                        f"""
+                        SELECT {self.get_item_columns(tier)}, created_at
+                        FROM {table}
+                        WHERE {where_string}
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT ?
+                    """,
+                        params + (chunk_size,),
+                    )
+
+                if len(rows) == 0:
+                    break
+
+                yield [unpack_item(row[1]) if tier == "hot" else unpack_cold_item(row["codec"], row[1]) for row in rows]
+
+                if len(rows) < chunk_size:
+                    break
+                last = (rows[-1]["created_at"], rows[-1][0])
+
+    def publish(self, changes=None):
+        """
+        Bump the queue revision and push the changes to the clients as a queue-manager-queue-delta event, so they can
+        patch their view in place. Each change is one of
+            {"op": "insert", "item": {summary, "status"}}  (new item, or replaced if the prompt_id is already listed)
+            {"op": "move", "prompt_id", "status", "number"}
+            {"op": "remove", "prompt_id"}
+        Without changes (bulk operations) the clients are asked to refetch. Clients whose revision doesn't match the
+        base_revision of a delta missed an event and refetch as well. Callers must hold the queue mutex.
+        """
+        base_revision = self.revision
+        self.revision += 1
+        delta = {"base_revision": base_revision, "revision": self.revision}
+        if changes is None or len(changes) > DELTA_MAX_CHANGES:
+            delta["refetch"] = True
+        else:
+            delta["changes"] = changes
+        self.notifier.send("queue-manager-queue-delta", delta)
 
     def get_tasks_remaining(self):
-        with self.native_queue.mutex:
+        with self.locked("get_tasks_remaining"):
             # Get the number of tasks remaining in the database
 
             return read_single("""
-                SELECT COUNT(*)
-                FROM queue
-                WHERE status = 0 OR status = 1
+                SELECT IFNULL(SUM(total), 0)
+                FROM queue_stats
+                WHERE status IN (0, 1) AND workflow_id = ''
             """)[0]  # total
 
+    def get_status_counts(self):
+        """
+        Number of items per status, {status: total}.
+        """
+        rows = read_query("SELECT status, total FROM queue_stats WHERE workflow_id = ''")
+        return {row[0]: row[1] for row in rows}
+
+    def get_facets(self, facets=None, status=None):
+        """
+        Item counts per value of each facet (workflow, client, day) from the maintained counters (see queue_facets table):
+        {facet: [{"value", "label", "total", "statuses": {status name: total}}]}, biggest first.
+        Only items with the given status are counted if status is set.
+        """
+        result = {}
+        for facet in FACETS if facets is None else [facet for facet in facets if facet in FACETS]:
+            rows = read_query(
+                """
+                SELECT value, status, total, label
+                FROM queue_facets
+                WHERE facet = ? AND total > 0
+            """,
+                (facet,),
+            )
+            groups = {}
+            for row in rows:
+                if status is not None and row[1] != status:
+                    continue
+                group = groups.setdefault(row[0], {"value": row[0], "label": None, "total": 0, "statuses": {}})
+                group["total"] += row[2]
+                group["statuses"][qm_metrics.STATUS_NAMES.get(row[1], str(row[1]))] = row[2]
+                group["label"] = group["label"] or row[3]
+            result[facet] = sorted(groups.values(), key=lambda group: (-group["total"], group["value"]))
+        return result
+
+    def repair_facets(self):
+        """
+        Reconcile the maintained counters (queue_facets and queue_stats) with the queue table, e.g. after the database
+        was edited by hand. Scans the whole queue. Returns the number of counters which were wrong, per table.
+        """
+        with self.locked("repair_facets"):
+            repaired = {}
+            # table, its columns (key columns first, then total), query computing them from the queue table
+            for table, key_length, columns, expected_query in (
+                ("queue_facets", 3, "facet, value, status, total, label", FACETS_EXPECTED),
+                ("queue_stats", 2, "status, workflow_id, total", QUEUE_STATS_EXPECTED),
+            ):
+                expected = {tuple(row[:key_length]): row[key_length] for row in read_query(expected_query)}
+                actual = {tuple(row[:key_length]): row[key_length] for row in read_query(f"SELECT {columns} FROM {table} WHERE total != 0")}
+                repaired[table] = sum(1 for key in expected.keys() | actual.keys() if expected.get(key, 0) != actual.get(key, 0))
+
+                if repaired[table] > 0:
+                    logging.warning("[Queue Manager] Repairing %d wrong counter(s) in %s", repaired[table], table)
+                    write_query(f"DELETE FROM {table}", commit=False)
+                    write_query(f"INSERT INTO {table} ({columns}) {expected_query}", commit=False)
+            commit()
+            return repaired
+
+    def record_run(self, row, finished_at):
+        """
+        Fold the run time of a finished item (row: its workflow_id, started_at) into the rolling statistics of its workflow
+        and of all workflows (see qm_db.migrate_execution_timing()). O(1) per item, so estimates never scan the history.
+        Commits the pending "finished" transition of the item either way.
+        """
+        if row is None or row[1] is None:
+            commit()
+            return
+
+        seconds = max(finished_at - row[1], 0.0)
+        write_many(
+            TIMING_UPSERT,
+            [{"workflow_id": workflow_id, "seconds": seconds, "alpha": self.eta_smoothing} for workflow_id in {"", row[0] or ""}],
+        )
+
+    def get_timing_stats(self):
+        """
+        Rolling run time statistics per workflow ('' for all workflows), most runs first.
+        """
+        rows = read_query("""
+            SELECT workflow_id, runs, mean_seconds, var_seconds, last_seconds, updated_at
+            FROM queue_timing
+            ORDER BY runs DESC, workflow_id
+        """)
+        return [
+            {
+                "workflow_id": row[0],
+                "runs": row[1],
+                "mean_seconds": row[2],
+                "stddev_seconds": math.sqrt(max(row[3], 0.0)),
+                "last_seconds": row[4],
+                "updated_at": row[5],
+            }
+            for row in rows
+        ]
+
+    def get_eta(self):
+        """
+        Estimate when the queue drains from the rolling run time statistics (see record_run()) and the maintained item
+        counts (queue_stats), so the cost doesn't depend on the queue length:
+            {"pending", "running", "workers", "mean_seconds", "running_seconds", "eta_seconds", "eta_at", "timestamp"}
+        running_seconds is the expected remaining time of the running items. Workflows which never finished are expected
+        to take the mean of all workflows. The estimates are None until the first item finished.
+        """
+        now = time.time()
+        row = read_single("SELECT mean_seconds FROM queue_timing WHERE workflow_id = ''")
+        mean = row[0] if row is not None else None
+
+        pending = 0
+        known_count = 0
+        known_seconds = 0.0
+        for row in read_query("""
+            SELECT s.workflow_id, s.total, t.mean_seconds
+            FROM queue_stats s
+            LEFT JOIN queue_timing t ON t.workflow_id = s.workflow_id
+            WHERE s.status = 0 AND s.total > 0
+        """):
+            if row[0] == "":
+                pending = row[1]
+            elif row[2] is not None:
+                known_count += row[1]
+                known_seconds += row[1] * row[2]
+
+        running = read_query(
+            """
+            SELECT q.started_at, IFNULL(t.mean_seconds, ?), q.worker_id
+            FROM queue q
+            LEFT JOIN queue_timing t ON t.workflow_id = q.workflow_id
+            WHERE q.status = 1
+        """,
+            (mean,),
+        )
+        # Workers of a shared queue run items in parallel
+        workers = max(len({row[2] for row in running}), 1) if self.shared else 1
+
+        eta = {"pending": pending, "running": len(running), "workers": workers, "mean_seconds": mean, "timestamp": now}
+        if mean is None:
+            eta.update(running_seconds=None, eta_seconds=0.0 if pending + len(running) == 0 else None, eta_at=None)
+            return eta
+
+        running_seconds = sum(max(row[1] - (now - (row[0] or now)), 0.0) for row in running)
+        eta_seconds = (running_seconds + known_seconds + (pending - known_count) * mean) / workers
+        eta.update(running_seconds=running_seconds, eta_seconds=eta_seconds, eta_at=now + eta_seconds)
+        return eta
+
+    def get_expected_starts(self, db_ids, eta=None):
+        """
+        Expected start (unix time) of pending items, {db_id: expected_start}. The expected run times of the items ahead
+        of the first one are summed up by SQLite, which reads every pending item ahead of it (an indexed range scan),
+        so this is computed on demand (see /queue_manager/eta), never for listings.
+        """
+        if eta is None:
+            eta = self.get_eta()
+        if len(db_ids) == 0 or eta["mean_seconds"] is None:
+            return {}
+
+        positions = read_query(
+            """
+            SELECT number, id
+            FROM queue
+            WHERE id IN (SELECT value FROM json_each(?)) AND status = 0
+            ORDER BY number, id
+        """,
+            (dumps(list(db_ids)),),
+        )
+        if len(positions) == 0:
+            return {}
+
+        first, last = tuple(positions[0]), tuple(positions[-1])
+        ahead = read_single(
+            """
+            SELECT IFNULL(SUM(IFNULL(t.mean_seconds, ?)), 0)
+            FROM queue q
+            LEFT JOIN queue_timing t ON t.workflow_id = q.workflow_id
+            WHERE q.status = 0 AND (q.number, q.id) < (?, ?)
+        """,
+            (eta["mean_seconds"], *first),
+        )[0]
+        # Items between the requested ones count as well
+        rows = read_query(
+            """
+            SELECT q.id, IFNULL(t.mean_seconds, ?)
+            FROM queue q
+            LEFT JOIN queue_timing t ON t.workflow_id = q.workflow_id
+            WHERE q.status = 0 AND (q.number, q.id) >= (?, ?) AND (q.number, q.id) <= (?, ?)
+            ORDER BY q.number, q.id
+        """,
+            (eta["mean_seconds"], *first, *last),
+        )
+
+        wanted = {row[1] for row in positions}
+        starts = {}
+        for row in rows:
+            if row[0] in wanted:
+                starts[row[0]] = eta["timestamp"] + (eta["running_seconds"] + ahead) / eta["workers"]
+            ahead += row[1]
+        return starts
+
     def task_done(self, item_id, history_result, status: Optional["PromptQueue.ExecutionStatus"], process_item=None):
-        with self.native_queue.mutex:
+        with self.locked("task_done"):
             # Mark the task as finished in the database
 
             # Get the running item from the native queue dictionary
             item = self.native_queue.currently_running.get(item_id, None)
             if item is not None:
-                # Mark the item as finished in the database
-                write_query(
+                # Mark the item as finished in the database. Items of a shared queue only if this worker still holds
+                # the claim, i.e. the lease wasn't reclaimed by another worker meanwhile.
+                worker_id = self.worker_id if self.shared else None
+                finished_at = time.time()
+                row = write_returning(
                     """
                     UPDATE queue
-                    SET status = 2
-                    WHERE prompt_id = ?
+                    SET status = 2, lease_expires_at = NULL, finished_at = ?
+                    WHERE prompt_id = ? AND (? IS NULL OR worker_id = ?)
+                    RETURNING workflow_id, started_at
                 """,
-                    (item[1],),
+                    (finished_at, item[1], worker_id, worker_id),
+                    commit=False,
                 )
+                self.record_run(row, finished_at)
+                if row is not None:
+                    qm_metrics.item_finished(item[1])
+                    self.publish([{"op": "move", "prompt_id": item[1], "status": 2, "number": item[0]}])
+                else:
+                    # deleted while running (the delete published its removal), or reclaimed by another worker
+                    qm_metrics.item_dropped(item[1])
                 # logging.info("[Queue Manager] Workflow finished: %s at %s", item[1], item[0])
 
                 # Call the original task_done method
@@ -199,9 +720,11 @@ class QM_Queue:
     # Put item for execution
     # NOTE: We keep only up to one item in native "pending" queue (to avoid bottleneck for large queues).
     def queue_put(self, item):  # comfy server calls this method
-        # logging.info(json.dumps(item))
+        # logging.info(dumps(item))
+
+        with self.locked("queue_put"):
+            qm_metrics.items_put.inc()
 
-        with self.native_queue.mutex:
             # if item[3]["extra_pnginfo"] is not set then we pass it to original put
             # It suggests request does not come from ComfyUI but from external source (like API or some app's plugin) - as such they won't benefit from queue manager features
             if "extra_pnginfo" not in item[3] or "workflow" not in item[3]["extra_pnginfo"]:
@@ -209,51 +732,64 @@ class QM_Queue:
                 self.original_put(tuple(item))
                 return
 
-            # Add the item to the database
-            write_query(
+            summary = item_summary(item)
+            prompt, workflow_hash = pack_item(item)
+
+            # Add the item to the database (replacing the existing one with the same prompt_id)
+            row = write_returning(
                 """
-                INSERT OR REPLACE INTO queue (prompt_id, number, name, workflow_id, prompt)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT INTO queue (prompt_id, number, name, workflow_id, prompt, client_id, node_count, preview, workflow_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(prompt_id) DO UPDATE
+                  SET number = excluded.number, name = excluded.name, workflow_id = excluded.workflow_id, prompt = excluded.prompt,
+                      client_id = excluded.client_id, node_count = excluded.node_count, preview = excluded.preview,
+                      workflow_hash = excluded.workflow_hash, status = 0
+                RETURNING id
             """,
                 (
                     item[1],
                     item[0],
-                    item[3]["extra_pnginfo"]["workflow"]["workflow_name"],
-                    item[3]["extra_pnginfo"]["workflow"]["id"],
-                    json.dumps(item),
+                    summary["name"],
+                    summary["workflow_id"],
+                    prompt,
+                    summary["client_id"],
+                    summary["node_count"],
+                    summary["preview"],
+                    workflow_hash,
                 ),
             )
 
+            if not self.shared:
+                self.pending.add(item[0], row[0])
+            self.publish(
+                [
+                    {
+                        "op": "insert",
+                        "item": {"db_id": row[0], "prompt_id": item[1], "number": item[0], **summary, "status": 0},
+                    }
+                ]
+            )
+
             # logging.info("[Queue Manager] Workflow queued: %s at %s", item[1], item[0])
 
+            if self.shared:
+                # whichever instance asks first claims the item with highest priority (see queue_get_shared())
+                self.native_queue.not_empty.notify()
+                self.notifier.queue_updated()
             # Is there's no pending item in the native heap nd we are not paused then add item with highest priority (could be this one)
-            if len(self.native_queue.queue) == 0 and not self.paused:
-                # get item from database which has highest priority and higher than this
-                item = read_single(
-                    """
-                    SELECT number, prompt
-                    FROM queue
-                    WHERE status = 0 AND number <= ?
-                    ORDER BY number
-                    LIMIT 1
-                """,
-                    (item[0],),
-                )
-
-                if item is not None:
-                    # Convert the item to a tuple
-                    item = tuple(json.loads(item[1]))
+            elif len(self.native_queue.queue) == 0 and not self.paused:
+                entry = self.pending.pop_item()
 
-                    # Backwards compatibility: if item[5] does not exist, create it with empty dict
-                    if len(item) < 6:
-                        item = item + ({},)
-
-                    self.original_put(item)
+                if entry is not None:
+                    self.original_put(entry[0])
             else:  # just notify frontend that we have a new item
-                PromptServer.instance.queue_updated()
+                self.notifier.queue_updated()
 
     def queue_get(self, timeout=None):
-        with self.pause_lock:
+        if self.shared:
+            return self.queue_get_shared(timeout)
+
+        with self.locked("queue_get", self.pause_lock, hold=False):
             while self.paused:
                 self.pause_lock.wait(timeout=timeout)
                 if timeout is not None and self.paused:  # if timed out and we are still paused
@@ -265,30 +801,17 @@ class QM_Queue:
                 if self.native_queue.task_counter == 0 and len(self.native_queue.currently_running) == 0:
                     self.restore_queue(True)
 
-                # Get the item with highest priority from the queue in database
-                item_db = read_single("""
-                    SELECT number, prompt, updated_at
-                    FROM queue
-                    WHERE status = 0
-                    ORDER BY number
-                    LIMIT 1
-                """)
+                # Get the item with highest priority from the pending index (prefetched from the database)
+                entry = self.pending.pop_item()
 
-                if item_db is not None:
-                    item = json.loads(item_db[1])
+                if entry is not None:
+                    item, updated_at = entry
 
                     # SIML: TODO: Perhaps use different column to check timestamp? i.e. queued_at since item might be updated for other reasons?
                     # If we have takeover client then we need to set the client_id in the prompt
-                    if self.takeover_client and self.takeover_client["timestamp"] > item_db[2]:
+                    if self.takeover_client and self.takeover_client["timestamp"] > updated_at:
                         item[3]["client_id"] = self.takeover_client["client_id"]
 
-                    # Native format is a tuple
-                    item = tuple(item)
-
-                    # Backwards compatibility: if item[5] does not exist, create it with empty dict
-                    if len(item) < 6:
-                        item = item + ({},)
-
                     heapq.heappush(self.native_queue.queue, item)
 
             queue_item = self.original_get(
@@ -296,15 +819,19 @@ class QM_Queue:
             )  # Wait for an item to be available in the queue (either one from the database (above) or wait for put())
 
             if queue_item is not None:
-                # Mark the item as running in the database
-                write_query(
+                # Mark the item as running in the database. RETURNING reports the row before the updated_at trigger,
+                # i.e. when the item was enqueued or re-prioritized
+                row = write_returning(
                     """
                     UPDATE queue
-                    SET status = 1
+                    SET status = 1, started_at = ?, finished_at = NULL
                     WHERE prompt_id = ?
+                    RETURNING updated_at
                 """,
-                    (queue_item[0][1],),
+                    (time.time(), queue_item[0][1]),
                 )
+                qm_metrics.item_started(queue_item[0][1], row[0] if row is not None else None)
+                self.publish([{"op": "move", "prompt_id": queue_item[0][1], "status": 1, "number": queue_item[0][0]}])
                 # logging.info(
                 #     "[Queue Manager] Executing workflow: \033[33m%s\033[0m at %s",
                 #     queue_item[0][3]["extra_pnginfo"]["workflow"]["workflow_name"],
@@ -315,12 +842,121 @@ class QM_Queue:
                 # No item in the queue
                 return None
 
+    def queue_get_shared(self, timeout=None):
+        """
+        queue_get() of a shared queue: the pending item with highest priority is claimed from the database (see claim_next())
+        right before it's handed out. Items put by other instances don't wake this one up, so the database is polled
+        every poll_interval seconds while waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.locked("queue_get", self.pause_lock, hold=False):
+            while True:
+                while self.paused:
+                    self.pause_lock.wait(timeout=timeout)
+                    if timeout is not None and self.paused:
+                        return None
+
+                claimed = None
+                # Items which are not in the database (external API requests) wait in the native heap
+                if len(self.native_queue.queue) == 0:
+                    if self.native_queue.task_counter == 0 and len(self.native_queue.currently_running) == 0:
+                        self.restore_queue(True)
+
+                    claimed = self.claim_next()
+                    if claimed is not None:
+                        item, updated_at = claimed
+                        if self.takeover_client and self.takeover_client["timestamp"] > updated_at:
+                            item[3]["client_id"] = self.takeover_client["client_id"]
+                        heapq.heappush(self.native_queue.queue, item)
+
+                if len(self.native_queue.queue) > 0:
+                    queue_item = self.original_get(timeout)
+                    qm_metrics.item_started(queue_item[0][1], claimed[1] if claimed is not None else None)
+                    if claimed is not None:
+                        self.publish([{"op": "move", "prompt_id": queue_item[0][1], "status": 1, "number": queue_item[0][0]}])
+                    return queue_item
+
+                remaining = self.poll_interval if deadline is None else min(self.poll_interval, deadline - time.monotonic())
+                if remaining <= 0:
+                    return None
+                self.native_queue.not_empty.wait(remaining)
+
+    def claim_next(self):
+        """
+        Claim the pending item with highest priority for this worker of a shared queue: it's marked as running with a lease
+        of lease_seconds, which the heartbeat extends while it runs (see extend_leases()). A single statement,
+        so two workers never claim the same item. Returns (item, updated_at) or None if nothing is pending.
+        """
+        row = write_returning(
+            """
+            UPDATE queue
+            SET status = 1, worker_id = ?, lease_expires_at = ?, started_at = ?, finished_at = NULL
+            WHERE id = (SELECT id FROM queue WHERE status = 0 ORDER BY number, id LIMIT 1)
+            RETURNING prompt, updated_at
+        """,
+            (self.worker_id, time.time() + self.lease_seconds, time.time()),
+        )
+        if row is None:
+            return None
+
+        item = tuple(unpack_item(row[0]))
+        # Backwards compatibility: if item[5] does not exist, create it with empty dict
+        if len(item) < 6:
+            item = item + ({},)
+        return item, row[1]
+
+    def extend_leases(self):
+        """
+        Extend the leases of the items this worker is running (shared queue, called by qm_shared.QM_Heartbeat).
+        """
+        with self.locked("extend_leases"):
+            running = [item[1] for item in self.native_queue.currently_running.values()]
+        if len(running) == 0:
+            return 0
+
+        return write_query(
+            """
+            UPDATE queue
+            SET lease_expires_at = ?
+            WHERE prompt_id IN (SELECT value FROM json_each(?)) AND status = 1 AND worker_id = ?
+        """,
+            (time.time() + self.lease_seconds, dumps(running), self.worker_id),
+        )
+
+    def reclaim_expired(self):
+        """
+        Put running items whose lease expired (their worker crashed or hangs) back to pending, keeping their priority.
+        """
+        with self.locked("reclaim_expired"):
+            reclaimed = write_query(
+                """
+                UPDATE queue
+                SET status = 0, worker_id = NULL, lease_expires_at = NULL
+                WHERE status = 1 AND lease_expires_at < ?
+            """,
+                (time.time(),),
+            )
+            if reclaimed > 0:
+                logging.warning("[Queue Manager] Reclaimed %d item(s) with expired lease", reclaimed)
+                self.publish()
+                self.notifier.queue_updated()
+                self.native_queue.not_empty.notify()
+            return reclaimed
+
+    def external_changes(self):
+        """
+        Another instance sharing the database changed the queue: clients refetch and a waiting queue_get() looks for new items.
+        """
+        with self.locked("external_changes"):
+            self.publish()
+            self.native_queue.not_empty.notify()
+
     # ===========================================================
     # ================== NON-HIJACK METHODS =====================
     # ===========================================================
 
     def toggle_playback(self):
-        with self.pause_lock:
+        with self.locked("toggle_playback", self.pause_lock):
             # Toggle the playback of the queue
             self.paused = not self.paused
             logging.info("[Queue Manager] Queue " + ("paused." if self.paused else "play."))
@@ -340,7 +976,8 @@ class QM_Queue:
             else:
                 # remove the pending item from the native queue if we are paused
                 self.native_queue.queue = []
-                PromptServer.instance.queue_updated()
+                self.pending.invalidate()
+                self.notifier.queue_updated()
                 # native queue might also be locked waiting for an item to be available
                 # we need to notify it to wake up so it can move on, and so we can reach the pause lock
                 # and avoid executing a new item while we are paused
@@ -350,38 +987,41 @@ class QM_Queue:
         """
         Delete items from the database
         """
-        with self.native_queue.mutex:
-            logging.info("[Queue Manager] Deleting items from queue: %s", items)
-            # Delete the item from the database
-
-            deleted = 0
-            for item in items:
-                deleted += write_query(
-                    """
-                    DELETE FROM queue
-                    WHERE prompt_id = ?
-                """,
-                    (item,),
-                    False,
-                )
-
-            get_conn().commit()
+        with self.locked("delete_items"):
+            logging.info("[Queue Manager] Deleting %d item(s) from queue", len(items))
+            # Delete the items from the database, prompt ids are bound as one JSON array
+            deleted = write_query(
+                """
+                DELETE FROM queue
+                WHERE prompt_id IN (SELECT value FROM json_each(?))
+            """,
+                (dumps(items),),
+            )
 
+            qm_metrics.items_deleted.inc(deleted)
+            for prompt_id in items:
+                qm_metrics.item_dropped(prompt_id)
             if deleted > 0:
-                PromptServer.instance.queue_updated()
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"deleted": deleted})
+                self.pending.invalidate()
+                self.publish([{"op": "remove", "prompt_id": prompt_id} for prompt_id in items])
+                self.notifier.queue_updated()
+                self.notifier.send("queue-manager-queue-updated", {"deleted": deleted})
 
     def wipe_queue(self):
-        with self.native_queue.mutex:
+        with self.locked("wipe_queue"):
             # Wipe the queue from the database
-            write_query("""
+            deleted = write_query("""
                 DELETE FROM queue
                 WHERE status = 0
             """)
+            qm_metrics.items_deleted.inc(deleted)
+            self.pending.invalidate()
+            if deleted > 0:
+                self.publish()
 
     # Set status of pending and running items to 3 (archived)
     def archive_queue(self, filters=None):
-        with self.native_queue.mutex:
+        with self.locked("archive_queue"):
             where_string, params = self.get_filters(filters, ["status = 0"])
 
             # Archive the queue from the database
@@ -393,16 +1033,19 @@ class QM_Queue:
             """,
                 params,
             )
+            qm_metrics.items_archived.inc(total)
 
             # remove the items from the native queue and heapify queue
             self.native_queue.queue = []
             heapq.heapify(self.native_queue.queue)
+            self.pending.invalidate()
 
             # If affected any rows notify the frontend that the queue and archive have been archived
             if total > 0:
                 logging.info("[Queue Manager] Queue Archived: %d item(s)", total)
-                PromptServer.instance.queue_updated()
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"total_moved": total})
+                self.publish()
+                self.notifier.queue_updated()
+                self.notifier.send("queue-manager-queue-updated", {"total_moved": total})
             else:
                 logging.info("[Queue Manager] No items to archive")
 
@@ -412,192 +1055,397 @@ class QM_Queue:
         """
         Archive items from the database
         """
-        with self.native_queue.mutex:
-            # Archive the item from the database
+        return self.archive_selection({"ids": items})
 
-            archived = 0
-            for item in items:
-                archived += write_query(
-                    """
-                    UPDATE queue
-                    SET status = 3
-                    WHERE id = ?
-                """,
-                    (item,),
-                    False,
-                )
+    def archive_selection(self, selection):
+        """
+        Archive all items of the selection (see get_selection()) with a single statement
+        """
+        if isinstance(selection, dict) and selection.get("tier", "hot") != "hot":
+            raise BadSelectionException("Invalid selection: items of the cold tier can only be played or deleted")
+
+        with self.locked("archive_selection"):
+            where_string, params = self.get_selection(selection)
 
-            get_conn().commit()
+            archived = write_query(
+                f"""
+                UPDATE queue
+                SET status = 3
+                WHERE {where_string}
+            """,
+                params,
+            )
+            qm_metrics.items_archived.inc(archived)
 
             if archived > 0:
+                # the item waiting in the native queue might have been archived, next one is taken from the pending index
+                self.native_queue.queue = []
+                self.pending.invalidate()
                 logging.info("[Queue Manager] Queue Item Archived: %d item(s)", archived)
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"total_moved": archived})
+                self.publish()
+                self.notifier.send("queue-manager-queue-updated", {"total_moved": archived})
 
             return archived
 
+    def delete_selection(self, selection):
+        """
+        Delete all items of the selection (see get_selection()) with a single statement
+        """
+        with self.locked("delete_selection"):
+            where_string, params = self.get_selection(selection)
+
+            deleted = write_query(
+                f"""
+                DELETE FROM {self.get_table(selection.get("tier", "hot"), selection.get("route", None))}
+                WHERE {where_string}
+            """,
+                params,
+            )
+            qm_metrics.items_deleted.inc(deleted)
+
+            if deleted > 0:
+                self.native_queue.queue = []
+                self.pending.invalidate()
+                logging.info("[Queue Manager] Deleted %d item(s)", deleted)
+                self.publish()
+                self.notifier.queue_updated()
+                self.notifier.send("queue-manager-queue-updated", {"deleted": deleted})
+
+            return deleted
+
     def delete_running(self, prompt_id=None):
-        with self.native_queue.mutex:
-            # Interrupt the queue
-            return write_query(
+        with self.locked("delete_running"):
+            # Interrupt the queue, only the items run by this worker when the queue is shared
+            worker_id = self.worker_id if self.shared and prompt_id is None else None
+            deleted = write_query(
                 """
                 DELETE FROM queue
-                WHERE status = 1 AND (? IS NULL OR prompt_id = ?)
+                WHERE status = 1 AND (? IS NULL OR prompt_id = ?) AND (? IS NULL OR worker_id = ?)
             """,
-                (prompt_id, prompt_id),
+                (prompt_id, prompt_id, worker_id, worker_id),
             )
+            qm_metrics.items_deleted.inc(deleted)
+            qm_metrics.item_dropped(prompt_id)
+            if deleted > 0:
+                self.publish([{"op": "remove", "prompt_id": prompt_id}] if prompt_id is not None else None)
+            return deleted
 
-    def play_items(self, items, front, client_id=None):
+    def play_items(self, items, front, client_id=None, tier="hot"):
         """
-        Play items from the archive
+        Play items from the archive (or any other route, items of the cold tier are moved back to the hot queue first)
         """
-        with self.native_queue.mutex:
-            # Play the item from the database
-
-            moved = 0
-            for db_id in items:
-                PromptServer.instance.number += 1
-
-                logging.info(
-                    "[Queue Manager] Playing item: %s, priority: %d, front: %s",
-                    db_id,
-                    PromptServer.instance.number * (-1 if front else 1),
-                    front,
-                )
-
-                # Get the item and update the client id in prompt json
-                row = read_single(
-                    """
-                    SELECT prompt
-                    FROM queue
-                    WHERE id = ?
-                """,
-                    (db_id,),
-                )
-                if row is None:
-                    continue
-
-                prompt = json.loads(row[0])
-                prompt[3]["client_id"] = client_id
-
-                # Backwards compatibility: if prompt[5] does not exist, create it with empty dict
-                if len(prompt) < 6:
-                    prompt.append({})
-
-                moved += write_query(
-                    """
-                    UPDATE queue
-                    SET status = 0, number = ?, prompt = ?
-                    WHERE id = ?
-                """,
-                    # Ensure correct priority
-                    (
-                        PromptServer.instance.number * (-1 if front else 1),
-                        json.dumps(prompt),
-                        db_id,
-                    ),
-                    False,
-                )
-
-            get_conn().commit()
+        with self.locked("play_items"):
+            if tier == "cold":
+                self.restore_from_cold(items)
+
+            # Priority follows the order of the given ids, client id is set in the stored prompt with JSON functions
+            # so the whole selection is moved with one statement without decoding the prompts.
+            # Backwards compatibility: if prompt[5] does not exist, create it with empty dict
+            moved = write_query(
+                """
+                UPDATE queue
+                SET status = 0,
+                    number = ? * (? + ids.key + 1),
+                    client_id = ?,
+                    prompt = CASE
+                        WHEN json_array_length(queue.prompt) < 6
+                        THEN json_insert(json_set(queue.prompt, '$[3].client_id', ?), '$[#]', json('{}'))
+                        ELSE json_set(queue.prompt, '$[3].client_id', ?)
+                    END
+                FROM json_each(?) AS ids
+                WHERE queue.id = ids.value
+            """,
+                (-1 if front else 1, PromptServer.instance.number, client_id, client_id, client_id, dumps(items)),
+            )
+            PromptServer.instance.number += len(items)
 
             if moved > 0:
                 # if moved to the front then remove the pending item from the native queue so next iteration will get the one
                 # with highest priority in the database
                 if front:
                     self.native_queue.queue = []
+                self.pending.invalidate()
 
                 # Notify native queue lock so if it's waiting it can move on and go for next iteration
                 PromptServer.instance.prompt_queue.not_empty.notify()
 
                 logging.info("[Queue Manager] %d item(s) scheduled for generation.", moved)
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"total_moved": moved})
-                PromptServer.instance.queue_updated()
+                self.publish()
+                self.notifier.send("queue-manager-queue-updated", {"total_moved": moved})
+                self.notifier.queue_updated()
 
             return moved
 
     # Change status to 0 for all items with status 3, update the client_id and set correct priority for each item
-    def play_archive(self, client_id=None, filters=None):
-        with self.native_queue.mutex:
+    def play_archive(self, client_id=None, filters=None, tier="hot"):
+        if tier == "cold":
+            return self.play_cold_archive(client_id, filters)
+
+        with self.locked("play_archive"):
             # Play the item from the database
             where_string, params = self.get_filters(filters, ["status = 3"])
 
-            # Get the archived items from the database
-            rows = read_query(
+            # Oldest first, client id and number are set in the stored prompt with JSON functions
+            # so the whole archive is moved with one statement without decoding the prompts.
+            moved = write_query(
                 f"""
-                SELECT id, prompt
-                FROM queue
-                WHERE {where_string}
-                ORDER BY updated_at
-            """,
-                params,
-            )
-
-            # Convert the items to a list of tuples
-            parameters = []
-            for row in rows:
-                PromptServer.instance.number += 1
-
-                item = json.loads(row[1])
-                item[3]["client_id"] = client_id
-                item[0] = PromptServer.instance.number
-                parameters.append(
-                    (
-                        PromptServer.instance.number,
-                        json.dumps(item),
-                        row[0],
-                    )
-                )
-
-            # Update the items in the database
-            moved = write_many(
-                """
                 UPDATE queue
-                SET status = 0, number = ?, prompt = ?
-                WHERE id = ?
+                SET status = 0,
+                    number = ? + archived.position,
+                    client_id = ?,
+                    prompt = json_set(queue.prompt, '$[0]', ? + archived.position, '$[3].client_id', ?)
+                FROM (
+                    SELECT id, ROW_NUMBER() OVER (ORDER BY updated_at, id) AS position
+                    FROM queue
+                    WHERE {where_string}
+                ) AS archived
+                WHERE queue.id = archived.id
             """,
-                parameters,
+                (PromptServer.instance.number, client_id, PromptServer.instance.number, client_id) + params,
             )
+            PromptServer.instance.number += moved
 
             if moved > 0:
+                self.pending.invalidate()
+
                 # Notify native queue lock so if it's waiting it can move on and go for next iteration
                 PromptServer.instance.prompt_queue.not_empty.notify()
 
                 logging.info("[Queue Manager] %d item(s) scheduled for generation.", moved)
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"total_moved": moved})
-                PromptServer.instance.queue_updated()
+                self.publish()
+                self.notifier.send("queue-manager-queue-updated", {"total_moved": moved})
+                self.notifier.queue_updated()
             return moved
 
-    def delete_from_queue(self, route="queue", filters=None):
-        with self.native_queue.mutex:
-            where_string, params = self.get_filters(filters, [self.get_route_query(route)])
+    def delete_from_queue(self, route="queue", filters=None, tier="hot"):
+        table = self.get_table(tier, route)
+        with self.locked("delete_from_queue"):
+            where_string, params = self.get_filters(filters, [self.get_route_query(route)], tier=tier)
             # Delete the archive from the database
             deleted = write_query(
                 f"""
-                DELETE FROM queue
+                DELETE FROM {table}
                 WHERE {where_string}
             """,
                 params,
             )
+            qm_metrics.items_deleted.inc(deleted)
+            if deleted > 0:
+                self.publish()
 
             if route == "queue":
-                PromptServer.instance.queue_updated()
+                self.pending.invalidate()
+                self.notifier.queue_updated()
             else:
-                PromptServer.instance.send_sync("queue-manager-queue-updated", {"deleted": deleted})
+                self.notifier.send("queue-manager-queue-updated", {"deleted": deleted})
 
             return deleted
 
+    def play_cold_archive(self, client_id=None, filters=None):
+        """
+        Play archived items of the cold tier matching the filters, oldest first
+        """
+        with self.locked("play_cold_archive"):
+            where_string, params = self.get_filters(filters, ["status = 3"], tier="cold")
+            rows = read_query(
+                f"""
+                SELECT id
+                FROM cold.queue
+                WHERE {where_string}
+                ORDER BY updated_at, id
+            """,
+                params,
+            )
+            if len(rows) == 0:
+                return 0
+            return self.play_items([row[0] for row in rows], False, client_id, "cold")
+
+    # ===========================================================
+    # ======================= COLD TIER =========================
+    # ===========================================================
+    # Completed and archived items past their retention are moved to a separate database file (see qm_db.cold_path())
+    # so the hot queue table and its indexes only hold recent history. They can still be listed, exported, played
+    # and deleted with tier="cold".
+
+    def expire_items(self, batch_size=EXPIRE_BATCH_SIZE):
+        """
+        Move completed and archived items past their retention to the cold tier, oldest first, in batches of batch_size.
+        Called by QM_Maintenance. Returns the number of moved items.
+        """
+        expired = 0
+        for route, (days, count) in self.retention.items():
+            if not days and not count:
+                continue
+
+            status = self.get_route_status(route)
+            while True:
+                with self.locked("expire_items"):
+                    # Items past the max age and the ones beyond the newest `count` are both the oldest items
+                    # of the status, so the expired items of a batch are whichever prefix is longer
+                    ids = []
+                    if count:
+                        excess = self.count_items(route, None, "", ()) - count
+                        if excess > 0:
+                            ids = [
+                                row[0]
+                                for row in read_query(
+                                    "SELECT id FROM queue WHERE status = ? ORDER BY updated_at, id LIMIT ?",
+                                    (status, min(excess, batch_size)),
+                                )
+                            ]
+                    if days and len(ids) < batch_size:
+                        rows = read_query(
+                            """
+                            SELECT id
+                            FROM queue
+                            WHERE status = ? AND updated_at < datetime('now', ?)
+                            ORDER BY updated_at, id
+                            LIMIT ?
+                        """,
+                            (status, f"-{days} days", batch_size),
+                        )
+                        if len(rows) > len(ids):
+                            ids = [row[0] for row in rows]
+
+                    moved = self.move_to_cold(ids)
+                expired += moved
+                if len(ids) < batch_size:
+                    break
+
+        if expired > 0:
+            logging.info("[Queue Manager] Moved %d expired item(s) to the cold tier", expired)
+        return expired
+
+    def move_to_cold(self, ids):
+        """
+        Move items from the hot queue to the cold tier. Callers must hold the queue mutex.
+        """
+        if len(ids) == 0:
+            return 0
+
+        rows = read_query(
+            f"""
+            SELECT {COLD_COLUMNS}, prompt
+            FROM queue
+            WHERE id IN (SELECT value FROM json_each(?))
+        """,
+            (dumps(ids),),
+        )
+        write_many(
+            f"""
+            INSERT OR REPLACE INTO cold.queue ({COLD_COLUMNS}, codec, prompt)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            [(*tuple(row)[:-1], *pack_cold_item(unpack_item(row["prompt"]))) for row in rows],
+        )
+        # The items are deleted from the hot queue once their copies are committed. After a crash in between
+        # they are in both tiers and simply moved again.
+        get_writer().flush()
+        moved = write_query(
+            """
+            DELETE FROM queue
+            WHERE id IN (SELECT value FROM json_each(?))
+        """,
+            (dumps([row["id"] for row in rows]),),
+        )
+
+        qm_metrics.items_expired.inc(moved)
+        if moved > 0:
+            self.publish()
+            self.notifier.send("queue-manager-queue-updated", {"total_moved": moved})
+        return moved
+
+    def restore_from_cold(self, ids):
+        """
+        Move items of the cold tier back to the hot queue, they keep their id and status. Items conflicting with an item
+        of the hot queue are kept in the cold tier. Returns the number of restored items. Callers must hold the queue mutex.
+        """
+        rows = read_query(
+            f"""
+            SELECT {COLD_COLUMNS}, codec, prompt
+            FROM cold.queue
+            WHERE id IN (SELECT value FROM json_each(?))
+        """,
+            (dumps(ids),),
+        )
+        if len(rows) == 0:
+            return 0
+
+        params = []
+        for row in rows:
+            prompt, workflow_hash = pack_item(unpack_cold_item(row["codec"], row["prompt"]))
+            params.append((*tuple(row)[:-2], prompt, workflow_hash))
+
+        restored = write_many(
+            f"""
+            INSERT OR IGNORE INTO queue ({COLD_COLUMNS}, prompt, workflow_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            params,
+        )
+        # Drop workflows stored only for items which are in the hot queue already
+        if restored < len(params):
+            write_query("DELETE FROM blobs WHERE refs <= 0")
+
+        get_writer().flush()
+        # Only the items which made it to the hot queue leave the cold tier. The others conflict with an item of the hot
+        # queue (same prompt_id, e.g. queued again since) and stay cold rather than being lost.
+        removed = write_query(
+            """
+            DELETE FROM cold.queue
+            WHERE id IN (SELECT value FROM json_each(?))
+              AND (id, prompt_id) IN (SELECT id, prompt_id FROM main.queue WHERE id IN (SELECT value FROM json_each(?)))
+        """,
+            (dumps([row["id"] for row in rows]),) * 2,
+        )
+        if removed < len(rows):
+            logging.warning(
+                "[Queue Manager] %d item(s) of the cold tier conflict with items of the queue and were kept", len(rows) - removed
+            )
+        return restored
+
     # Import queue from uploaded json file
-    def import_queue(self, items, client_id=None, status=0, api_key_comfy_org=None):
+    def import_queue(self, items, client_id=None, status=0, api_key_comfy_org=None, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Import items from any iterable (e.g. helpers.iter_json_items() reading an uploaded file) in transactions of batch_size items.
+        The queue mutex is released between batches so large imports don't stall execution, and the progress is reported
+        with queue-manager-queue-updated events. Returns (imported, submitted).
+        """
+        imported = 0
+        submitted = 0
+        batch = []
+        try:
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    imported += self.import_batch(batch, client_id, status, api_key_comfy_org)
+                    submitted += len(batch)
+                    batch = []
+                    self.notifier.send("queue-manager-queue-updated", {"total_imported": imported, "submitted": submitted, "done": False})
+
+            if len(batch) > 0:
+                imported += self.import_batch(batch, client_id, status, api_key_comfy_org)
+                submitted += len(batch)
+        finally:
+            # clients showing the progress wait for the done event, also when nothing new was imported or the upload failed
+            if imported > 0 or submitted > 0:
+                self.notifier.send("queue-manager-queue-updated", {"total_imported": imported, "submitted": submitted, "done": True})
+
+        return imported, submitted
+
+    def import_batch(self, items, client_id=None, status=0, api_key_comfy_org=None):
         theServer = PromptServer.instance
         theQueue = theServer.prompt_queue
-        with theQueue.mutex:
+        with self.locked("import_batch"):
             # Add items to the queue in database
 
             query_params = []
 
             for item in items:
-                # TODO: Check if the item is a list, has the correct length, and contains valid data format
+                # TODO: Check if the item has the correct length and contains valid data format
                 # SIML: Check if all prompts in the queue are valid
+                if not isinstance(item, list) or len(item) < 4 or not isinstance(item[3], dict):
+                    continue
 
                 if client_id is not None:
                     item[3]["client_id"] = client_id
@@ -608,48 +1456,61 @@ class QM_Queue:
                     item[5] = {"api_key_comfy_org": api_key_comfy_org} if api_key_comfy_org is not None else {}
 
                 PromptServer.instance.number += 1
+                summary = item_summary(item)
+                prompt, workflow_hash = pack_item(item)
                 query_params.append(
                     (
                         item[1],
                         PromptServer.instance.number,
-                        item[3]["extra_pnginfo"]["workflow"]["workflow_name"],
-                        item[3]["extra_pnginfo"]["workflow"]["id"],
-                        json.dumps(item),
+                        summary["name"],
+                        summary["workflow_id"],
+                        prompt,
                         status,
+                        summary["client_id"],
+                        summary["node_count"],
+                        summary["preview"],
+                        workflow_hash,
                     )
                 )
 
             total = write_many(
                 """
-                    INSERT OR IGNORE INTO queue (prompt_id, number, name, workflow_id, prompt, status)
-                    VALUES (?, ?, ?, ?, ?, ?)
+                    INSERT OR IGNORE INTO queue (prompt_id, number, name, workflow_id, prompt, status, client_id, node_count, preview, workflow_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 query_params,
             )
 
+            # Drop workflows stored only for ignored duplicates
+            if total < len(query_params):
+                write_query("DELETE FROM blobs WHERE refs <= 0")
+
             if total > 0:
+                self.publish()
                 theQueue.not_empty.notify()
                 if status == 0:
-                    theServer.queue_updated()
-                if status == 3:
-                    PromptServer.instance.send_sync("queue-manager-queue-updated", {"total_imported": total})
+                    self.pending.invalidate()
+                    self.notifier.queue_updated()
 
-            return total, len(items)
+            return total
 
     # If there are any items in the queue with status 1 (running), restore them to status 0 (pending) with highest priority
     # TODO: Add a setting to enable/disable this feature
     def restore_queue(self, called_by_queue_get=False):
-        with PromptServer.instance.prompt_queue.mutex:
+        with self.locked("restore_queue"):
             if self.restored:
                 return
 
-            # Get running items from the database
-            rows = read_query("""
+            # Get running items from the database. Items of a shared queue run by other workers are left to their leases.
+            rows = read_query(
+                f"""
                 SELECT prompt_id, number, name, workflow_id, prompt
                 FROM queue
-                WHERE status = 1
+                WHERE status = 1 {"AND (worker_id = ? OR lease_expires_at IS NULL)" if self.shared else ""}
                 ORDER BY number
-            """)
+            """,
+                (self.worker_id,) if self.shared else (),
+            )
             if len(rows) > 0:
                 logging.info("[Queue Manager] Restoring unfinished jobs: %d item(s)", len(rows))
                 # Get current highest priority (lowest number for pending task) in the database
@@ -671,7 +1532,7 @@ class QM_Queue:
                     write_query(
                         """
                         UPDATE queue
-                        SET status = 0, number = ?
+                        SET status = 0, number = ?, worker_id = NULL, lease_expires_at = NULL
                         WHERE prompt_id = ?
                     """,
                         (
@@ -680,20 +1541,21 @@ class QM_Queue:
                         ),
                     )
                     min_number -= 1
+                self.publish()
 
             # Get task counter (highest task number) from the database
             rows = read_single("""
-                SELECT number
+                SELECT MAX(number)
                 FROM queue
-                WHERE status = 1 OR status = 0 -- pending or running
-                ORDER BY number DESC
-                LIMIT 1
+                WHERE status IN (0, 1) -- pending or running
             """)
-            if rows:
+            if rows[0] is not None:
                 task_counter = rows[0] + 1
             else:
                 task_counter = 1
 
+            self.pending.invalidate()
+
             # Set the task counter in the queue
             PromptServer.instance.prompt_queue.task_counter = task_counter
             # Set the number in server
@@ -708,7 +1570,7 @@ class QM_Queue:
 
             self.restored = True  # we restore the queue only once per server start
 
-    def get_filters(self, filters=None, where_clauses=None, params=None):
+    def get_filters(self, filters=None, where_clauses=None, params=None, tier="hot"):
         if filters is not None:
             if where_clauses is None:
                 where_clauses = []
@@ -720,17 +1582,92 @@ class QM_Queue:
                 if key == "workflow":
                     where_clauses.append("workflow_id = ?")
                     params.append(the_filter["value"])
-                # elif key == "checkpoint":
-                #     where_clauses.append("name LIKE ?")
-                #     params.append(f"%{value}%")
+                elif key == "search":
+                    # workflow name, node types, model names and text inputs (see migrate_search_index())
+                    if self.search_index and tier == "hot":
+                        query = search_query(the_filter["value"])
+                        if query is not None:
+                            where_clauses.append("id IN (SELECT rowid FROM queue_fts WHERE queue_fts MATCH ?)")
+                            params.append(query)
+                    elif str(the_filter["value"]).strip() != "":
+                        where_clauses.append("(name LIKE ? OR preview LIKE ?)")
+                        params.extend([f"%{the_filter['value']}%"] * 2)
 
         return " AND ".join(where_clauses), () if params is None else tuple(params)  # convert to tuple if not None
 
+    def get_selection(self, selection):
+        """
+        Get where clause and parameters of a bulk selection, either
+            {"ids": [db ids]} - explicit list of items, or
+            {"route": route, "filters": filters, "exclude": [db ids]} - everything matching the route and filters except excluded items,
+        so the client never needs to ship the list of selected items. Id lists are bound as a single JSON array (json_each).
+        """
+        if not isinstance(selection, dict):
+            raise BadSelectionException("Invalid selection")
+
+        if "ids" in selection:
+            ids = selection["ids"]
+            if not isinstance(ids, list) or not all(isinstance(db_id, int) for db_id in ids):
+                raise BadSelectionException("Invalid selection: ids must be a list of item ids")
+            return "id IN (SELECT value FROM json_each(?))", (dumps(ids),)
+
+        route = selection.get("route", "queue")
+        if route not in ["queue", "archive", "completed"]:
+            raise BadRouteException("Invalid route: " + str(route))
+        tier = selection.get("tier", "hot")
+        self.get_table(tier, route)
+
+        filters = selection.get("filters", None)
+        if filters is not None and not isinstance(filters, dict):
+            raise BadSelectionException("Invalid selection: filters must be an object")
+
+        exclude = selection.get("exclude", [])
+        if not isinstance(exclude, list) or not all(isinstance(db_id, int) for db_id in exclude):
+            raise BadSelectionException("Invalid selection: exclude must be a list of item ids")
+
+        where_clauses = [self.get_route_query(route)]
+        params = []
+        if len(exclude) > 0:
+            where_clauses.append("id NOT IN (SELECT value FROM json_each(?))")
+            params.append(dumps(exclude))
+
+        return self.get_filters(filters, where_clauses, params, tier)
+
+    def get_table(self, tier="hot", route=None):
+        """
+        Table of the tier: "hot" (the queue) or "cold" (completed and archived items past their retention, see expire_items())
+        """
+        match tier:
+            case "hot":
+                return "queue"
+            case "cold" if route in (None, "archive", "completed"):
+                return "cold.queue"
+            case "cold":
+                raise BadRouteException("Invalid route for the cold tier: " + str(route))
+
+        raise BadRouteException("Invalid tier: " + str(tier))
+
+    def get_route_status(self, route="queue"):
+        match route:
+            case "archive":
+                return 3
+            case "completed":
+                return 2
+        return 0
+
+    def get_sort_column(self, route="queue"):
+        # Pending items are sorted by priority, archived and completed ones by the time they were moved there
+        match route:
+            case "archive" | "completed":
+                return "updated_at"
+
+        return "number"
+
     def get_route_query(self, route="queue", include_running=False):
         # Get the query for the given route
         match route:
             case "queue":
-                return "status = 0" + (" OR status = 1" if include_running else "")  # pending
+                return "status IN (0, 1)" if include_running else "status = 0"  # pending (and running)
             case "archive":
                 return "status = 3"
             case "completed":
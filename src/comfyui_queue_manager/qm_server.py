@@ -2,11 +2,27 @@
 from aiohttp import web
 
 from server import PromptServer
-import logging, json
+import logging, json, tempfile
 from datetime import datetime, timezone
 
-from .helpers import sanitize_filename, requestJson
-from .inc.exceptions import BadRouteException
+from .helpers import sanitize_filename, requestJson, export_chunk, iter_json_items
+from .inc.exceptions import BadRouteException, BadCursorException, BadSelectionException
+from .qm_async import QM_AsyncQueue
+from .qm_cache import QM_ResponseCache, etag_matches, make_etag
+from .qm_json import dumps_bytes, loads
+from .qm_locks import profiler
+from . import qm_metrics
+
+MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_SIZE = 200
+IMPORT_READ_SIZE = 1 << 16
+
+
+def json_response(data, status=200):
+    """
+    Like web.json_response() but encoded with the queue manager's JSON codec straight to bytes.
+    """
+    return web.Response(body=dumps_bytes(data), status=status, content_type="application/json")
 
 
 class QM_Server:
@@ -15,9 +31,26 @@ class QM_Server:
         self.queue = queue_manager.queue
         self.__version__ = __version__
 
+        # All database work of the routes runs on a bounded thread pool, off the event loop
+        self.async_queue = QM_AsyncQueue(self.queue, queue_manager.options.get("db_workers", 2))
+
+        # Serialized queue pages of the current queue revision
+        self.response_cache = QM_ResponseCache(queue_manager.options.get("response_cache_size", 64))
+
         # Get queue items
         @PromptServer.instance.routes.get("/queue_manager/queue")
         async def get_queue(request):
+            # Pages are tagged with the queue revision (read before the page, so the page is never older than its tag)
+            revision = self.queue.revision
+            cache_key = "&".join(sorted(f"{key}={value}" for key, value in request.query.items()))
+            headers = {"ETag": make_etag(revision, cache_key), "Cache-Control": "no-cache"}
+            if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+                return web.Response(status=304, headers=headers)
+
+            body = self.response_cache.get(revision, cache_key)
+            if body is not None:
+                return web.Response(body=body, content_type="application/json", headers=headers)
+
             # Get page number from query string
             page = int(request.query.get("page", 0))
 
@@ -25,50 +58,103 @@ class QM_Server:
 
             route = self.get_the_route(request)
 
+            cursor = self.get_cursor(request)
+
+            tier = self.get_tier(request)
+
+            # SIML: Get default page size from extension settings
+            page_size = min(max(int(request.query.get("page_size", 100)), 1), MAX_PAGE_SIZE)
+
             # pending items
-            # SIML: Get page size from extension settings
-            running, pending, info = self.queue.get_current_queue(page, 100, route=route, filters=filters, return_meta=True)
+            running, pending, info = await self.async_queue.get_current_queue(
+                page,
+                page_size,
+                route=route,
+                filters=filters,
+                return_meta=True,
+                cursor=cursor,
+                # In cursor mode counting is optional as it's the only part which doesn't scale with the page size
+                with_total=cursor is None or request.query.get("total", "0") == "1",
+                # Pending items are listed as summaries unless full prompts are explicitly requested (see /queue_manager/item)
+                summary=request.query.get("full", "0") != "1",
+                tier=tier,
+            )
 
             # Remove sensitive data
-            remove_sensitive = lambda queue: [x[:5] for x in queue]
+            remove_sensitive = lambda queue: [x[:5] if isinstance(x, (tuple, list)) else x for x in queue]
             running = remove_sensitive(running)
             pending = remove_sensitive(pending)
 
             # Return the archive object as JSON
-            return web.json_response({"running": running, "pending": pending, "info": info})
+            body = await self.async_queue.run(dumps_bytes, {"running": running, "pending": pending, "info": info})
+            self.response_cache.put(revision, cache_key, body)
+            return web.Response(body=body, content_type="application/json", headers=headers)
+
+        # Get single queue item with its full prompt
+        @PromptServer.instance.routes.get("/queue_manager/item")
+        async def get_item(request):
+            try:
+                db_id = int(request.query.get("id", ""))
+            except ValueError:
+                return json_response({"error": "Invalid item id"}, status=400)
+
+            item = await self.async_queue.get_item(db_id, self.get_tier(request))
+            if item is None:
+                return json_response({"error": "Item not found"}, status=404)
+
+            # Remove sensitive data
+            return json_response(item[:5])
 
         # Archive POSTed items
         @PromptServer.instance.routes.post("/queue_manager/archive")
         async def post_archive(request):
             # Get the archived items
-            json_data = await request.json()
+            json_data = await request.json(loads=loads)
             if "archive" in json_data:
-                archived = self.queue.archive_items(json_data["archive"])
-                return web.json_response({"archived": archived})
+                archived = await self.async_queue.archive_items(json_data["archive"])
+                return json_response({"archived": archived})
             else:
-                return web.json_response({"error": "No items to archive"}, status=400)
+                return json_response({"error": "No items to archive"}, status=400)
+
+        # Archive or delete a selection of items with a single statement. Selection is either {"ids": [...]} or
+        # {"route": ..., "filters": ..., "exclude": [...]}: everything matching the filters except excluded items (see QM_Queue.get_selection())
+        @PromptServer.instance.routes.post("/queue_manager/bulk")
+        async def post_bulk(request):
+            json_data = await requestJson(request)
+            selection = json_data.get("selection", None)
+            if selection is None:
+                return json_response({"error": "No items selected"}, status=400)
+
+            match json_data.get("action", None):
+                case "archive":
+                    return json_response({"archived": await self.async_queue.archive_selection(selection)})
+                case "delete":
+                    return json_response({"deleted": await self.async_queue.delete_selection(selection)})
+
+            return json_response({"error": "Invalid action"}, status=400)
 
         # Play entire archive
         @PromptServer.instance.routes.post("/queue_manager/play-archive")
         async def play_archive(request):
             logging.info("[Queue Manager] Play archive")
-            json_data = await request.json()
+            json_data = await request.json(loads=loads)
             client_id = None
             filters = None
+            tier = self.check_tier(json_data.get("tier", "hot"))
             if "client_id" in json_data:
                 client_id = json_data["client_id"]
             if "filters" in json_data:
                 filters = json_data["filters"]
 
-            moved = self.queue.play_archive(client_id, filters)
-            return web.json_response({"queued": moved})
+            moved = await self.async_queue.play_archive(client_id, filters, tier)
+            return json_response({"queued": moved})
 
         # Toggle Play/Pause of the queue
         @PromptServer.instance.routes.get("/queue_manager/toggle")
         async def toggle_queue(request):
             # Toggle the status of the queue
-            self.queue.toggle_playback()
-            return web.json_response({"paused": self.queue.paused})
+            await self.async_queue.toggle_playback()
+            return json_response({"paused": self.queue.paused})
 
         # Return the status of the queue's playback
         @PromptServer.instance.routes.get("/queue_manager/playback")
@@ -79,30 +165,85 @@ class QM_Server:
                     "paused": self.queue.paused,
                 },
             )
-            return web.json_response({"paused": self.queue.paused})
+            return json_response({"paused": self.queue.paused})
 
         @PromptServer.instance.routes.get("/queue_manager/archive-queue")
         async def archive_queue(request):
             filters = self.get_filters(request)
-            total = self.queue.archive_queue(filters)
-            return web.json_response({"archived": total})
+            total = await self.async_queue.archive_queue(filters)
+            return json_response({"archived": total})
 
         # Play item from archive
         @PromptServer.instance.routes.post("/queue_manager/play")
         async def play_item(request):
             # Get the item to play
-            json_data = await request.json()
+            json_data = await request.json(loads=loads)
             if "items" in json_data:
-                total = self.queue.play_items(json_data["items"], json_data.get("front", False) == True, json_data.get("clientId", None))
-                return web.json_response({"moved": total})
+                total = await self.async_queue.play_items(
+                    json_data["items"],
+                    json_data.get("front", False) == True,
+                    json_data.get("clientId", None),
+                    self.check_tier(json_data.get("tier", "hot")),
+                )
+                return json_response({"moved": total})
             else:
-                return web.json_response({"error": "No item to play"}, status=400)
+                return json_response({"error": "No item to play"}, status=400)
 
         # Endpoint to expose __version__ information
         @PromptServer.instance.routes.get("/queue_manager/version")
         async def get_version(request):
             # Return the version as JSON
-            return web.json_response({"version": self.__version__})
+            return json_response({"version": self.__version__})
+
+        # Item counts per workflow, client and day (?facets=workflow,client&route=archive), see QM_Queue.get_facets()
+        @PromptServer.instance.routes.get("/queue_manager/facets")
+        async def get_facets(request):
+            facets = request.query["facets"].split(",") if "facets" in request.query else None
+            status = self.queue.get_route_status(self.get_the_route(request)) if "route" in request.query else None
+            return json_response(await self.async_queue.get_facets(facets, status))
+
+        # Reconcile the facet and status counters with the queue table
+        @PromptServer.instance.routes.post("/queue_manager/facets/repair")
+        async def repair_facets(request):
+            return json_response({"repaired": await self.async_queue.repair_facets()})
+
+        # When the queue is expected to drain, with the run time statistics per workflow it's estimated from (see QM_Queue.get_eta())
+        # and the expected start of the pending items listed in ?ids=1,2,3. Times are absolute (unix time), computed on demand
+        # as they change with the clock, unlike the queue pages which are cached per revision.
+        @PromptServer.instance.routes.get("/queue_manager/eta")
+        async def get_eta(request):
+            try:
+                db_ids = [int(db_id) for db_id in request.query.get("ids", "").split(",") if db_id != ""][:MAX_PAGE_SIZE]
+            except ValueError:
+                return json_response({"error": "Invalid item ids"}, status=400)
+
+            eta = await self.async_queue.get_eta()
+            expected_starts = {str(db_id): start for db_id, start in (await self.async_queue.get_expected_starts(db_ids, eta)).items()}
+            return json_response({**eta, "expected_starts": expected_starts, "workflows": await self.async_queue.get_timing_stats()})
+
+        # What the background database maintenance did (see QM_Maintenance)
+        @PromptServer.instance.routes.get("/queue_manager/maintenance")
+        async def get_maintenance(request):
+            return json_response(self.queue_manager.maintenance.report)
+
+        # Prometheus metrics (see qm_metrics), disabled with the metrics_enabled option
+        @PromptServer.instance.routes.get("/queue_manager/metrics")
+        async def get_metrics(request):
+            if not qm_metrics.is_enabled():
+                return web.Response(text="Metrics are disabled\n", status=404)
+            status_counts = await self.async_queue.get_status_counts()
+            return web.Response(
+                body=qm_metrics.render(status_counts).encode("utf-8"),
+                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            )
+
+        # Queue mutex contention per call site (see qm_locks), ?reset=1 starts a new measurement period
+        @PromptServer.instance.routes.get("/queue_manager/locks")
+        async def get_lock_stats(request):
+            summary = profiler.summary()
+            if request.rel_url.query.get("reset") in ("1", "true"):
+                profiler.reset()
+            return json_response(summary)
 
         # Import the queue
         @PromptServer.instance.routes.post("/queue_manager/import")
@@ -113,36 +254,47 @@ class QM_Server:
             if field is None or field.name != "queue_json":
                 return web.Response(text="No file uploaded", status=400)
 
-            content = await field.read()
-
-            client_id = None
-            is_archive = False
-            api_key_comfy_org = None
-
-            while True:
-                field = await reader.next()
-                if field is None:
-                    break
-                if field.name == "client_id":
-                    client_id = await field.read()
-                if field.name == "archive":
-                    is_archive = True
-                if field.name == "api_key_comfy_org":
-                    api_key_comfy_org = await field.read()
-
-            try:
-                json_data = json.loads(content)
-            except json.JSONDecodeError as e:
-                return web.Response(text=f"Invalid JSON: {e}", status=400)
-
-            if client_id is not None:
-                client_id = client_id.decode("ascii")
+            # Spool the upload to a temporary file so the size of the import is limited by disk rather than memory
+            with tempfile.TemporaryFile(prefix="qm-import-") as upload:
+                while True:
+                    chunk = await field.read_chunk(IMPORT_READ_SIZE)
+                    if not chunk:
+                        break
+                    await self.async_queue.run(upload.write, chunk)
+
+                client_id = None
+                is_archive = False
+                api_key_comfy_org = None
+
+                while True:
+                    field = await reader.next()
+                    if field is None:
+                        break
+                    if field.name == "client_id":
+                        client_id = await field.read()
+                    if field.name == "archive":
+                        is_archive = True
+                    if field.name == "api_key_comfy_org":
+                        api_key_comfy_org = await field.read()
+
+                if client_id is not None:
+                    client_id = client_id.decode("ascii")
+
+                if api_key_comfy_org is not None:
+                    api_key_comfy_org = api_key_comfy_org.decode("ascii")
+
+                logging.info("[Queue Manager] Importing %s", "to archive." if is_archive else "to queue.")
+
+                # JSON array or NDJSON is parsed item by item while importing, in batches (see QM_Queue.import_queue())
+                upload.seek(0)
+                try:
+                    imported, total = await self.async_queue.import_queue(
+                        iter_json_items(upload, IMPORT_READ_SIZE), client_id, 3 if is_archive else 0, api_key_comfy_org
+                    )
+                except json.JSONDecodeError as e:
+                    # batches imported before the error are kept
+                    return web.Response(text=f"Invalid JSON: {e}", status=400)
 
-            if api_key_comfy_org is not None:
-                api_key_comfy_org = api_key_comfy_org.decode("ascii")
-
-            logging.info("[Queue Manager] Importing %s", "to archive." if is_archive else "to queue.")
-            imported, total = self.queue.import_queue(json_data, client_id, 3 if is_archive else 0, api_key_comfy_org)
             logging.info(
                 "[Queue Manager] Imported %d of %d total submitted entries %s",
                 imported,
@@ -150,7 +302,7 @@ class QM_Server:
                 "to archive." if is_archive else "to queue.",
             )
 
-            return web.json_response({"imported": imported, "submitted": total})
+            return json_response({"imported": imported, "submitted": total})
 
         # Export the queue
         @PromptServer.instance.routes.get("/queue_manager/export")
@@ -159,13 +311,12 @@ class QM_Server:
 
             filters = self.get_filters(request)
 
-            # Export the queue
-            json_data = self.queue.get_full_queue(route, filters)
+            tier = self.get_tier(request)
+            # checked before the response starts, so a bad pair is still answered with an error status
+            self.queue.get_table(tier, route)
 
-            # Remove sensitive data from items. json_data is a list of lists, check each item if it 6 elements long and remove the 6th element
-            for i in range(len(json_data)):
-                if len(json_data[i]) >= 6:
-                    del json_data[i][5]
+            # Export format: JSON array (default) or newline delimited JSON, one item per line
+            ndjson = request.query.get("format", "json") == "ndjson"
 
             # Get filter values from the request so we can include them in the export filename
             filter_values = []
@@ -181,12 +332,27 @@ class QM_Server:
                 filter_values = ""
 
             # Trigger browser download
-            response = web.json_response(json_data)
+            response = web.StreamResponse()
             # file name: comfyui-queue-export-[current-date-and-time].json
-            response.headers["Content-Disposition"] = 'attachment; filename="comfyui-{}-export-{}.json"'.format(
-                route + filter_values, datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            response.headers["Content-Disposition"] = 'attachment; filename="comfyui-{}-export-{}.{}"'.format(
+                route + filter_values, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), "ndjson" if ndjson else "json"
             )
-            response.headers["Content-Type"] = "application/json"
+            response.headers["Content-Type"] = "application/x-ndjson" if ndjson else "application/json"
+            response.enable_chunked_encoding()
+            await response.prepare(request)
+
+            # Stream the export chunk by chunk so memory use stays flat regardless of the size of the queue.
+            # Sensitive data (item[5]) is removed from each item as it's encoded.
+            if not ndjson:
+                await response.write(b"[")
+            first = True
+            async for chunk in self.async_queue.iter_full_queue(route, filters, EXPORT_CHUNK_SIZE, tier):
+                await response.write(await self.async_queue.run(export_chunk, chunk, ndjson, first))
+                first = False
+            if not ndjson:
+                await response.write(b"]")
+
+            await response.write_eof()
             return response
 
         # Delete archive
@@ -194,11 +360,11 @@ class QM_Server:
         async def delete_from_queue(request):
             route = self.get_the_route(request)
             filters = self.get_filters(request)
-            total = self.queue.delete_from_queue(route, filters)
+            total = await self.async_queue.delete_from_queue(route, filters, self.get_tier(request))
 
             logging.info("[Queue Manager] Deleted %d items from the archive", total)
 
-            return web.json_response({"deleted": total})
+            return json_response({"deleted": total})
 
         # Take over client focus
         @PromptServer.instance.routes.get("/queue_manager/takeover")
@@ -207,25 +373,25 @@ class QM_Server:
 
             # is client_id valid: 32 chars hex
             if client_id is None:
-                return web.json_response({"error": "Client ID not provided"}, status=400)
+                return json_response({"error": "Client ID not provided"}, status=400)
             if len(client_id) != 32:
-                return web.json_response({"error": "Invalid client ID"}, status=400)
+                return json_response({"error": "Invalid client ID"}, status=400)
             if not all(c in "0123456789abcdef" for c in client_id):
-                return web.json_response({"error": "Invalid client ID"}, status=400)
+                return json_response({"error": "Invalid client ID"}, status=400)
 
             takeover_client = {"client_id": client_id, "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")}
 
             self.queue_manager.queue.takeover_client = takeover_client
-            self.queue_manager.options.set("takeover_client", client_id)
+            await self.async_queue.run(self.queue_manager.options.set, "takeover_client", client_id)
 
             logging.info(f"[Queue Manager] Client takeover requested by {client_id}")
 
-            return web.json_response(takeover_client)
+            return json_response(takeover_client)
 
         @PromptServer.instance.routes.get("/queue_manager/poke_status")
         async def poke_status(request):
             PromptServer.instance.queue_updated()
-            return web.json_response({"success": True})
+            return json_response({"success": True})
 
         # Hook us into the server's middleware so we can listen to some native api requests
         @web.middleware
@@ -239,20 +405,20 @@ class QM_Server:
                         json_data = await requestJson(request)
                         if "clear" in json_data:
                             if json_data["clear"]:
-                                self.queue.wipe_queue()
+                                await self.async_queue.wipe_queue()
                         if "delete" in json_data:
-                            self.queue.delete_items(json_data["delete"])
+                            await self.async_queue.delete_items(json_data["delete"])
                     case "/api/interrupt":
                         json_data = await requestJson(request)
                         total = 0
 
                         if ("prompt_id" in json_data) and (json_data["prompt_id"] is not None):
                             # delete specific item
-                            total = self.queue.delete_running(json_data["prompt_id"])
+                            total = await self.async_queue.delete_running(json_data["prompt_id"])
                             # logging.info(f"[Queue Manager] Interrupting item {json_data["prompt_id"]}")
                         else:
                             # delete the currently running item
-                            total = self.queue.delete_running()
+                            total = await self.async_queue.delete_running()
                         logging.info(f"[Queue Manager] Deleted {total} items from the queue")
 
             return await handler(request)
@@ -267,9 +433,9 @@ class QM_Server:
         async def error_middleware(request, handler):
             try:
                 return await handler(request)
-            except BadRouteException as ae:
+            except (BadRouteException, BadCursorException, BadSelectionException) as ae:
                 logging.error("[Queue Manager] " + ae.message)
-                return web.json_response(
+                return json_response(
                     {"error": ae.message},
                     status=422,
                 )
@@ -289,14 +455,48 @@ class QM_Server:
 
         return route
 
+    def get_tier(self, request):
+        """
+        Storage tier of the request: hot (default) or cold, see QM_Queue.expire_items().
+        """
+        return self.check_tier(request.query.get("tier", "hot"))
+
+    def check_tier(self, tier):
+        if tier not in ["hot", "cold"]:
+            raise BadRouteException("Invalid tier: " + str(tier))
+        return tier
+
+    def get_cursor(self, request):
+        """
+        Get keyset pagination cursor from the request: JSON encoded [] for the first page or [sort value, id] of the last seen item.
+        Returns None if the cursor is not set (page number mode).
+        """
+        cursor_json = request.query.get("cursor", None)
+        if cursor_json is None:
+            return None
+
+        try:
+            cursor = loads(cursor_json) if cursor_json != "" else []
+        except json.JSONDecodeError:
+            raise BadCursorException("Invalid cursor: " + cursor_json)
+
+        if not isinstance(cursor, list) or len(cursor) not in (0, 2):
+            raise BadCursorException("Invalid cursor: " + cursor_json)
+
+        # the sort value and the id are bound as query parameters, only scalars can be compared with the columns
+        if len(cursor) == 2 and (not isinstance(cursor[0], (str, int, float)) or not isinstance(cursor[1], int)):
+            raise BadCursorException("Invalid cursor: " + cursor_json)
+
+        return cursor
+
     def get_filters(self, request):
         filters_json = request.query.get("filters", None)
         filters = None
         if filters_json is not None:
             #     decode url-encoded json string
             try:
-                filters = json.loads(filters_json)
+                filters = loads(filters_json)
             except json.JSONDecodeError:
-                return web.json_response({"error": "Invalid filter format"}, status=400)
+                return json_response({"error": "Invalid filter format"}, status=400)
 
         return filters
@@ -0,0 +1,70 @@
+"""
+Shared queue: several ComfyUI instances (workers) run the items of one queue database.
+
+Workers claim pending items atomically in queue_get() (see QM_Queue.claim_next()) with a lease of lease_seconds.
+The heartbeat thread of each worker extends the leases of the items it runs and puts items whose lease expired back
+to pending, so the items of a crashed worker are picked up by the others without waiting for its restart.
+
+Changes committed by other workers are noticed by polling PRAGMA data_version every shared_poll_interval seconds,
+which also counts this instance's own commits on the writer connection, so busy queues publish (and clients refetch)
+at most once per poll.
+"""
+
+import logging
+import threading
+import time
+
+from . import qm_db
+
+
+class QM_Heartbeat:
+    def __init__(self, queue):
+        self.queue = queue
+        self.enabled = queue.shared
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.conn = None
+        self.data_version = None
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.loop, name="queue-manager-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def loop(self):
+        last_beat = float("-inf")
+        while True:
+            try:
+                if time.monotonic() - last_beat >= self.queue.lease_seconds / 3:
+                    last_beat = time.monotonic()
+                    self.beat()
+                self.poll()
+            except Exception as e:  # a missed beat is retried, leases outlive a few of them
+                logging.warning("[Queue Manager] Shared queue heartbeat failed: %s", e)
+            if self.stop_event.wait(self.queue.poll_interval):
+                return
+
+    def beat(self):
+        self.queue.extend_leases()
+        self.queue.reclaim_expired()
+
+    def poll(self):
+        """
+        Let the queue know when the database changed since the last poll.
+        """
+        if self.conn is None:
+            self.conn = qm_db.connect(read_only=True)
+        data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if self.data_version is not None and data_version != self.data_version:
+            self.queue.external_changes()
+        self.data_version = data_version
@@ -5,6 +5,8 @@ from .qm_options import QM_Options
 from .qm_queue import QM_Queue
 from .qm_server import QM_Server
 from .qm_db import init_schema
+from .qm_maintenance import QM_Maintenance
+from .qm_shared import QM_Heartbeat
 
 
 class QueueManager:
@@ -12,6 +14,10 @@ class QueueManager:
         init_schema()
         self.options = QM_Options()
         self.queue = QM_Queue(self)
+        self.maintenance = QM_Maintenance(self.options, self.queue)
+        self.heartbeat = QM_Heartbeat(self.queue)
         self.server = QM_Server(self, __version__)
+        self.maintenance.start()
+        self.heartbeat.start()
 
         return
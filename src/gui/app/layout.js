@@ -2,13 +2,17 @@
 import {Geist, Geist_Mono} from "next/font/google";
 import "./globals.scss";
 import {useEffect, useState} from "react";
-import Queue from "@/components/Queue";
+import Queue, {toSummary} from "@/components/Queue";
 import {baseURL} from "@/internals/config";
 import useEvent from "react-use-event-hook";
 import {AppContext} from "@/internals/app-context";
 import {apiCall} from "@/internals/functions";
 import {EllipsisVertical} from "lucide-react";
 
+const PAGE_SIZE = 100;
+const MAX_PAGE_SIZE = 500; // keep in sync with MAX_PAGE_SIZE in qm_server.py
+const ROUTE_STATUS = {queue: 0, completed: 2, archive: 3}; // keep in sync with QM_Queue.get_route_status()
+
 const geistSans = Geist({
   variable: "--font-geist-sans",
   subsets: ["latin"],
@@ -26,6 +30,7 @@ export default function RootLayout({children}) {
     error: null,
     queue: null,
     route: 'queue', // queue, archive, bin
+    tier: 'hot', // hot, cold: completed and archived items past their retention (archive and completed routes)
     shiftDown: false,
     clientId: null,
     filters: null
@@ -33,6 +38,7 @@ export default function RootLayout({children}) {
 
   const [uiState, setUiState] = useState({
     menuOpen: false,
+    importProgress: null, // {total_imported, submitted} while an import is running
   });
 
   const [currentJob, setProgress] = useState({
@@ -49,14 +55,16 @@ export default function RootLayout({children}) {
   }
 
 
-  const fetchQueueItems = async (page) => {
+  /**
+   * Fetch the queue from the start (keyset pagination). When refreshing, reload page by page until as many items as
+   * are already loaded came back, so the list doesn't shrink under the user.
+   */
+  const fetchQueueItems = async (loadedCount) => {
     setAppStatus(prev => ({...prev, loading: true, error: null}));
     try {
       // console.log("Fetching queue items from", baseURL);
-      let queryArgs = '';
-      if (page) {
-        queryArgs = "?page=" + page;
-      }
+      const pageSize = Math.min(Math.max(PAGE_SIZE, loadedCount || 0), MAX_PAGE_SIZE);
+      let queryArgs = "?cursor=&total=1&page_size=" + pageSize;
 
       queryArgs = appendFilters(queryArgs);
       queryArgs = appendRoute(queryArgs);
@@ -67,7 +75,26 @@ export default function RootLayout({children}) {
         throw new Error("Network response was not ok");
       }
       const queue = await response.json();
-      setAppStatus(prev => ({...prev, loading: false, error: null, queue}));
+
+      // the revision of the first page is kept, changes made meanwhile come again as deltas and are patched idempotently
+      let pending = queue.pending;
+      let nextCursor = queue.info.next_cursor;
+      while (nextCursor && pending.length < (loadedCount || 0)) {
+        let moreArgs = "?page_size=" + Math.min(loadedCount - pending.length, MAX_PAGE_SIZE) + "&cursor=" + encodeURIComponent(JSON.stringify(nextCursor));
+
+        moreArgs = appendFilters(moreArgs);
+        moreArgs = appendRoute(moreArgs);
+
+        const moreResponse = await fetch(`${baseURL}queue_manager/queue` + moreArgs);
+        if (!moreResponse.ok) {
+          throw new Error("Network response was not ok");
+        }
+        const more = await moreResponse.json();
+        pending = [...pending, ...more.pending];
+        nextCursor = more.info.next_cursor;
+      }
+
+      setAppStatus(prev => ({...prev, loading: false, error: null, queue: {...queue, pending, info: {...queue.info, next_cursor: nextCursor}}}));
 
     } catch (error) {
       setAppStatus(prev => ({...prev, loading: false, error: error.message, queue: null}));
@@ -75,6 +102,43 @@ export default function RootLayout({children}) {
     }
   };
 
+  /**
+   * Fetch the next page after the last loaded item and append it to the list
+   */
+  const fetchMoreQueueItems = useEvent(async () => {
+    if (appStatus.loading || !appStatus.queue || !appStatus.queue.info || !appStatus.queue.info.next_cursor) {
+      return;
+    }
+
+    setAppStatus(prev => ({...prev, loading: true, error: null}));
+    try {
+      let queryArgs = "?page_size=" + PAGE_SIZE + "&cursor=" + encodeURIComponent(JSON.stringify(appStatus.queue.info.next_cursor));
+
+      queryArgs = appendFilters(queryArgs);
+      queryArgs = appendRoute(queryArgs);
+
+      const response = await fetch(`${baseURL}queue_manager/queue` + queryArgs);
+      if (!response.ok) {
+        throw new Error("Network response was not ok");
+      }
+      const more = await response.json();
+      setAppStatus(prev => ({
+        ...prev,
+        loading: false,
+        error: null,
+        queue: prev.queue ? {
+          ...prev.queue,
+          pending: [...prev.queue.pending, ...more.pending],
+          info: {...prev.queue.info, next_cursor: more.info.next_cursor},
+        } : more,
+      }));
+
+    } catch (error) {
+      setAppStatus(prev => ({...prev, loading: false, error: error.message}));
+      console.error("Error fetching more " + appStatus.route + " items:", error);
+    }
+  });
+
   function getNodeIDs(nodes) {
     const nodeIDs = {};
     for (const node of nodes) {
@@ -95,14 +159,14 @@ export default function RootLayout({children}) {
 
     // check if the job is running
     for (const item of queue.running) {
-      if (item[1] === jobID) {
+      if (Array.isArray(item) && item[1] === jobID) {
         return item;
       }
     }
 
-    // check if the job is in the queue
+    // check if the job is in the queue (only full items carry the workflow, summaries will show up as running shortly)
     for (const item of queue.pending) {
-      if (item[1] === jobID) {
+      if (Array.isArray(item) && item[1] === jobID) {
         return item;
       }
     }
@@ -110,6 +174,29 @@ export default function RootLayout({children}) {
     return null;
   }
 
+  /**
+   * Replace the summary of a running item patched in from a delta with its full prompt, the progress needs the workflow nodes
+   */
+  async function loadRunningItem(jobID) {
+    const summary = appStatus.queue ? appStatus.queue.running.find(item => !Array.isArray(item) && item.prompt_id === jobID) : null;
+    if (!summary || summary.db_id === undefined) {
+      return;
+    }
+
+    const fullItem = await apiCall(`queue_manager/item?id=${summary.db_id}`, null, "GET");
+    if (!fullItem || !fullItem[3].extra_pnginfo) {
+      return;
+    }
+
+    setAppStatus(prev => {
+      if (!prev.queue) {
+        return prev;
+      }
+      const running = prev.queue.running.map(item => (!Array.isArray(item) && item.prompt_id === jobID) ? fullItem : item);
+      return {...prev, queue: {...prev.queue, running}};
+    });
+  }
+
   function appendFilters(queryArgs) {
     if (isFilterOn()) {
       queryArgs += (queryArgs ? '&filters=' : '?filters=') + encodeURIComponent(JSON.stringify(appStatus.filters));
@@ -121,6 +208,17 @@ export default function RootLayout({children}) {
     if (appStatus.route) {
       queryArgs += (queryArgs ? '&route=' : '?route=') + appStatus.route;
     }
+    return appendTier(queryArgs);
+  }
+
+  function isColdTier() {
+    return appStatus.tier === 'cold' && appStatus.route !== 'queue';
+  }
+
+  function appendTier(queryArgs) {
+    if (isColdTier()) {
+      queryArgs += (queryArgs ? '&tier=' : '?tier=') + appStatus.tier;
+    }
     return queryArgs;
   }
 
@@ -138,11 +236,12 @@ export default function RootLayout({children}) {
     await apiCall('queue_manager/play-archive', {
       client_id: appStatus.clientId,
       filters: isFilterOn() ? appStatus.filters : null,
+      tier: isColdTier() ? 'cold' : 'hot',
     })
   }
 
   async function deleteFromQueue() {
-    let queryArgs = appendFilters("?route=" + appStatus.route);
+    let queryArgs = appendTier(appendFilters("?route=" + appStatus.route));
 
     try {
       const response = await fetch(`${baseURL}queue_manager/queue${queryArgs}`, {
@@ -177,12 +276,106 @@ export default function RootLayout({children}) {
     return appStatus.filters && Object.keys(appStatus.filters).length > 0;
   }
 
+  /**
+   * The loaded list follows the server's queue revision, changes are pushed as queue-manager-queue-delta events
+   */
+  function hasRevision() {
+    return !!(appStatus.queue && appStatus.queue.info && appStatus.queue.info.revision !== undefined);
+  }
+
+  /**
+   * Running items are full native queue tuples when fetched, summaries when patched in from a delta
+   */
+  function runningPromptId(item) {
+    return Array.isArray(item) ? item[1] : item.prompt_id;
+  }
+
+  function runningNumber(item) {
+    return Array.isArray(item) ? item[0] : item.number;
+  }
+
+  /**
+   * Patch the loaded list with a queue-manager-queue-delta event (see QM_Queue.publish() in qm_queue.py).
+   * Returns the patched queue, or null if it has to be refetched (missed event, bulk change, filtered list...).
+   */
+  function applyQueueDelta(queue, delta) {
+    if (!hasRevision() || delta.refetch || delta.base_revision !== queue.info.revision || isColdTier()) {
+      return null;
+    }
+
+    const routeStatus = ROUTE_STATUS[appStatus.route];
+    let pending = queue.pending;
+    let running = queue.running;
+    let total = queue.info.total;
+    const counted = total !== null && total !== undefined; // total is optional in cursor mode
+    const lastLoaded = pending.length > 0 ? pending[pending.length - 1] : null;
+
+    for (const change of delta.changes) {
+      const promptId = change.op === "insert" ? change.item.prompt_id : change.prompt_id;
+      const index = pending.findIndex(item => item.prompt_id === promptId);
+      const loaded = index !== -1 ? pending[index] : null;
+      const wasRunning = running.find(item => runningPromptId(item) === promptId);
+
+      if (index !== -1) {
+        pending = pending.filter((item, i) => i !== index);
+        total -= counted ? 1 : 0;
+      }
+      running = running.filter(item => runningPromptId(item) !== promptId);
+
+      if (change.op === "remove") {
+        continue;
+      }
+
+      const status = change.op === "insert" ? change.item.status : change.status;
+      if (status === 1) {
+        if (appStatus.route === 'queue') {
+          // started items are listed from their summary, loadRunningItem() swaps in the full prompt for the progress
+          const item = change.op === "insert" ? change.item : {...(loaded || {prompt_id: promptId}), number: change.number};
+          running = [...running, {...item, status: 1}].sort((a, b) => runningNumber(a) - runningNumber(b));
+        }
+        continue;
+      }
+      if (status !== routeStatus) {
+        continue;
+      }
+      if (appStatus.route !== 'queue' || isFilterOn()) {
+        return null; // only the pending queue is patched in place, sorted by number
+      }
+
+      const known = loaded || (wasRunning ? toSummary(wasRunning) : null);
+      if (change.op !== "insert" && !known) {
+        return null; // moved in from another route, the summary isn't loaded
+      }
+      const item = change.op === "insert" ? change.item : {...known, number: change.number, status};
+
+      // items sorted after the last loaded one come with the next page
+      if (queue.info.next_cursor && lastLoaded && item.number > lastLoaded.number) {
+        total += counted ? 1 : 0;
+        continue;
+      }
+      const position = pending.findIndex(other => other.number > item.number);
+      pending = position === -1 ? [...pending, item] : [...pending.slice(0, position), item, ...pending.slice(position)];
+      total += counted ? 1 : 0;
+    }
+
+    return {...queue, running, pending, info: {...queue.info, total, revision: delta.revision}};
+  }
+
   const onQueueStatusUpdated = (event) => {
 
     switch (event.data.message.name) {
       case "status":
-        if (appStatus.route === 'queue') {
-          fetchQueueItems((appStatus.queue && appStatus.queue.info) ? appStatus.queue.info.page : 0);
+        // with revisions the list is kept up to date by the delta events
+        if (appStatus.route === 'queue' && !hasRevision()) {
+          fetchQueueItems(appStatus.queue ? appStatus.queue.pending.length : 0);
+        }
+        break;
+      case "queue-manager-queue-delta":
+        const patched = applyQueueDelta(appStatus.queue, event.data.message.detail);
+        if (patched) {
+          setAppStatus(prev => ({...prev, queue: patched}));
+        } else {
+          fetchQueueItems(appStatus.queue ? appStatus.queue.pending.length : 0);
         }
         break;
       case "execution_start":
@@ -208,6 +401,7 @@ export default function RootLayout({children}) {
         // set the current job with the prompt id and false integrity flag
         // we don't have the workflow data yet, so set integrity to false so we can pick up progress later when we get the workflow data
         setProgress(prev => ({...prev, id: prompt_id, integrity: false, nodes: {}}));
+        loadRunningItem(prompt_id);
 
         break;
 
@@ -254,7 +448,15 @@ export default function RootLayout({children}) {
 
       case "queue-manager-queue-updated":
         console.log("Queue Manager: queue updated: ", event.data.message);
-        fetchQueueItems()
+        // Large imports report progress after each batch, refresh the list once they're done
+        if (event.data.message.detail && event.data.message.detail.done === false) {
+          setUiState(prev => ({...prev, importProgress: event.data.message.detail}));
+          break;
+        }
+        setUiState(prev => ({...prev, importProgress: null}));
+        if (!hasRevision()) {
+          fetchQueueItems(appStatus.queue ? appStatus.queue.pending.length : 0)
+        }
         break;
     }
   }
@@ -325,6 +527,8 @@ export default function RootLayout({children}) {
 
     } catch (error) {
       console.error("Error importing queue:", error);
+    } finally {
+      setUiState(prev => ({...prev, importProgress: null}));
     }
   });
 
@@ -381,6 +585,8 @@ export default function RootLayout({children}) {
           nodes: nodeIDs,
           integrity: true
         }));
+      } else {
+        loadRunningItem(currentJob.id);
       }
     }
   }, [appStatus.queue]);
@@ -388,7 +594,7 @@ export default function RootLayout({children}) {
   useEffect(() => {
     setAppStatus(prev => ({ ...prev, queue: null }));
     fetchQueueItems();
-  }, [appStatus.route]);
+  }, [appStatus.route, appStatus.tier]);
 
   // on mount get the queue items from the server
   useEffect(() => {
@@ -460,6 +666,37 @@ export default function RootLayout({children}) {
         >Completed
         </button>
 
+        {/* Items past their retention are kept in the cold tier (see QM_Queue.expire_items() in qm_queue.py) */}
+        {appStatus.route !== 'queue' &&
+          <label className="tier ml-auto mr-2 flex items-center gap-1 text-neutral-500">
+            <input
+              type="checkbox"
+              checked={appStatus.tier === 'cold'}
+              onChange={(event) => {
+                setAppStatus(prev => ({...prev, tier: event.target.checked ? 'cold' : 'hot'}));
+              }}
+            />
+            Expired
+          </label>
+        }
+
+        {/* Full-text search: workflow name, node types, model names and text inputs (see search_query() in helpers.py) */}
+        <input
+          type="search"
+          className={"search mr-2" + (appStatus.route === 'queue' ? " ml-auto" : "") + " px-2 rounded dark:bg-neutral-800 bg-neutral-100"}
+          placeholder="Search"
+          onKeyDown={(event) => {
+            if (event.key !== "Enter") {
+              return;
+            }
+            const value = event.target.value.trim();
+            setAppStatus(prev => {
+              const {search: _, ...filters} = prev.filters || {};
+              return {...prev, filters: value ? {...filters, search: {type: "search", value, valueLabel: value}} : filters};
+            });
+          }}
+        />
+
       </div>
       {isFilterOn() &&
         <div className="filters flex items-center p-2">
@@ -507,45 +744,15 @@ export default function RootLayout({children}) {
                progress={currentJob.progress}
                route={appStatus.route}
                shiftDown={appStatus.shiftDown}
+               onLoadMore={fetchMoreQueueItems}
         />
       </div>
       <footer className={"footer"}>
         <div className={"paging flex"}>
-          {appStatus.queue && appStatus.queue.info && (appStatus.queue.info.last_page > 0) &&
-            <>
-              {/* Previous page if needed */}
-              <button
-                className={"page" + (appStatus.queue.info.page === 0 ? ' disabled' : '')}
-                onClick={() => {
-                  setAppStatus(prev => ({...prev, queue: null}));
-                  fetchQueueItems(appStatus.queue.info.page - 1);
-                }}
-                disabled={appStatus.queue.info.page === 0}
-              > &lt;&lt; </button>
-              <div className={'pages flex justify-center flex-1'}>
-                {Array.from({length: (appStatus.queue.info.last_page + 1)}, (_, i) => (
-                  <button
-                    key={i}
-                    className={"page" + (appStatus.queue.info.page === i ? ' active' : '')}
-                    onClick={() => {
-                      setAppStatus(prev => ({...prev, queue: null}));
-                      fetchQueueItems(i);
-                    }}
-                  >
-                    {i + 1}
-                  </button>
-                ))}
-              </div>
-              {/* Next page if needed */}
-              <button
-                className={"page" + (appStatus.queue.info.page === appStatus.queue.info.last_page ? ' disabled' : '')}
-                onClick={() => {
-                  setAppStatus(prev => ({...prev, queue: null}));
-                  fetchQueueItems(appStatus.queue.info.page + 1);
-                }}
-                disabled={appStatus.queue.info.page === appStatus.queue.info.last_page}
-              > &gt;&gt; </button>
-            </>
+          {appStatus.queue && appStatus.queue.info && appStatus.queue.info.total > 0 &&
+            <span className={"loaded text-neutral-500"}>
+              {appStatus.queue.pending.length} / {appStatus.queue.info.total}
+            </span>
           }
         </div>
         <div className="p-2 flex actions">
@@ -587,7 +794,7 @@ export default function RootLayout({children}) {
                     </svg>
                     Run All {isFilterOn() ? "*" : ""}
                   </button>
-                  <a href={baseURL + "queue_manager/export" + appendFilters("?route=archive")}
+                  <a href={baseURL + "queue_manager/export" + appendTier(appendFilters("?route=archive"))}
                      className="hover:bg-neutral-700 dark:bg-teal-700 bg-teal-200 text-neutral-900  py-1 px-2 rounded mr-1 border-0">📤
                     Export {isFilterOn() ? "*" : "Archive"}
                   </a>
@@ -599,7 +806,7 @@ export default function RootLayout({children}) {
               }
               {appStatus.route === 'completed' &&
                 <>
-                  <a href={baseURL + "queue_manager/export" + appendFilters("?route=completed")}
+                  <a href={baseURL + "queue_manager/export" + appendTier(appendFilters("?route=completed"))}
                      className="hover:bg-neutral-700 dark:bg-teal-700 bg-teal-200 text-neutral-900  py-1 px-2 rounded mr-1 border-0">📤
                     Export {isFilterOn() ? "*" : "Completed"}
                   </a>
@@ -623,14 +830,16 @@ export default function RootLayout({children}) {
                 id="uploadQueueForm"
                 type="file"
                 name="queue_json"
-                accept=".json"
+                accept=".json,.ndjson"
                 required
                 hidden
                 onChange={uploadQueue}
               />
               <label htmlFor={"uploadQueueForm"}
                      className={"hover:bg-neutral-700 py-1 px-2 rounded mr-1 border-0 dark:bg-teal-900 bg-teal-300"}>📁
-                Import {appStatus.route === 'queue' ? 'Queue' : 'Archive'}</label>
+                {uiState.importProgress ?
+                  `Importing… ${uiState.importProgress.total_imported}` :
+                  `Import ${appStatus.route === 'queue' ? 'Queue' : 'Archive'}`}</label>
             </form>
           }
         </div>
@@ -1,17 +1,37 @@
 "use client";           // (keep for app-router; harmless in pages-router)
 
-import React, {useContext, useEffect, useState} from "react";
+import React, {useContext, useEffect, useRef, useState} from "react";
 import {baseURL} from "@/internals/config";
 import {apiCall} from "@/internals/functions";
 import {AppContext} from "@/internals/app-context";
 
 
+/**
+ * Running items are full native queue tuples, pending ones are summaries. Render both from the summary shape.
+ */
+export function toSummary(item) {
+  if (!Array.isArray(item)) {
+    return item;
+  }
+
+  const workflow = item[3].extra_pnginfo ? item[3].extra_pnginfo.workflow : null;
+  return {
+    db_id: item[3].db_id,
+    prompt_id: item[1],
+    number: item[0],
+    name: workflow ? workflow.workflow_name : null,
+    workflow_id: workflow ? workflow.id : null,
+    workflow: workflow,
+  };
+}
+
 // take items from parent component
-export default function Queue( { data, isLoading, error, progress } ) {
+export default function Queue( { data, isLoading, error, progress, onLoadMore } ) {
   const [state, setState] = useState({
     pending:[],
     running:[],
   })
+  const sentinel = useRef(null);
 
 
   function Button({children, className, onClick}) {
@@ -27,12 +47,19 @@ export default function Queue( { data, isLoading, error, progress } ) {
 
   function QueueItemRow({item, className, loader, index, mode}) {
     const {appStatus, setAppStatus} = useContext(AppContext)
+    // items of the cold tier are addressed by their id in the cold database
+    const tier = appStatus.route !== 'queue' && appStatus.tier === 'cold' ? 'cold' : 'hot';
 
     async function cancelQueueItem() {
+      if (tier === 'cold') {
+        await apiCall(`queue_manager/bulk`, {action: "delete", selection: {ids: [item.db_id], tier}});
+        return;
+      }
+
       const route = (mode === 'running' || mode === 'external') ? 'interrupt' : 'queue';
 
       await apiCall(`api/${route}`, {
-        delete: [item[1]],
+        delete: [item.prompt_id],
       })
     }
 
@@ -41,8 +68,18 @@ export default function Queue( { data, isLoading, error, progress } ) {
      */
     async function loadQueueItem() {
       // console.log("Loading queue item", item);
+      let workflow = item.workflow;
+      if (!workflow) {
+        // summaries don't carry the workflow, load the full item
+        const fullItem = await apiCall(`queue_manager/item?id=${item.db_id}&tier=${tier}`, null, "GET");
+        if (!fullItem) {
+          return;
+        }
+        workflow = fullItem[3].extra_pnginfo.workflow;
+      }
+
       window.parent.postMessage(
-        { type: "QM_LoadWorkflow", workflow: item[3].extra_pnginfo.workflow, number: item[0] },
+        { type: "QM_LoadWorkflow", workflow: workflow, number: item.number },
         "*"
       );
     }
@@ -50,21 +87,21 @@ export default function Queue( { data, isLoading, error, progress } ) {
     // POST to /api/archive with array of item ids to archive
     async function archiveQueueItem() {
       await apiCall(`queue_manager/archive`, {
-        archive: [item[3].db_id],
+        archive: [item.db_id],
       })
     }
 
     async function playItem() {
       console.log("Playing item from client: " + appStatus.clientId);
-      await apiCall(`queue_manager/play`, {items: [item[3].db_id], front: appStatus.shiftDown === true, clientId: appStatus.clientId})
+      await apiCall(`queue_manager/play`, {items: [item.db_id], front: appStatus.shiftDown === true, clientId: appStatus.clientId, tier})
     }
 
     async function filterByWorkflow() {
       // Post message to parent window to filter by workflow
       setAppStatus(prev => ({...prev, filters: {...appStatus.filters, workflow: {
             type: 'workflow',
-            value: item[3].extra_pnginfo.workflow.id,
-            valueLabel: item[3].extra_pnginfo.workflow.workflow_name
+            value: item.workflow_id,
+            valueLabel: item.name
           }}}));
     }
 
@@ -72,7 +109,7 @@ export default function Queue( { data, isLoading, error, progress } ) {
     return (
       <tr className={"dark:odd:bg-neutral-900 odd:bg-neutral-100" + (className ? ' ' + className : '')}>
         <td className="px-3 py-1 serial">
-          <span>{(index === undefined || !data.info)?'':index+1+data.info.page * data.info.page_size}</span>
+          <span>{(index === undefined || !data.info)?'':index+1+(data.info.page || 0) * data.info.page_size}</span>
           {loader &&
             <span className="loader py-1 ">
               <svg xmlns="http://www.w3.org/2000/svg" fill="none" viewBox="0 0 24 24" strokeWidth={1.5} stroke="currentColor" className="size-6"><path strokeLinecap="round" strokeLinejoin="round" d="M16.023 9.348h4.992v-.001M2.985 19.644v-4.992m0 0h4.992m-4.993 0 3.181 3.183a8.25 8.25 0 0 0 13.803-3.7M4.031 9.865a8.25 8.25 0 0 1 13.803-3.7l3.181 3.182m0-4.991v4.99"/></svg>
@@ -80,10 +117,10 @@ export default function Queue( { data, isLoading, error, progress } ) {
           }
         </td>
         <td className="px-3 py-1 text-left name">
-          <button className={'plain'} onClick={filterByWorkflow}>
+          <button className={'plain'} onClick={filterByWorkflow} title={item.preview ? item.preview : undefined}>
             {mode === 'external'
               ? "External job"
-              : (item[3].extra_pnginfo.workflow.workflow_name ? item[3].extra_pnginfo.workflow.workflow_name : "")
+              : (item.name ? item.name : "")
             }
           </button>
         </td>
@@ -123,6 +160,20 @@ export default function Queue( { data, isLoading, error, progress } ) {
     });
   }, [data]);
 
+  // Infinite scroll: load the next page when the end of the list comes into view
+  useEffect(function () {
+    if (!sentinel.current || !onLoadMore) return;
+
+    const observer = new IntersectionObserver(entries => {
+      if (entries[0].isIntersecting) {
+        onLoadMore();
+      }
+    });
+    observer.observe(sentinel.current);
+
+    return () => observer.disconnect();
+  }, [state, onLoadMore]);
+
   if (error)       return <p className="text-red-500 text-center">Loading failed: {error}</p>;
   if (!isLoading && (!data || (!data.running.length && !data.pending.length))) return <p className="italic text-center">No items.</p>;
   if (isLoading && !data)  return <p className="italic text-center">Loading...</p>;
@@ -138,13 +189,16 @@ export default function Queue( { data, isLoading, error, progress } ) {
         </thead>
         <tbody>
           {state.running.map(item => (
-            <QueueItemRow item={item} key={item[1]} className={'running'} loader={true} mode={ item[3].extra_pnginfo ? 'running' : 'external'} />
+            <QueueItemRow item={toSummary(item)} key={toSummary(item).prompt_id} className={'running'} loader={true} mode={ !Array.isArray(item) || item[3].extra_pnginfo ? 'running' : 'external'} />
           ))}
           {state.pending.map((item, index) => (
-            <QueueItemRow item={item} key={item[3].db_id} className={'pending'} index={index} />
+            <QueueItemRow item={toSummary(item)} key={toSummary(item).db_id} className={'pending'} index={index} />
           ))}
         </tbody>
       </table>
+      {data && data.info && data.info.next_cursor &&
+        <div ref={sentinel} className="italic text-center py-2">Loading more...</div>
+      }
     </div>
   );
 }
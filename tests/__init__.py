@@ -1 +0,0 @@
-"""Unit test package for comfyui_queue_manager."""
@@ -1,6 +1,77 @@
 import os
 import sys
+import uuid
+
+import pytest
 
 # Add the project root directory to Python path
 # This allows the tests to import the project
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+# Outside of ComfyUI use stand-ins for the server and execution modules
+try:
+    import server  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "stubs"))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the queue manager at a fresh database."""
+    from src.comfyui_queue_manager import qm_db
+
+    monkeypatch.setattr(qm_db, "DB_PATH", tmp_path / "qm-queue.db")
+    monkeypatch.setattr(qm_db, "_pool", qm_db.QM_ReadPool())
+    monkeypatch.setattr(qm_db, "_writer", qm_db.QM_Writer())
+    qm_db.init_schema()
+    yield qm_db
+    qm_db.close_connections()
+
+
+@pytest.fixture
+def prompt_server():
+    from server import PromptServer
+
+    return PromptServer()
+
+
+@pytest.fixture
+def queue_manager(db, prompt_server):
+    """QueueManager without the HTTP routes (these need a running aiohttp app)."""
+    from src.comfyui_queue_manager.qm_options import QM_Options
+    from src.comfyui_queue_manager.qm_queue import QM_Queue
+
+    class QueueManager:
+        pass
+
+    manager = QueueManager()
+    manager.options = QM_Options()
+    manager.queue = QM_Queue(manager)
+    yield manager
+    # send coalesced notifications before the database goes away
+    manager.queue.notifier.flush()
+
+
+@pytest.fixture
+def queue(queue_manager):
+    return queue_manager.queue
+
+
+@pytest.fixture
+def make_item():
+    """Factory for queue items in the format ComfyUI puts them on the queue."""
+
+    def make(number, workflow_id="workflow-a", name="Workflow A", client_id="client"):
+        prompt_id = str(uuid.uuid4())
+        prompt = {
+            "3": {"class_type": "KSampler", "inputs": {"seed": number, "steps": 20, "model": ["4", 0]}},
+            "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd_xl_base_1.0.safetensors"}},
+            "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "a portrait of a cat", "clip": ["4", 1]}},
+        }
+        extra_data = {
+            "client_id": client_id,
+            "extra_pnginfo": {"workflow": {"id": workflow_id, "workflow_name": name, "nodes": [{"id": 3}, {"id": 4}, {"id": 6}]}},
+        }
+        return [number, prompt_id, prompt, extra_data, ["9"], {}]
+
+    return make
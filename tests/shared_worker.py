@@ -0,0 +1,55 @@
+"""
+Worker process of a shared queue for test_shared.py and benchmarks/bench_shared.py: runs the items of the queue
+database in QM_DB_PATH like ComfyUI's prompt worker until nothing is left, then prints the ids of the prompts it ran.
+
+    QM_DB_PATH=... QM_SHARED_QUEUE=1 QM_WORKER_ID=... python tests/shared_worker.py [seconds per item]
+"""
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+try:
+    import server  # noqa: F401
+except ImportError:
+    sys.path.insert(0, os.path.join(ROOT, "tests", "stubs"))
+
+from server import PromptServer  # noqa: E402
+
+
+def main(seconds):
+    from src.comfyui_queue_manager.qm_db import close_connections, init_schema
+    from src.comfyui_queue_manager.qm_options import QM_Options
+    from src.comfyui_queue_manager.qm_queue import QM_Queue
+
+    init_schema()
+    PromptServer()
+
+    class QueueManager:
+        pass
+
+    manager = QueueManager()
+    manager.options = QM_Options()
+    manager.queue = QM_Queue(manager)
+
+    ran = []
+    while True:
+        got = manager.queue.queue_get(timeout=0.5)
+        if got is None:
+            break
+        item, item_id = got
+        time.sleep(seconds)  # "execute" the prompt
+        manager.queue.task_done(item_id, {}, None)
+        ran.append(item[1])
+
+    manager.queue.notifier.flush()
+    close_connections()
+    print(json.dumps(ran))
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0)
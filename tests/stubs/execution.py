@@ -0,0 +1,59 @@
+"""
+Minimal stand-in for ComfyUI's `execution` module. PromptQueue mirrors the native implementation closely enough
+for the queue manager's hijacked methods to behave as they do inside ComfyUI.
+"""
+
+import copy
+import heapq
+import threading
+from typing import NamedTuple
+
+
+class PromptQueue:
+    def __init__(self, server):
+        self.server = server
+        self.mutex = threading.RLock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.task_counter = 0
+        self.queue = []
+        self.currently_running = {}
+        self.history = {}
+        self.flags = {}
+
+    def put(self, item):
+        with self.mutex:
+            heapq.heappush(self.queue, item)
+            self.server.queue_updated()
+            self.not_empty.notify()
+
+    def get(self, timeout=None):
+        with self.not_empty:
+            while len(self.queue) == 0:
+                self.not_empty.wait(timeout=timeout)
+                if timeout is not None and len(self.queue) == 0:
+                    return None
+            item = heapq.heappop(self.queue)
+            i = self.task_counter
+            self.currently_running[i] = copy.deepcopy(item)
+            self.task_counter += 1
+            self.server.queue_updated()
+            return (item, i)
+
+    class ExecutionStatus(NamedTuple):
+        status_str: str
+        completed: bool
+        messages: list
+
+    def task_done(self, item_id, history_result, status, process_item=None):
+        with self.mutex:
+            prompt = self.currently_running.pop(item_id)
+            self.history[prompt[1]] = {"prompt": prompt, "outputs": {}, "status": status}
+            self.server.queue_updated()
+
+    def get_current_queue(self):
+        with self.mutex:
+            return list(self.currently_running.values()), copy.deepcopy(self.queue)
+
+    def get_tasks_remaining(self):
+        with self.mutex:
+            return len(self.queue) + len(self.currently_running)
@@ -0,0 +1,27 @@
+"""
+Minimal stand-in for ComfyUI's `server` module so the queue manager can be imported and exercised without ComfyUI.
+Only the parts of PromptServer the extension touches are implemented.
+"""
+
+from execution import PromptQueue
+
+
+class PromptServer:
+    instance = None
+
+    def __init__(self):
+        PromptServer.instance = self
+        self.number = 0
+        self.client_id = None
+        self.prompt_queue = PromptQueue(self)
+        # every send_sync() call is recorded as (event, data) so tests can assert on notifications
+        self.messages = []
+
+    def get_queue_info(self):
+        return {"exec_info": {"queue_remaining": self.prompt_queue.get_tasks_remaining()}}
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data))
+
+    def queue_updated(self):
+        self.send_sync("status", {"status": self.get_queue_info()})
@@ -0,0 +1,40 @@
+"""Tests for the queue page cache."""
+
+from src.comfyui_queue_manager.qm_cache import QM_ResponseCache, etag_matches, make_etag
+
+
+def test_entries_follow_the_revision():
+    cache = QM_ResponseCache(2)
+    cache.put(1, "route=queue", b"a")
+    cache.put(1, "route=archive", b"b")
+    assert cache.get(1, "route=queue") == b"a"
+
+    # least recently used entry goes first
+    cache.put(1, "route=completed", b"c")
+    assert cache.get(1, "route=archive") is None
+    assert cache.get(1, "route=queue") == b"a"
+
+    # a change of the queue drops everything, late responses of older revisions are not stored
+    assert cache.get(2, "route=queue") is None
+    cache.put(2, "route=queue", b"d")
+    cache.put(1, "route=archive", b"b")
+    assert cache.get(2, "route=queue") == b"d"
+    assert cache.get(1, "route=archive") is None
+
+
+def test_etags():
+    etag = make_etag(5, "page_size=100&route=queue")
+    assert etag == make_etag(5, "page_size=100&route=queue")
+    assert etag != make_etag(6, "page_size=100&route=queue")
+    assert etag != make_etag(5, "page_size=100&route=archive")
+    assert etag_matches(f'"x", {etag}', etag)
+    assert etag_matches("W/" + etag, etag)
+    assert not etag_matches(None, etag)
+
+
+def test_revision_changes_with_the_queue(queue, make_item):
+    revision = queue.revision
+    queue.get_current_queue(0, 10)
+    assert queue.revision == revision
+    queue.queue_put(make_item(1))
+    assert queue.revision > revision
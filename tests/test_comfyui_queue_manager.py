@@ -3,22 +3,32 @@
 """Tests for `comfyui_queue_manager` package."""
 
 import pytest
-from src.comfyui_queue_manager.nodes import Example
+from src.comfyui_queue_manager.nodes import NODE_CLASS_MAPPINGS, WorkflowName
 
 
 @pytest.fixture
-def example_node():
-    """Fixture to create an Example node instance."""
-    return Example()
+def workflow_name_node(prompt_server):
+    """Fixture to create a WorkflowName node instance."""
+    return WorkflowName()
 
 
-def test_example_node_initialization(example_node):
+def test_workflow_name_node_initialization(workflow_name_node):
     """Test that the node can be instantiated."""
-    assert isinstance(example_node, Example)
+    assert isinstance(workflow_name_node, WorkflowName)
+    assert NODE_CLASS_MAPPINGS["Workflow Name"] is WorkflowName
 
 
 def test_return_types():
     """Test the node's metadata."""
-    assert Example.RETURN_TYPES == ("IMAGE",)
-    assert Example.FUNCTION == "test"
-    assert Example.CATEGORY == "Example"
+    assert WorkflowName.RETURN_TYPES == ("STRING",)
+    assert WorkflowName.FUNCTION == "run"
+    assert WorkflowName.CATEGORY == "Queue Manager"
+
+
+def test_running_workflow_name(workflow_name_node, prompt_server, make_item):
+    """Test that the node emits the name of the running workflow."""
+    assert workflow_name_node.run() == ("",)
+
+    prompt_server.prompt_queue.put(tuple(make_item(1, name="My Workflow")))
+    prompt_server.prompt_queue.get()
+    assert workflow_name_node.run() == ("My Workflow",)
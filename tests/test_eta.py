@@ -0,0 +1,110 @@
+"""Tests for the execution timestamps, the run time statistics per workflow and the queue ETA."""
+
+import pytest
+
+
+def run(db, queue, seconds):
+    """Run the next item as if it took `seconds`."""
+    item, task_id = queue.queue_get(timeout=0.01)
+    db.write_query("UPDATE queue SET started_at = started_at - ? WHERE prompt_id = ?", (seconds, item[1]))
+    queue.task_done(task_id, {}, None)
+    return item
+
+
+def test_timestamps(db, queue, make_item):
+    queue.queue_put(make_item(1))
+    enqueued_at, started_at = db.read_single("SELECT enqueued_at, started_at FROM queue")
+    assert enqueued_at is not None and started_at is None
+
+    item, task_id = queue.queue_get(timeout=0.01)
+    started_at, finished_at = db.read_single("SELECT started_at, finished_at FROM queue")
+    assert started_at >= enqueued_at and finished_at is None
+    queue.task_done(task_id, {}, None)
+    finished_at = db.read_single("SELECT finished_at FROM queue")[0]
+    assert finished_at >= started_at
+
+    # played again: enqueued anew, the timestamps of the previous run are cleared
+    queue.play_items([db.read_single("SELECT id FROM queue")[0]], True)
+    assert db.read_single("SELECT enqueued_at >= ?, started_at, finished_at FROM queue", (finished_at,))[:] == (1, None, None)
+
+
+def test_rolling_statistics(db, queue, make_item):
+    for number in range(1, 5):
+        queue.queue_put(make_item(number, *(("workflow-a", "Workflow A") if number < 4 else ("workflow-b", "Workflow B"))))
+    run(db, queue, 10)
+    run(db, queue, 20)
+    queue.eta_smoothing = 0.5
+    run(db, queue, 40)
+    run(db, queue, 100)
+
+    stats = {row["workflow_id"]: row for row in queue.get_timing_stats()}
+    # the first runs are averaged evenly (weight 1 / runs), then the latest run weighs eta_smoothing
+    assert stats["workflow-a"]["runs"] == 3
+    assert stats["workflow-a"]["mean_seconds"] == pytest.approx(27.5, abs=0.1)
+    assert stats["workflow-a"]["last_seconds"] == pytest.approx(40, abs=0.1)
+    assert stats["workflow-b"]["mean_seconds"] == pytest.approx(100, abs=0.1)
+    assert stats["workflow-b"]["stddev_seconds"] == 0
+    assert stats[""]["runs"] == 4
+    assert stats[""]["mean_seconds"] == pytest.approx(63.75, abs=0.1)
+
+
+def test_eta_and_expected_starts(db, queue, make_item):
+    assert queue.get_eta()["eta_seconds"] == 0
+    for number in range(1, 9):
+        queue.queue_put(make_item(number, *(("workflow-a", "Workflow A") if number % 2 else ("workflow-b", "Workflow B"))))
+    assert queue.get_eta()["eta_seconds"] is None  # nothing finished yet
+
+    run(db, queue, 10)  # workflow-a
+    run(db, queue, 30)  # workflow-b
+    queue.queue_put(make_item(9, "workflow-c", "Workflow C"))  # never ran: the mean of all workflows
+    item, task_id = queue.queue_get(timeout=0.01)  # workflow-a, started 4 s ago
+    db.write_query("UPDATE queue SET started_at = started_at - 4 WHERE prompt_id = ?", (item[1],))
+
+    eta = queue.get_eta()
+    assert (eta["pending"], eta["running"], eta["workers"]) == (6, 1, 1)
+    assert eta["mean_seconds"] == pytest.approx(20, abs=0.1)
+    assert eta["running_seconds"] == pytest.approx(6, abs=0.1)
+    # 2 x workflow-a, 3 x workflow-b, 1 x workflow-c
+    assert eta["eta_seconds"] == pytest.approx(6 + 2 * 10 + 3 * 30 + 20, abs=0.1)
+    assert eta["eta_at"] == pytest.approx(eta["timestamp"] + eta["eta_seconds"])
+
+    # expected starts of items 6 and 7
+    ids = {row[0]: row[1] for row in db.read_query("SELECT number, id FROM queue WHERE status = 0")}
+    starts = queue.get_expected_starts([ids[7], ids[6]], eta)
+    now = eta["timestamp"]
+    assert [starts[ids[6]] - now, starts[ids[7]] - now] == pytest.approx([6 + 30 + 10, 6 + 30 + 10 + 30], abs=0.1)
+    # items of other workflows ahead and in between are taken into account
+    starts = queue.get_expected_starts([ids[4], ids[6], ids[8]], eta)
+    assert [starts[ids[number]] - now for number in (4, 6, 8)] == pytest.approx([6, 6 + 40, 6 + 80], abs=0.1)
+    assert queue.get_expected_starts([item[3].get("db_id", -1), 12345], eta) == {}  # not pending
+
+    # the time-relative estimates are not part of the listings, which are cached per revision
+    running, pending, info = queue.get_current_queue(0, 10, return_meta=True, cursor=[], summary=True)
+    assert "eta" not in info and all("expected_start" not in item for item in pending)
+
+
+def test_page_cost_does_not_depend_on_position(db, queue, make_item):
+    """With run time statistics, a queue page costs the same at the head of a long queue and deep into it."""
+    queue.import_queue([make_item(number) for number in range(1, 3001)], None, 0)
+    run(db, queue, 10)
+
+    db.get_pool().resize(1)  # single reader, so the SQLite work of the page is counted on one connection
+    with db.get_pool().connection() as reader:
+        pass
+    steps = []
+
+    def page_steps(cursor):
+        steps.clear()
+        for conn in (reader, db.get_writer().connection()):
+            conn.set_progress_handler(lambda: steps.append(1) and 0, 100)
+        try:
+            info = queue.get_current_queue(0, 20, return_meta=True, cursor=cursor, with_total=False, summary=True)[2]
+        finally:
+            for conn in (reader, db.get_writer().connection()):
+                conn.set_progress_handler(None, 100)
+        return len(steps), info["next_cursor"]
+
+    head, cursor = page_steps([])
+    deep_cursor = list(db.read_single("SELECT number, id FROM queue WHERE status = 0 ORDER BY number, id LIMIT 1 OFFSET 2900"))
+    deep, _ = page_steps(deep_cursor)
+    assert deep <= head * 1.5 + 5
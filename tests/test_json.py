@@ -0,0 +1,54 @@
+"""JSON codec: every codec must round-trip queue items the same way as stdlib json."""
+
+import json
+
+import pytest
+
+from src.comfyui_queue_manager import qm_json
+
+
+@pytest.fixture(params=["orjson", "msgspec", "json"])
+def codec(request):
+    if request.param != "json" and getattr(qm_json, request.param) is None:
+        pytest.skip(f"{request.param} is not installed")
+    previous = qm_json.get_codec()
+    qm_json.set_codec(request.param)
+    yield request.param
+    qm_json.set_codec(previous)
+
+
+def test_round_trip(codec, make_item):
+    item = make_item(1)
+    item[2]["3"]["inputs"]["seed"] = 2**64 + 1  # beyond 64 bits, handled by the stdlib fallback
+    item[2]["6"]["inputs"]["text"] = "zażółć 🐈"
+    item[3]["db_id"] = None
+
+    encoded = qm_json.dumps_bytes(item)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == item
+    assert qm_json.loads(encoded) == item
+    assert qm_json.loads(qm_json.dumps(item)) == item
+    assert qm_json.loads(json.dumps(item)) == item
+    assert qm_json.dumps_bytes((1, "a")) == qm_json.dumps_bytes([1, "a"])
+
+    with pytest.raises(json.JSONDecodeError):
+        qm_json.loads("[1,")
+
+
+def test_queue_with_codec(codec, queue, make_item):
+    items = [make_item(number) for number in range(1, 4)]
+    for item in items:
+        queue.queue_put(item)
+    assert sorted(queue.get_full_queue("queue"), key=lambda item: item[0]) == items
+
+    queue.queue_manager.options.set("takeover_client", {"client_id": "abc"})
+    assert queue.queue_manager.options.get("takeover_client") == {"client_id": "abc"}
+
+
+def test_unknown_codec_falls_back_to_json():
+    previous = qm_json.get_codec()
+    try:
+        qm_json.set_codec("yaml")
+        assert qm_json.get_codec() == "json"
+    finally:
+        qm_json.set_codec(previous)
@@ -0,0 +1,52 @@
+"""Tests for the queue mutex profiling."""
+
+import threading
+import time
+
+from src.comfyui_queue_manager.qm_locks import QM_TimingStats, profiler
+
+
+def test_profiling_disabled_returns_the_lock(queue):
+    assert not profiler.enabled
+    assert queue.locked("queue_put") is queue.native_queue.mutex
+
+
+def test_wait_and_hold_per_site(queue, make_item):
+    profiler.configure(True, 0)
+    profiler.reset()
+    try:
+        queue.queue_put(make_item(1))
+
+        # hold the mutex from another thread so get_current_queue has to wait for it
+        held = threading.Event()
+
+        def hold():
+            with queue.locked("holder"):
+                held.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        held.wait()
+        queue.get_current_queue(0, 10)
+        thread.join()
+
+        sites = profiler.summary()["sites"]
+        assert sites["queue_put"]["wait"]["count"] == 1
+        assert sites["holder"]["hold"]["max_ms"] >= 40
+        assert sites["get_current_queue"]["wait"]["max_ms"] >= 20
+        assert list(sites)[0] == "get_current_queue"  # worst waits first
+        assert "get_current_queue n=1" in profiler.log_line()
+    finally:
+        profiler.configure(False)
+        profiler.reset()
+
+
+def test_percentiles():
+    stats = QM_TimingStats()
+    for _ in range(99):
+        stats.add(0.0002)
+    stats.add(0.3)
+    assert stats.percentile(0.5) == 0.00025
+    assert stats.percentile(0.99) == 0.00025
+    assert stats.percentile(1.0) == 0.3
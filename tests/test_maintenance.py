@@ -0,0 +1,85 @@
+"""Tests for the background database maintenance."""
+
+import sqlite3
+
+
+def make_maintenance(queue_manager, queue=None, **options):
+    from src.comfyui_queue_manager.qm_maintenance import QM_Maintenance
+
+    defaults = {"wal_checkpoint_mb": 0, "vacuum_free_pages": 10, "analyze_interval": 1}
+    for key, value in {**defaults, **options}.items():
+        queue_manager.options.set(key, value)
+    return QM_Maintenance(queue_manager.options, queue)
+
+
+def fill(queue, make_item, count):
+    items = [make_item(number) for number in range(count)]
+    for item in items:
+        item[2]["6"]["inputs"]["text"] = "a portrait of a cat " * 200  # make the rows take some pages
+    queue.import_queue(items, None, 3)
+
+
+def test_checkpoint_vacuum_and_optimize(db, queue_manager, queue, make_item):
+    assert db.read_single("PRAGMA auto_vacuum")[0] == 2  # new databases use incremental auto vacuum
+
+    fill(queue, make_item, 300)
+    queue.delete_from_queue("archive")
+    free_pages = db.read_single("PRAGMA freelist_count")[0]
+    assert free_pages > 10
+
+    maintenance = make_maintenance(queue_manager)
+    actions = maintenance.run_once()
+    assert any(action.startswith("checkpoint") for action in actions)
+    assert f"incremental vacuum of {free_pages} pages" in actions
+    assert "optimize" in actions
+    assert db.read_single("PRAGMA freelist_count")[0] == 0
+    assert maintenance.report["runs"] == 1 and maintenance.report["vacuumed_pages"] == free_pages
+
+
+def test_existing_database_is_converted_when_idle(db, queue_manager, queue, make_item):
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+    # connections cache the auto_vacuum mode, reopen them like on a restart
+    db.close_connections()
+    assert db.read_single("PRAGMA auto_vacuum")[0] == 0
+
+    fill(queue, make_item, 200)
+    queue.delete_from_queue("archive")
+
+    maintenance = make_maintenance(queue_manager, analyze_interval=0)
+    actions = maintenance.run_once()
+    assert any(action.startswith("converted to incremental auto vacuum") for action in actions)
+    conn = sqlite3.connect(db.DB_PATH)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+
+def test_expired_items_are_moved_and_vacuumed(db, queue_manager, queue, make_item):
+    fill(queue, make_item, 300)
+    queue.retention["archive"] = (0, 50)
+
+    maintenance = make_maintenance(queue_manager, queue, analyze_interval=0)
+    actions = maintenance.run_once()
+    assert actions[0] == "moved 250 expired items to the cold tier"
+    assert any(action.startswith("incremental vacuum") for action in actions)
+    assert maintenance.report["expired"] == 250
+    assert queue.get_status_counts()[3] == 50
+    assert db.read_single("SELECT COUNT(*) FROM cold.queue")[0] == 250
+
+
+def test_cold_tier_is_checkpointed_and_vacuumed(db, queue_manager, queue, make_item):
+    fill(queue, make_item, 300)
+    queue.retention["archive"] = (0, 1)
+    assert queue.expire_items() == 299
+    queue.delete_from_queue("archive", tier="cold")
+    free_pages = db.read_single("PRAGMA cold.freelist_count")[0]
+    assert free_pages > 10
+
+    maintenance = make_maintenance(queue_manager, queue, analyze_interval=0)
+    actions = maintenance.run_once()
+    assert any(action.startswith("checkpoint") and action.endswith("WAL of the cold tier") for action in actions)
+    assert f"incremental vacuum of {free_pages} pages of the cold tier" in actions
+    assert db.read_single("PRAGMA cold.freelist_count")[0] == 0
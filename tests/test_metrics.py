@@ -0,0 +1,85 @@
+"""Tests for the Prometheus metrics."""
+
+import re
+
+from src.comfyui_queue_manager import qm_metrics
+
+
+def sample(text, name, labels=""):
+    match = re.search("^" + re.escape(name + labels) + r" (\S+)$", text, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_lifecycle_metrics(queue, make_item):
+    before = qm_metrics.render({})
+    for number in range(1, 4):
+        queue.queue_put(make_item(number))
+    got = queue.queue_get(timeout=0.01)
+    queue.task_done(got[1], {}, None)
+    queue.archive_queue()
+
+    text = qm_metrics.render(queue.get_status_counts())
+    assert 'queue_manager_items{status="completed"} 1' in text
+    assert 'queue_manager_items{status="archived"} 2' in text
+    assert sample(text, "queue_manager_put_total") - sample(before, "queue_manager_put_total") == 3
+    assert sample(text, "queue_manager_get_total") - sample(before, "queue_manager_get_total") == 1
+    assert sample(text, "queue_manager_done_total") - sample(before, "queue_manager_done_total") == 1
+    assert sample(text, "queue_manager_archived_total") - sample(before, "queue_manager_archived_total") == 2
+    assert sample(text, "queue_manager_wait_seconds_count") - sample(before, "queue_manager_wait_seconds_count") == 1
+    assert sample(text, "queue_manager_run_seconds_count") - sample(before, "queue_manager_run_seconds_count") == 1
+
+    # statement latencies are labelled by verb and table
+    assert sample(text, "queue_manager_db_statement_seconds_count", '{statement="UPDATE queue"}') > 0
+    assert sample(text, "queue_manager_db_statement_seconds_count", '{statement="INSERT queue"}') >= 3
+    assert 'queue_manager_db_statement_seconds_bucket{statement="INSERT queue",le="+Inf"}' in text
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = qm_metrics.Histogram("test_seconds", "Test", (1, 2), ("kind",))
+    for value in (0.5, 1.5, 1.7, 5):
+        histogram.observe(value, "a")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{kind="a",le="1.0"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="2.0"} 3' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{kind="a"} 4' in lines
+
+
+def test_metrics_can_be_disabled(queue, make_item):
+    qm_metrics.set_enabled(False)
+    try:
+        before = qm_metrics.render({})
+        queue.queue_put(make_item(1))
+        assert qm_metrics.render({}) == before
+    finally:
+        qm_metrics.set_enabled(True)
+
+
+def test_statement_label():
+    assert qm_metrics.statement_label("\n  SELECT id FROM queue WHERE status = 0") == "SELECT queue"
+    assert qm_metrics.statement_label("INSERT INTO blobs (hash) VALUES (?)") == "INSERT blobs"
+    assert qm_metrics.statement_label("COMMIT") == "COMMIT"
+
+
+def test_deleted_running_items_are_dropped(queue, make_item):
+    for number in range(1, 4):
+        queue.queue_put(make_item(number))
+
+    first = queue.queue_get(timeout=0.01)
+    queue.delete_running(first[0][1])
+    assert first[0][1] not in qm_metrics._started
+
+    second = queue.queue_get(timeout=0.01)
+    queue.delete_items([second[0][1]])
+    assert second[0][1] not in qm_metrics._started
+
+    # the native worker still reports the interrupted items as done, they don't count as finished
+    before = qm_metrics.render({})
+    queue.task_done(first[1], {}, None)
+    queue.task_done(second[1], {}, None)
+    assert sample(qm_metrics.render({}), "queue_manager_done_total") == sample(before, "queue_manager_done_total")
+
+    third = queue.queue_get(timeout=0.01)
+    queue.delete_running()
+    assert qm_metrics._started == {}
+    queue.task_done(third[1], {}, None)
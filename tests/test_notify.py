@@ -0,0 +1,71 @@
+"""Tests for coalesced queue change notifications."""
+
+import time
+
+from src.comfyui_queue_manager.qm_notify import QM_Notifier
+
+
+def test_first_event_is_sent_and_burst_is_merged(prompt_server):
+    notifier = QM_Notifier(50)
+    for _ in range(3):
+        notifier.send("queue-manager-queue-updated", {"total_moved": 2})
+    notifier.send("queue-manager-queue-updated", {"deleted": 1})
+    assert prompt_server.messages == [("queue-manager-queue-updated", {"total_moved": 2})]
+
+    time.sleep(0.15)
+    assert prompt_server.messages[1:] == [("queue-manager-queue-updated", {"total_moved": 4, "deleted": 1})]
+
+    # the window has passed, next event goes out right away
+    notifier.send("queue-manager-queue-updated", {"deleted": 3})
+    assert prompt_server.messages[-1] == ("queue-manager-queue-updated", {"deleted": 3})
+    notifier.flush()
+    assert len(prompt_server.messages) == 3
+
+
+def test_status_burst(queue, make_item, prompt_server):
+    # the first item goes to the native heap, every other put only notifies the clients
+    queue.queue_put(make_item(1))
+    prompt_server.messages.clear()
+    start = time.monotonic()
+    for number in range(2, 502):
+        queue.queue_put(make_item(number))
+    windows = (time.monotonic() - start) / queue.notifier.window
+    queue.notifier.flush()
+    assert 1 <= [event for event, data in prompt_server.messages].count("status") <= windows + 2
+
+
+def test_zero_window_sends_everything(prompt_server):
+    notifier = QM_Notifier(0)
+    for _ in range(3):
+        notifier.send("queue-manager-queue-updated", {"total_moved": 1})
+    assert len(prompt_server.messages) == 3
+
+
+def test_queue_deltas_follow_revisions(queue, make_item, prompt_server):
+    revision = queue.get_current_queue(0, 10, return_meta=True)[2]["revision"]
+    first, second = make_item(1), make_item(2)
+    queue.queue_put(first)
+    queue.queue_put(second)
+    queue.delete_items([second[1]])
+    queue.archive_queue()
+    queue.notifier.flush()
+
+    deltas = [data for event, data in prompt_server.messages if event == "queue-manager-queue-delta"]
+    assert deltas[0]["base_revision"] == revision
+    assert deltas[0]["changes"][0]["op"] == "insert"
+    assert deltas[0]["changes"][0]["item"]["prompt_id"] == first[1]
+    # the rest was merged within the window, a bulk change turns it into a refetch
+    assert deltas[1] == {"base_revision": revision + 1, "revision": revision + 4, "refetch": True}
+    assert queue.get_current_queue(0, 10, return_meta=True)[2]["revision"] == revision + 4
+
+
+def test_merged_deltas():
+    from src.comfyui_queue_manager.qm_notify import merge
+
+    payload = merge(None, {"base_revision": 1, "revision": 2, "changes": [{"op": "remove", "prompt_id": "a"}]})
+    payload = merge(payload, {"base_revision": 2, "revision": 3, "changes": [{"op": "remove", "prompt_id": "b"}]})
+    assert payload == {
+        "base_revision": 1,
+        "revision": 3,
+        "changes": [{"op": "remove", "prompt_id": "a"}, {"op": "remove", "prompt_id": "b"}],
+    }
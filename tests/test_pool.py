@@ -0,0 +1,65 @@
+"""Tests for the read-only connection pool."""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+
+def test_readers_are_read_only(db):
+    with db.get_pool().connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM cold.queue").fetchone()[0] == 0
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM queue")
+
+
+def test_pool_is_bounded(db):
+    pool = db.QM_ReadPool(2)
+    first, first_generation = pool.acquire()
+    second, second_generation = pool.acquire()
+    assert first is not second
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    assert acquired == []  # both connections are in use
+
+    pool.release(first, first_generation)
+    waiter.join(1)
+    assert acquired[0][0] is first and pool.opened == 2
+
+    pool.release(*acquired[0])
+    pool.release(second, second_generation)
+    pool.close()
+    assert pool.opened == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+
+
+def test_connection_settings(db):
+    db.configure_connections(2, cache_size_kb=1024, mmap_size_mb=0, temp_store="file", cached_statements=16)
+    try:
+        with db.get_pool().connection() as conn:
+            assert conn.execute("PRAGMA cache_size").fetchone()[0] == -1024
+            assert conn.execute("PRAGMA cold.cache_size").fetchone()[0] == -1024
+            assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 0
+            assert conn.execute("PRAGMA temp_store").fetchone()[0] == 1
+        assert db.get_writer().connection().execute("PRAGMA cache_size").fetchone()[0] == -1024
+        assert db.get_pool().size == 2
+    finally:
+        db.configure_connections()
+
+
+def test_reads_see_committed_writes_only(db):
+    db.configure_writer("batched", 60_000)
+    db.write_query("INSERT INTO options (key, value) VALUES ('a', '1')")
+    # uncommitted writes are read through the writer connection, other readers keep their snapshot
+    assert db.read_single("SELECT value FROM options WHERE key = 'a'")[0] == "1"
+    with db.get_pool().connection() as conn:
+        assert conn.execute("SELECT value FROM options WHERE key = 'a'").fetchone() is None
+    db.get_writer().flush()
+    with db.get_pool().connection() as conn:
+        assert conn.execute("SELECT value FROM options WHERE key = 'a'").fetchone()[0] == "1"
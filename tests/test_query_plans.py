@@ -0,0 +1,102 @@
+"""
+Query plan regression check: every SQL statement QM_Queue runs must be served by an index,
+without full table scans or temporary B-tree sorts.
+"""
+
+import re
+
+import pytest
+
+ROUTES = ["queue", "archive", "completed"]
+WORKFLOW_FILTER = {"workflow": {"type": "workflow", "value": "workflow-b", "valueLabel": "Workflow B"}}
+SEARCH_FILTER = {"search": {"type": "search", "value": "portrait KSampler", "valueLabel": "portrait KSampler"}}
+
+
+@pytest.fixture
+def statements(db):
+    """Record every statement executed on the read connection and on the writer connection."""
+    recorded = []
+    # the tests read from a single thread, so they always get the same connection back from the pool
+    db.get_pool().resize(1)
+    with db.get_pool().connection() as reader:
+        pass
+    connections = [reader, db.get_writer().connection()]
+    for conn in connections:
+        conn.set_trace_callback(recorded.append)
+    yield recorded
+    for conn in connections:
+        conn.set_trace_callback(None)
+
+
+def exercise_queue(queue, make_item):
+    """Call every QM_Queue method that touches the database, across all routes and filters."""
+    for number in range(1, 11):
+        queue.queue_put(make_item(number, *(("workflow-a", "Workflow A") if number % 2 else ("workflow-b", "Workflow B"))))
+
+    queue.get_tasks_remaining()
+    queue.get_facets()
+
+    item, task_id = queue.queue_get(timeout=0.1)
+    queue.task_done(task_id, {}, None)
+    item, task_id = queue.queue_get(timeout=0.1)
+
+    for route in ROUTES:
+        for filters in (None, WORKFLOW_FILTER, SEARCH_FILTER):
+            queue.get_current_queue(1, 2, route=route, filters=filters, return_meta=True)
+            running, pending, info = queue.get_current_queue(0, 2, route=route, filters=filters, return_meta=True, cursor=[])
+            if info["next_cursor"] is not None:
+                queue.get_current_queue(0, 2, route=route, filters=filters, return_meta=True, cursor=info["next_cursor"], with_total=True)
+            queue.get_current_queue(0, 2, route=route, filters=filters, return_meta=True, cursor=[], summary=True)
+            queue.get_full_queue(route, filters)
+            list(queue.iter_full_queue(route, filters, 2))
+
+    archived = queue.get_current_queue(0, 2, return_meta=True, cursor=[])[1]
+    queue.get_item(archived[0][3]["db_id"])
+    queue.archive_items([archived[0][3]["db_id"]])
+    queue.archive_queue(WORKFLOW_FILTER)
+    queue.play_items([archived[0][3]["db_id"]], True, "client")
+    queue.play_archive("client", WORKFLOW_FILTER)
+    queue.archive_queue()
+    queue.play_archive("client")
+    queue.delete_items([archived[1][1]])
+    queue.archive_selection({"route": "queue", "filters": WORKFLOW_FILTER, "exclude": [archived[0][3]["db_id"]]})
+    queue.delete_selection({"route": "archive", "exclude": [archived[0][3]["db_id"]]})
+    queue.archive_selection({"route": "queue", "filters": SEARCH_FILTER})
+    queue.delete_selection({"ids": [archived[0][3]["db_id"]]})
+    queue.delete_running(item[1])
+    queue.delete_running()
+    imported = make_item(0, "workflow-c", "Workflow C")
+    queue.import_queue([imported, imported], "client", 3)
+    queue.delete_from_queue("archive", WORKFLOW_FILTER)
+    queue.delete_from_queue("completed")
+    queue.restore_queue(True)
+    queue.wipe_queue()
+    queue.queue_manager.options.set("queue_paused", False)
+    queue.queue_manager.options.get("takeover_client")
+
+
+def query_plan(conn, statement):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + statement)]
+
+
+def test_every_statement_uses_an_index(db, queue, make_item, statements):
+    exercise_queue(queue, make_item)
+
+    queries = {s.strip() for s in statements if re.match(r"\s*(SELECT|UPDATE|DELETE|INSERT)\b", s, re.IGNORECASE)}
+    # FTS5 reads its own (single row) config table
+    queries = {query for query in queries if "'queue_fts_" not in query}
+    assert len(queries) > 20
+
+    conn = db.get_writer().connection()
+    regressions = []
+    for query in sorted(queries):
+        plan = query_plan(conn, query)
+        # rows of subqueries computed by the statement itself (with an index, checked on their own plan lines)
+        computed = {detail.split(" ", 1)[1] for detail in plan if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+        for detail in plan:
+            # Scanning a table-valued function / virtual table / computed subquery is fine, scanning the queue or options table is not
+            is_table_scan = detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail and detail[len("SCAN ") :] not in computed
+            if is_table_scan or "TEMP B-TREE" in detail:
+                regressions.append(f"{detail}\n    {' '.join(query.split())[:300]}")
+
+    assert regressions == [], "Query plan regressions:\n" + "\n".join(regressions)
@@ -0,0 +1,548 @@
+"""Tests for QM_Queue running against a real database and a stand-in PromptServer."""
+
+import json
+import sqlite3
+import time
+
+import pytest
+
+
+def test_summary_listing(queue, make_item):
+    item = make_item(1, "workflow-a", "Workflow A", client_id="abc")
+    queue.queue_put(item)
+
+    running, pending, info = queue.get_current_queue(0, 10, return_meta=True, cursor=[], summary=True)
+
+    assert pending == [
+        {
+            "db_id": pending[0]["db_id"],
+            "prompt_id": item[1],
+            "number": 1,
+            "name": "Workflow A",
+            "workflow_id": "workflow-a",
+            "client_id": "abc",
+            "node_count": 3,
+            "preview": "a portrait of a cat",
+        }
+    ]
+
+    full = queue.get_item(pending[0]["db_id"])
+    assert full[1] == item[1]
+    assert full[2] == item[2]
+    assert queue.get_item(pending[0]["db_id"] + 1) is None
+
+
+def test_cursor_pages_with_ties(db, queue, make_item):
+    for number in [1, 1, 1, 2, 2, 3, 3, 3, 3, 4, 5]:
+        queue.queue_put(make_item(number))
+    ids = [row[0] for row in db.read_query("SELECT id FROM queue ORDER BY number, id")]
+    queue.archive_items(ids[::2])
+    db.write_query("UPDATE queue SET updated_at = id % 2 WHERE status = 3")
+
+    def walk(route):
+        seen, cursor = [], []
+        while cursor is not None:
+            _, pending, info = queue.get_queue_after(cursor, 2, route, return_meta=True, summary=True)
+            seen.extend(item["db_id"] for item in pending)
+            cursor = info["next_cursor"]
+        return seen
+
+    expected = {
+        "queue": [row[0] for row in db.read_query("SELECT id FROM queue WHERE status = 0 ORDER BY number, id")],
+        "archive": [row[0] for row in db.read_query("SELECT id FROM queue WHERE status = 3 ORDER BY updated_at, id")],
+    }
+    assert len(expected["queue"]) == 5 and len(expected["archive"]) == 6
+    for route in ("queue", "archive"):
+        assert walk(route) == expected[route]
+
+
+def test_summary_columns_migration(tmp_path, monkeypatch, make_item):
+    from src.comfyui_queue_manager import qm_db
+
+    # database created before summary columns existed
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, prompt_id VARCHAR(255) NOT NULL UNIQUE,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            number INTEGER, name TEXT, workflow_id VARCHAR(255), prompt TEXT, status INTEGER DEFAULT 0
+        )
+    """)
+    item = make_item(7, client_id="xyz")
+    conn.execute(
+        "INSERT INTO queue (prompt_id, number, name, workflow_id, prompt, status, updated_at) VALUES (?, ?, ?, ?, ?, 3, '2020-01-01 00:00:00')",
+        (item[1], 7, "Workflow A", "workflow-a", json.dumps(item)),
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(qm_db, "DB_PATH", path)
+    monkeypatch.setattr(qm_db, "_pool", qm_db.QM_ReadPool())
+    monkeypatch.setattr(qm_db, "_writer", qm_db.QM_Writer())
+    qm_db.init_schema()
+
+    row = qm_db.read_single("SELECT client_id, node_count, preview, updated_at FROM queue")
+    assert tuple(row) == ("xyz", 3, "a portrait of a cat", "2020-01-01 00:00:00")
+
+
+def test_workflows_are_stored_once(db, queue, make_item):
+    items = [make_item(number) for number in range(1, 6)]
+    for item in items:
+        queue.queue_put(item)
+
+    assert db.read_single("SELECT COUNT(*), MAX(refs) FROM blobs")[:] == (1, 5)
+    assert "nodes" not in db.read_single("SELECT prompt FROM queue")[0]
+
+    # reassembled on read
+    exported = queue.get_full_queue("queue")
+    assert sorted(exported, key=lambda item: item[0]) == items
+
+    # released with the last item using it
+    queue.delete_items([item[1] for item in items[:4]])
+    assert db.read_single("SELECT refs FROM blobs")[0] == 1
+    queue.delete_items([items[4][1]])
+    assert db.read_single("SELECT COUNT(*) FROM blobs")[0] == 0
+
+
+def test_export_in_chunks(queue, make_item):
+    from src.comfyui_queue_manager.helpers import export_chunk
+
+    items = [make_item(number) for number in range(1, 8)]
+    items[0][5] = {"api_key_comfy_org": "secret"}
+    for item in items:
+        queue.queue_put(item)
+    assert run_next(queue) == 1
+    queue.queue_get(timeout=0.01)  # item 2 is running
+
+    # running first, then pending newest first
+    chunks = list(queue.iter_full_queue("queue", chunk_size=2))
+    assert [[item[0] for item in chunk] for chunk in chunks] == [[2], [7, 6], [5, 4], [3]]
+    assert [item for chunk in chunks for item in chunk] == queue.get_full_queue("queue")
+
+    completed = list(queue.iter_full_queue("completed", chunk_size=2))
+    assert completed == [[items[0]]]
+
+    encoded = b"[" + b"".join(export_chunk(chunk, first=i == 0) for i, chunk in enumerate(completed + chunks)) + b"]"
+    assert json.loads(encoded) == [items[i][:5] for i in (0, 1, 6, 5, 4, 3, 2)]
+    assert b"secret" not in encoded
+
+    lines = b"".join(export_chunk(chunk, ndjson=True) for chunk in chunks).splitlines()
+    assert [json.loads(line)[0] for line in lines] == [item[0] for chunk in chunks for item in chunk]
+
+
+def test_streaming_import_in_batches(queue, make_item, prompt_server, tmp_path):
+    from src.comfyui_queue_manager.helpers import iter_json_items
+
+    items = [make_item(number) for number in range(1, 6)]
+    upload = tmp_path / "import.ndjson"
+    upload.write_text("\n".join(json.dumps(item) for item in items + [items[0], "not an item"]) + "\n")
+
+    with open(upload, "rb") as file:
+        assert queue.import_queue(iter_json_items(file, 16), None, 3, batch_size=2) == (5, 7)
+
+    # the first progress event is sent right away, the rest within the notification window is merged into one
+    queue.notifier.flush()
+    progress = [data for event, data in prompt_server.messages if event == "queue-manager-queue-updated"]
+    assert progress == [
+        {"total_imported": 2, "submitted": 2, "done": False},
+        {"total_imported": 5, "submitted": 7, "done": True},
+    ]
+    assert sorted(item[1] for item in queue.get_full_queue("archive")) == sorted(item[1] for item in items)
+
+    upload.write_text(json.dumps(items, indent=2))
+    with open(upload, "rb") as file:
+        assert [item[1] for item in iter_json_items(file, 16)] == [item[1] for item in items]
+
+
+def test_import_progress_is_always_done(queue, make_item, prompt_server, tmp_path):
+    from src.comfyui_queue_manager.helpers import iter_json_items
+
+    items = [make_item(number) for number in range(1, 3)]
+    assert queue.import_queue(items, None, 3) == (2, 2)
+    queue.notifier.flush()
+
+    # only duplicates, more than one batch
+    prompt_server.messages.clear()
+    assert queue.import_queue(items, None, 3, batch_size=1) == (0, 2)
+    queue.notifier.flush()
+    progress = [data for event, data in prompt_server.messages if event == "queue-manager-queue-updated"]
+    assert progress[-1] == {"total_imported": 0, "submitted": 2, "done": True}
+
+    # malformed JSON after the first batch
+    upload = tmp_path / "import.ndjson"
+    upload.write_text(json.dumps(make_item(3)) + "\n{broken\n")
+    prompt_server.messages.clear()
+    with open(upload, "rb") as file, pytest.raises(json.JSONDecodeError):
+        queue.import_queue(iter_json_items(file, 16), None, 3, batch_size=1)
+    queue.notifier.flush()
+    progress = [data for event, data in prompt_server.messages if event == "queue-manager-queue-updated"]
+    assert progress[-1] == {"total_imported": 1, "submitted": 1, "done": True}
+
+
+def test_import_duplicates_leave_no_orphan_blobs(db, queue, make_item):
+    item = make_item(1)
+    assert queue.import_queue([item], "client", 3) == (1, 1)
+    assert queue.import_queue([item, make_item(2, "workflow-b")], "client", 3) == (1, 2)
+
+    assert db.read_single("SELECT COUNT(*), SUM(refs) FROM blobs")[:] == (2, 2)
+
+
+def test_workflow_blobs_migration(db, make_item):
+    from src.comfyui_queue_manager.qm_blobs import unpack_item
+
+    # item stored before workflows were moved to blobs
+    item = make_item(1)
+    db.write_query("INSERT INTO queue (prompt_id, number, prompt) VALUES (?, ?, ?)", (item[1], 1, json.dumps(item)))
+    db.write_query("PRAGMA user_version = 1")
+    db.init_schema()
+
+    row = db.read_single("SELECT prompt, workflow_hash FROM queue")
+    assert row[1] is not None
+    assert unpack_item(row[0]) == item
+    assert db.read_single("SELECT refs FROM blobs WHERE hash = ?", (row[1],))[0] == 1
+
+
+def test_concurrent_migrations(tmp_path, monkeypatch):
+    import threading
+
+    from src.comfyui_queue_manager import qm_db
+
+    applied = []
+
+    def migrate_slowly(conn):
+        applied.append(threading.current_thread().name)
+        for statement in qm_db.split_statements("CREATE TABLE extra (id INTEGER);\nCREATE INDEX idx_extra ON extra (id);\n"):
+            conn.execute(statement)
+        time.sleep(0.2)  # the other instance tries to migrate meanwhile
+
+    monkeypatch.setattr(qm_db, "MIGRATIONS", qm_db.MIGRATIONS + [migrate_slowly])
+    monkeypatch.setattr(qm_db, "DB_PATH", tmp_path / "shared.db")
+    # two instances starting together on a new database
+    conns = [qm_db.connect(), qm_db.connect()]
+    barrier = threading.Barrier(len(conns))
+    errors = []
+
+    def start(conn):
+        barrier.wait()
+        try:
+            qm_db.create_schema(conn)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start, args=(conn,)) for conn in conns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(applied) == 1
+    for conn in conns:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(qm_db.MIGRATIONS)
+        conn.close()
+
+
+def test_failed_migration_is_rolled_back(db, monkeypatch):
+    version = db.read_single("PRAGMA user_version")[0]
+
+    def migrate_broken(conn):
+        conn.execute("CREATE TABLE extra (id INTEGER)")
+        raise sqlite3.OperationalError("crashed half way")
+
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS + [migrate_broken])
+    with pytest.raises(sqlite3.OperationalError, match="half way"):
+        db.init_schema()
+    assert db.read_single("PRAGMA user_version")[0] == version
+    assert db.read_single("SELECT 1 FROM sqlite_master WHERE name = 'extra'") is None
+
+
+def test_status_counters_follow_changes(db, queue, make_item):
+    def counted():
+        return {(row[0], row[1]): row[2] for row in db.read_query("SELECT status, workflow_id, total FROM queue_stats WHERE total != 0")}
+
+    def actual():
+        rows = db.read_query("SELECT status, '', COUNT(*) FROM queue GROUP BY status")
+        rows += db.read_query("SELECT status, workflow_id, COUNT(*) FROM queue GROUP BY status, workflow_id")
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    for number in range(1, 9):
+        queue.queue_put(make_item(number, "workflow-a" if number % 2 else "workflow-b"))
+    assert counted() == actual()
+
+    item, task_id = queue.queue_get(timeout=0.1)
+    assert queue.get_tasks_remaining() == 8
+    queue.task_done(task_id, {}, None)
+    assert queue.get_tasks_remaining() == 7
+    assert counted() == actual()
+
+    queue.archive_queue({"workflow": {"value": "workflow-b"}})
+    queue.delete_items([make_item(9)[1], item[1]])
+    queue.import_queue([make_item(10, "workflow-c")], "client", 3)
+    assert counted() == actual()
+
+    running, pending, info = queue.get_current_queue(0, 2, route="archive", filters={"workflow": {"value": "workflow-b"}}, return_meta=True)
+    assert info["total"] == 4
+
+
+def run_next(queue):
+    """Pick up next item like ComfyUI's worker does and finish it."""
+    got = queue.queue_get(timeout=0.01)
+    if got is None:
+        return None
+    queue.task_done(got[1], {}, None)
+    return got[0][0]
+
+
+def test_items_run_in_priority_order(queue, make_item):
+    for number in [5, 1, 3, 2, 4]:
+        queue.queue_put(make_item(number))
+
+    assert [run_next(queue) for _ in range(6)] == [5, 1, 2, 3, 4, None]
+
+
+def test_pause_front_insertion_and_deletes(queue, make_item, prompt_server):
+    queue.pending.prefetch = 2
+    items = [make_item(number) for number in range(1, 7)]
+    for item in items:
+        queue.queue_put(item)
+    assert run_next(queue) == 1
+
+    queue.delete_items([items[1][1]])
+    queue.archive_items([queue.get_current_queue(0, 1, cursor=[], summary=True)[1][0]["db_id"]])  # item 3
+
+    queue.toggle_playback()
+    assert queue.queue_get(timeout=0.01) is None
+    queue.toggle_playback()
+
+    archived = queue.get_current_queue(0, 1, route="archive", cursor=[], summary=True)[1][0]
+    prompt_server.number = 100
+    queue.play_items([archived["db_id"]], True, "client")  # back to the front
+
+    assert [run_next(queue) for _ in range(5)] == [3, 4, 5, 6, None]
+
+
+def test_batched_commits(db, queue, make_item):
+    db.configure_writer("batched", 60_000)
+    items = [make_item(number) for number in range(1, 4)]
+    for item in items:
+        queue.queue_put(item)
+    assert run_next(queue) == 1
+
+    # uncommitted, but visible to the queue manager itself
+    other = sqlite3.connect(db.DB_PATH)
+    assert other.execute("SELECT COUNT(*) FROM queue").fetchone()[0] == 0
+    assert queue.get_tasks_remaining() == 2
+    assert queue.get_current_queue(0, 10, route="completed", cursor=[], summary=True)[1][0]["prompt_id"] == items[0][1]
+
+    db.get_writer().flush()
+    assert other.execute("SELECT status FROM queue ORDER BY number").fetchall() == [(2,), (0,), (0,)]
+
+    # commits are grouped within the delay
+    db.configure_writer("batched", 10)
+    assert run_next(queue) == 2
+    for _ in range(100):
+        if other.execute("SELECT status FROM queue WHERE number = 2").fetchone()[0] == 2:
+            break
+        time.sleep(0.01)
+    assert other.execute("SELECT status FROM queue WHERE number = 2").fetchone()[0] == 2
+
+
+def test_batched_crash_recovery(db, queue_manager, make_item, prompt_server):
+    from src.comfyui_queue_manager.qm_queue import QM_Queue
+
+    queue = queue_manager.queue
+    for number in range(1, 4):
+        queue.queue_put(make_item(number))
+    db.configure_writer("batched", 60_000)
+    got = queue.queue_get(timeout=0.01)
+    db.get_writer().flush()
+    queue.task_done(got[1], {}, None)
+    assert db.read_single("SELECT status FROM queue WHERE number = 1")[0] == 2
+
+    # crash: the uncommitted "finished" transition of item 1 is lost, it's running as far as the database knows
+    writer = db.get_writer()
+    writer.connection().rollback()
+    writer.dirty, writer.writes = False, 0
+    assert db.read_single("SELECT status FROM queue WHERE number = 1")[0] == 1
+
+    prompt_server.__init__()
+    restarted = QM_Queue(queue_manager)
+    restarted.restore_queue(True)
+    assert [run_next(restarted) for _ in range(4)] == [1, 2, 3, None]
+    queue.notifier.flush()
+    restarted.notifier.flush()
+
+
+def test_bulk_selections(db, queue, make_item, prompt_server):
+    import pytest
+    from src.comfyui_queue_manager.inc.exceptions import BadSelectionException
+
+    for number in range(1, 9):
+        queue.queue_put(make_item(number, *(("workflow-a", "Workflow A") if number % 2 else ("workflow-b", "Workflow B"))))
+    ids = {row[1]: row[0] for row in db.read_query("SELECT id, number FROM queue")}
+    workflow_b = {"workflow": {"type": "workflow", "value": "workflow-b", "valueLabel": "Workflow B"}}
+
+    # everything of workflow B except item 4
+    prompt_server.messages.clear()
+    assert queue.archive_selection({"route": "queue", "filters": workflow_b, "exclude": [ids[4]]}) == 3
+    assert [event for event, data in prompt_server.messages] == ["queue-manager-queue-updated"]
+    assert [row[0] for row in db.read_query("SELECT number FROM queue WHERE status = 3 ORDER BY number")] == [2, 6, 8]
+
+    assert queue.delete_selection({"ids": [ids[1], ids[2]]}) == 2
+    assert queue.delete_selection({"route": "archive"}) == 2
+
+    # moved to the front as if played one by one: the last one given runs first
+    queue.archive_items([ids[3], ids[5]])
+    prompt_server.number = 100
+    assert queue.play_items([ids[5], ids[3]], True, "new-client") == 2
+    assert [run_next(queue) for _ in range(5)] == [3, 5, 4, 7, None]
+    played = [item for item in queue.get_full_queue("completed") if item[0] in (3, 5)]
+    assert [(item[3]["client_id"], len(item)) for item in played] == [("new-client", 6), ("new-client", 6)]
+
+    with pytest.raises(BadSelectionException):
+        queue.delete_selection({"ids": "1,2"})
+
+
+def test_play_archive_oldest_first(db, queue, make_item, prompt_server):
+    for number in range(1, 5):
+        queue.queue_put(make_item(number))
+    queue.archive_queue()
+    db.write_query("UPDATE queue SET updated_at = 10 - number")
+    prompt_server.number = 100
+
+    assert queue.play_archive("new-client") == 4
+    assert prompt_server.number == 104
+    rows = db.read_query("SELECT number, client_id, prompt FROM queue WHERE status = 0 ORDER BY number")
+    prompts = [json.loads(row[2]) for row in rows]
+    assert [row[0] for row in rows] == [prompt[0] for prompt in prompts] == [101, 102, 103, 104]
+    assert [prompt[2]["3"]["inputs"]["seed"] for prompt in prompts] == [4, 3, 2, 1]
+    assert {row[1] for row in rows} == {prompt[3]["client_id"] for prompt in prompts} == {"new-client"}
+
+
+def test_search_filter(db, queue, make_item):
+    from src.comfyui_queue_manager.helpers import search_query
+
+    items = [make_item(number, name=f"Workflow {number}") for number in range(1, 5)]
+    items[1][2]["4"]["inputs"]["ckpt_name"] = "juggernautXL_v9.safetensors"
+    items[2][2]["4"]["inputs"]["ckpt_name"] = "juggernautXL_v9.safetensors"
+    items[2][2]["6"]["inputs"]["text"] = "a landscape at dawn"
+    queue.import_queue(items, None, 3)
+
+    numbers = {item[1]: number for number, item in enumerate(items, 1)}
+    found = lambda text: sorted(
+        numbers[item[1]] for chunk in queue.iter_full_queue("archive", {"search": {"value": text}}) for item in chunk
+    )
+    assert found("juggernautXL portrait") == [2]
+    assert found("jugger*") == [2, 3]
+    assert found("nodes:CLIPTextEncode") == [1, 2, 3, 4]
+    assert found('inputs:landscape "Workflow') == [3]
+    assert found("name:workflow 4") == [4]
+    assert found("   ") == [1, 2, 3, 4]
+    assert search_query('a"b OR') == '"ab" "OR"'
+
+    # the index follows updates and deletes, the search filter works for bulk operations as well
+    archive = queue.get_current_queue(0, 10, route="archive", return_meta=True, summary=True)[1]
+    ids = {numbers[summary["prompt_id"]]: summary["db_id"] for summary in archive}
+    queue.play_items([ids[2]], False, "new-client")
+    assert found("juggernautXL") == [3]
+    assert [
+        numbers[summary["prompt_id"]]
+        for summary in queue.get_current_queue(0, 10, filters={"search": {"value": "juggernautXL"}}, return_meta=True, summary=True)[1]
+    ] == [2]
+    assert queue.delete_selection({"route": "archive", "filters": {"search": {"value": "dawn"}}}) == 1
+    assert found("juggernautXL") == []
+    assert db.read_single("SELECT COUNT(*) FROM queue_fts WHERE queue_fts MATCH 'juggernautXL'")[0] == 1
+
+
+def test_facets_follow_changes_and_repair(db, queue, make_item):
+    for number in range(1, 6):
+        queue.queue_put(
+            make_item(
+                number, *(("workflow-a", "Workflow A") if number % 2 else ("workflow-b", "Workflow B")), client_id=f"client-{number % 2}"
+            )
+        )
+    item, task_id = queue.queue_get(timeout=0.1)
+    queue.task_done(task_id, {}, None)
+    queue.archive_queue({"workflow": {"value": "workflow-b"}})
+
+    facets = queue.get_facets()
+    assert facets["workflow"] == [
+        {"value": "workflow-a", "label": "Workflow A", "total": 3, "statuses": {"pending": 2, "completed": 1}},
+        {"value": "workflow-b", "label": "Workflow B", "total": 2, "statuses": {"archived": 2}},
+    ]
+    assert [(group["value"], group["total"]) for group in queue.get_facets(["client"], 3)["client"]] == [("client-0", 2)]
+    assert sum(group["total"] for group in facets["day"]) == 5
+    assert queue.repair_facets() == {"queue_facets": 0, "queue_stats": 0}
+
+    # counters edited behind the triggers' back are reconciled with the queue table
+    db.write_query("UPDATE queue_facets SET total = 7 WHERE facet = 'client'")
+    db.write_query("DELETE FROM queue_stats WHERE workflow_id = 'workflow-b'")
+    assert queue.repair_facets() == {"queue_facets": 5, "queue_stats": 1}  # including the emptied client groups
+    assert queue.get_facets() == facets
+    assert queue.repair_facets() == {"queue_facets": 0, "queue_stats": 0}
+
+
+def test_retention_moves_items_to_cold_tier(db, queue, make_item):
+    from src.comfyui_queue_manager.inc.exceptions import BadRouteException
+
+    items = [make_item(number) for number in range(5)]
+    queue.import_queue(items, None, 3)
+    queue.retention = {"completed": (0, 0), "archive": (0, 2)}
+
+    assert queue.expire_items(batch_size=2) == 3
+    assert queue.get_status_counts()[3] == 2
+    assert db.read_single("SELECT COUNT(*) FROM cold.queue")[0] == 3
+    assert db.read_single("SELECT COUNT(*) FROM blobs")[0] == 1  # still used by the hot items
+    assert queue.repair_facets() == {"queue_facets": 0, "queue_stats": 0}
+
+    # the oldest items went cold, they are listed, fetched and exported like hot ones
+    cold = [items[0][1], items[1][1], items[2][1]]
+    _, pending, info = queue.get_current_queue(0, 10, "archive", return_meta=True, summary=True, tier="cold")
+    assert info["total"] == 3 and [item["prompt_id"] for item in pending] == cold
+    _, pending, info = queue.get_current_queue(0, 2, "archive", return_meta=True, cursor=[], tier="cold")
+    assert [item[1] for item in pending] == cold[:2] and info["next_cursor"] is not None
+    item = queue.get_item(pending[0][3]["db_id"], "cold")
+    assert item[3]["extra_pnginfo"]["workflow"] == items[0][3]["extra_pnginfo"]["workflow"]
+    assert sorted(item[1] for item in queue.get_full_queue("archive", tier="cold")) == sorted(cold)
+    with pytest.raises(BadRouteException):
+        queue.get_current_queue(0, 10, "queue", tier="cold")
+    with pytest.raises(BadRouteException):
+        queue.iter_full_queue("queue", tier="cold")  # before the export response starts streaming
+
+    # played items come back to the hot queue with their id
+    db_id = pending[1][3]["db_id"]
+    assert queue.play_items([db_id], False, "client-b", "cold") == 1
+    assert queue.get_item(db_id)[3]["client_id"] == "client-b"
+    assert queue.get_status_counts()[0] == 1
+    assert queue.get_item(db_id, "cold") is None
+
+    assert queue.delete_from_queue("archive", tier="cold") == 2
+    assert queue.repair_facets() == {"queue_facets": 0, "queue_stats": 0}
+
+
+def test_restore_from_cold_keeps_conflicting_items(db, queue, make_item):
+    items = [make_item(number) for number in range(3)]
+    queue.import_queue(items, None, 3)
+    queue.retention = {"completed": (0, 0), "archive": (0, 1)}
+    assert queue.expire_items() == 2
+    cold_ids = [row[0] for row in db.read_query("SELECT id FROM cold.queue ORDER BY id")]
+
+    # the first one was queued again since it went cold
+    queue.queue_put(items[0])
+    assert queue.restore_from_cold(cold_ids) == 1
+    assert [row[0] for row in db.read_query("SELECT id FROM cold.queue")] == [cold_ids[0]]
+    assert queue.get_item(cold_ids[1])[1] == items[1][1]
+    assert queue.get_item(cold_ids[0], "cold")[1] == items[0][1]  # not lost
+
+
+def test_retention_by_age(db, queue, make_item):
+    queue.import_queue([make_item(number) for number in range(3)], None, 3)
+    db.write_query("UPDATE queue SET status = 2, updated_at = datetime('now', '-10 days') WHERE id = 1")
+    db.write_query("UPDATE queue SET status = 2 WHERE id = 2")
+    queue.retention = {"completed": (7, 0), "archive": (0, 0)}
+
+    assert queue.expire_items() == 1
+    assert [row[0] for row in db.read_query("SELECT id FROM cold.queue WHERE status = 2")] == [1]
+    assert queue.get_status_counts()[2] == 1 and queue.get_status_counts()[3] == 1
+    assert queue.expire_items() == 0
@@ -0,0 +1,107 @@
+"""Tests for several queue manager instances sharing one queue database."""
+
+import json
+import os
+import subprocess
+import sys
+
+
+def make_worker(queue_manager, prompt_server, monkeypatch, worker_id):
+    from src.comfyui_queue_manager.qm_queue import QM_Queue
+
+    monkeypatch.setenv("QM_SHARED_QUEUE", "1")
+    monkeypatch.setenv("QM_WORKER_ID", worker_id)
+    prompt_server.__init__()
+    return QM_Queue(queue_manager)
+
+
+def test_claims_and_leases(db, queue_manager, make_item, prompt_server, monkeypatch):
+    worker_a = make_worker(queue_manager, prompt_server, monkeypatch, "a")
+    for number in range(1, 4):
+        worker_a.queue_put(make_item(number))
+    assert worker_a.native_queue.queue == []  # pending items stay in the database until claimed
+
+    got_a = worker_a.queue_get(timeout=0.01)
+    assert got_a[0][0] == 1
+    worker_b = make_worker(queue_manager, prompt_server, monkeypatch, "b")
+    got_b = worker_b.queue_get(timeout=0.01)
+    assert got_b[0][0] == 2
+    rows = db.read_query("SELECT number, worker_id, lease_expires_at FROM queue WHERE status = 1 ORDER BY number")
+    assert [(row[0], row[1]) for row in rows] == [(1, "a"), (2, "b")]
+    assert all(row[2] is not None for row in rows)
+
+    # worker a hangs: its lease runs out and item 1 goes back to pending for the others
+    db.write_query("UPDATE queue SET lease_expires_at = 0 WHERE worker_id = 'a'")
+    assert worker_b.reclaim_expired() == 1
+    assert worker_b.extend_leases() == 1
+    got_b2 = worker_b.queue_get(timeout=0.01)
+    assert got_b2[0][1] == got_a[0][1]
+
+    # the late result of worker a doesn't finish the item worker b runs now, nor tells the clients it did
+    revision = worker_a.revision
+    worker_a.task_done(got_a[1], {}, None)
+    assert db.read_single("SELECT status, worker_id FROM queue WHERE number = 1")[:] == (1, "b")
+    assert worker_a.revision == revision
+    worker_b.task_done(got_b2[1], {}, None)
+    assert db.read_single("SELECT status, lease_expires_at FROM queue WHERE number = 1")[:] == (2, None)
+
+    # a restart only restores the items of its own worker
+    restarted_a = make_worker(queue_manager, prompt_server, monkeypatch, "a")
+    restarted_a.restore_queue(True)
+    assert db.read_single("SELECT status FROM queue WHERE number = 2")[0] == 1
+    restarted_b = make_worker(queue_manager, prompt_server, monkeypatch, "b")
+    restarted_b.restore_queue(True)
+    assert db.read_single("SELECT status, worker_id FROM queue WHERE prompt_id = ?", (got_b[0][1],))[:] == (0, None)
+    assert restarted_a.queue_get(timeout=0.01)[0][1] == got_b[0][1]  # ahead of item 3
+
+    for worker in (worker_a, worker_b, restarted_a, restarted_b):
+        worker.notifier.flush()
+
+
+def test_worker_processes_drain_queue(db, queue, make_item):
+    items = [make_item(number) for number in range(1, 121)]
+    queue.import_queue(items, None, 0)
+    db.get_writer().flush()
+
+    worker = os.path.join(os.path.dirname(__file__), "shared_worker.py")
+    processes = [
+        subprocess.Popen(
+            [sys.executable, worker, "0.001"],
+            env={**os.environ, "QM_DB_PATH": str(db.DB_PATH), "QM_SHARED_QUEUE": "1", "QM_WORKER_ID": f"worker-{i}"},
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        for i in range(3)
+    ]
+    ran = [json.loads(process.communicate(timeout=60)[0]) for process in processes]
+
+    prompt_ids = [prompt_id for worker_ran in ran for prompt_id in worker_ran]
+    assert sorted(prompt_ids) == sorted(item[1] for item in items)  # every item ran exactly once
+    assert db.read_single("SELECT COUNT(*) FROM queue WHERE status = 2")[0] == len(items)
+    workers = {row[0] for row in db.read_query("SELECT DISTINCT worker_id FROM queue")}
+    assert workers <= {"worker-0", "worker-1", "worker-2"}
+
+
+def test_heartbeat_notices_other_workers(db, queue_manager, make_item, prompt_server, monkeypatch):
+    import sqlite3
+
+    from src.comfyui_queue_manager.qm_shared import QM_Heartbeat
+
+    worker = make_worker(queue_manager, prompt_server, monkeypatch, "a")
+    heartbeat = QM_Heartbeat(worker)
+    heartbeat.poll()
+    revision = worker.revision
+
+    # another instance sharing the database changes the queue
+    conn = sqlite3.connect(db.DB_PATH)
+    conn.execute("UPDATE queue SET status = 0 WHERE status = 1")
+    conn.execute("INSERT INTO options (key, value) VALUES ('other', '1')")
+    conn.commit()
+    conn.close()
+
+    heartbeat.poll()
+    assert worker.revision == revision + 1
+    heartbeat.poll()
+    assert worker.revision == revision + 1
+    heartbeat.stop()
+    worker.notifier.flush()
@@ -233,6 +233,10 @@ app.registerExtension({
       postStatusMessageToIframe(e)
     })
 
+    app.api.addEventListener("queue-manager-queue-delta", function (e) {
+      postStatusMessageToIframe(e)
+    })
+
 
 
     // Pass parent's key events to iframe